@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import argparse
+import copy
+import glob
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import vviz
+from cache import AnalysisCache
+from report import analysis_rows, write_report
+
+
+# video files matching the inputs (directories, files or glob patterns), in order and without duplicates
+def find_files(inputs, pattern='*.mp4', recursive=False):
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            if recursive:
+                matches = glob.glob(os.path.join(path, '**', pattern), recursive=True)
+            else:
+                matches = glob.glob(os.path.join(path, pattern))
+        else:
+            matches = glob.glob(path, recursive=recursive)
+        for match in sorted(matches):
+            if os.path.isfile(match) and match not in files:
+                files.append(match)
+    return files
+
+
+# Analysis of a single file, run in a worker process.
+# Returns one summary row per video stream, or a single row with the error.
+def analyse_file(path, args):
+    args = copy.copy(args)
+    args.path_to_file = path
+    # files are analysed in parallel, each with a single ffprobe process
+    args.workers = 1
+
+    try:
+        cache = None if args.no_cache else AnalysisCache(directory=args.cache_dir, max_size=args.cache_size * 1000000)
+        streams, track = vviz.read_streams_and_track(args, cache)
+
+        rows = analysis_rows(path, streams, track, peak_windows=args.window)
+
+        if args.charts:
+            vviz.chart_streams(streams, track, args, auto_open=False)
+        return rows
+    except Exception as e:
+        return [OrderedDict([('file', path), ('error', str(e))])]
+
+
+def analyse_files(files, args, jobs=None):
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(analyse_file, path, args): path for path in files}
+        for count, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            results[path] = future.result()
+            status = results[path][0].get('error', 'done')
+            print("[{}/{}] {}: {}".format(count, len(files), path, status))
+
+    # rows in the order of the files
+    rows = []
+    for path in files:
+        rows += results[path]
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Batch analysis of video files, with a summary report '
+                                                 '(bitrates, GOPs and fragments) and optional charts')
+    parser.add_argument('inputs', nargs='+', help='video files, directories or glob patterns')
+    parser.add_argument('--pattern', dest='pattern',
+                        help='pattern of the files to analyse in directories (default: %(default)s)',
+                        default='*.mp4')
+    parser.add_argument('--recursive', dest='recursive', action='store_true',
+                        help='also look for files in sub-directories')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int,
+                        help='number of files analysed in parallel (default: number of cores)',
+                        default=os.cpu_count())
+    parser.add_argument('-o', '--output', dest='output',
+                        help='summary report file, in CSV or JSON (by extension) (default: %(default)s)',
+                        default='summary.csv')
+    parser.add_argument('--charts', dest='charts', action='store_true',
+                        help='also generate the charts of each file (see --formats)')
+    vviz.add_analysis_arguments(parser)
+
+    args = parser.parse_args()
+    vviz.check_analysis_arguments(parser, args)
+
+    files = find_files(args.inputs, pattern=args.pattern, recursive=args.recursive)
+    if not files:
+        raise Exception("No files found for {}".format(", ".join(args.inputs)))
+
+    print("Analysing {} files with {} jobs".format(len(files), args.jobs))
+    rows = analyse_files(files, args, jobs=args.jobs)
+
+    write_report(rows, args.output)
+    print("Summary written to {}".format(args.output))
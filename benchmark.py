@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from collections import OrderedDict
+
+import numpy as np
+import vviz
+from bitrate import BitrateCalculator
+from ffprobe_parser import FFProbeCompactReader, FFProbeResponse
+from mp4dump_parser import MP4DumpResponse
+from models import Stream, MP4Track, sizeof_fmt
+from profiler import Profiler
+
+# Benchmark of the analysis stages on synthetic ffprobe and mp4dump outputs, so that no ffprobe, mp4dump
+# or video file is needed. Results are written as JSON, to compare runs between commits (see --compare).
+
+SIZES = [10000, 100000, 1000000, 10000000]
+STAGES = ['parse_ffprobe', 'parse_ffprobe_compact', 'stream', 'parse_mp4dump', 'track',
+          'gops', 'bitrate', 'join', 'traces', 'html']
+
+TIME_BASE = 90000
+TIME_SCALE = 10000000
+
+# average frame sizes (bytes) by picture type
+FRAME_SIZES = {'I': 60000, 'P': 15000, 'B': 5000}
+
+
+# frames of a synthetic stream as (pts, size, pict_type, key_frame) arrays, in presentation order.
+# The GOP pattern repeats over the stream, each GOP starting with an IDR frame.
+def synthetic_frames(count, gop='IBBPBBPBBPBB', frame_rate=25, seed=0):
+    random = np.random.RandomState(seed)
+    indexes = np.arange(count)
+    pict_types = np.array(list(gop))[indexes % len(gop)]
+    sizes = np.zeros(count, dtype=np.int64)
+    for pict_type, size in FRAME_SIZES.items():
+        frames = pict_types == pict_type
+        sizes[frames] = size * random.uniform(0.5, 1.5, frames.sum())
+    pts = indexes * (TIME_BASE // frame_rate)
+    return pts, sizes, pict_types, indexes % len(gop) == 0
+
+
+def _stream_json(count, frame_rate):
+    return OrderedDict([('index', 0), ('codec_type', 'video'), ('width', 1920), ('height', 1080),
+                        ('avg_frame_rate', '{}/1'.format(frame_rate)), ('time_base', '1/{}'.format(TIME_BASE)),
+                        ('start_pts', 0), ('duration_ts', count * (TIME_BASE // frame_rate)),
+                        ('duration', '{:.6f}'.format(count / frame_rate))])
+
+
+# ffprobe -show_frames -show_streams -print_format json output
+def ffprobe_json(frames, frame_rate=25):
+    pts, sizes, pict_types, key_frames = frames
+    template = '{{"media_type":"video","stream_index":0,"key_frame":{},"pkt_pts":{},"pkt_size":"{}","pict_type":"{}"}}'
+    items = [template.format(int(key), p, s, t)
+             for p, s, t, key in zip(pts.tolist(), sizes.tolist(), pict_types.tolist(), key_frames.tolist())]
+    return '{{"frames":[{}],"streams":[{}]}}'.format(",".join(items), json.dumps(_stream_json(len(pts), frame_rate)))
+
+
+# ffprobe -print_format compact output, as read from the process (see FFProbeCommand)
+def ffprobe_compact_lines(frames, frame_rate=25):
+    pts, sizes, pict_types, key_frames = frames
+    template = "frame|media_type=video|stream_index=0|key_frame={}|pkt_pts={}|pkt_size={}|pict_type={}"
+    lines = [template.format(int(key), p, s, t)
+             for p, s, t, key in zip(pts.tolist(), sizes.tolist(), pict_types.tolist(), key_frames.tolist())]
+    lines.append("stream|" + "|".join("{}={}".format(k, v) for k, v in _stream_json(len(pts), frame_rate).items()))
+    return lines
+
+
+# mp4dump --format json --verbosity 1 output: one moof/mdat pair per fragment, with the samples in the trun entries
+def mp4dump_json(frames, frame_rate=25, fragment_duration=2.0):
+    sizes = frames[1]
+    sample_duration = TIME_SCALE // frame_rate
+    per_fragment = max(1, int(round(fragment_duration * frame_rate)))
+
+    boxes = [json.dumps(OrderedDict([
+        ('name', 'moov'), ('size', 0), ('children', [
+            {'name': 'mvhd', 'timescale': 1000, 'duration': len(sizes) * 1000 // frame_rate},
+            {'name': 'trak', 'children': [
+                {'name': 'tkhd', 'id': 1},
+                {'name': 'mdia', 'children': [{'name': 'mdhd', 'timescale': TIME_SCALE}]}]},
+            {'name': 'mvex', 'children': [
+                {'name': 'trex', 'track id': 1, 'default sample duration': 0, 'default sample size': 0,
+                 'default sample flags': 0}]}])])),
+        json.dumps({'name': 'sidx', 'timescale': TIME_SCALE})]
+
+    entry = '{{"d":{},"s":{}}}'.format
+    for sequence, start in enumerate(range(0, len(sizes), per_fragment), start=1):
+        samples = sizes[start:start + per_fragment].tolist()
+        boxes.append('{{"name":"moof","children":[{{"name":"mfhd","sequence number":{sequence}}},'
+                     '{{"name":"traf","children":[{{"name":"tfhd","track ID":1,"default sample duration":{duration}}},'
+                     '{{"name":"tfdt","base media decode time":{decode_time}}},'
+                     '{{"name":"trun","sample count":{count},"entries":[{entries}]}}]}}]}}'.format(
+                      sequence=sequence, duration=sample_duration, decode_time=start * sample_duration,
+                      count=len(samples), entries=",".join(entry(sample_duration, size) for size in samples)))
+        boxes.append('{{"name":"mdat","header_size":8,"size":{}}}'.format(sum(samples) + 8))
+    return "[{}]".format(",".join(boxes))
+
+
+def _commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        return output.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_result(record):
+    print("{frames:>10} {name:<22} wall {wall:8.3f}s  cpu {cpu:8.3f}s  peak {peak:>9}  rss {rss:>9}".format(
+        frames=record['frames'], name=record['name'], wall=record['wall'], cpu=record['cpu'],
+        peak=sizeof_fmt(record['peak_memory'], 'B') if record.get('peak_memory') is not None else '-',
+        rss=sizeof_fmt(record['max_rss'], 'B') if record.get('max_rss') is not None else '-'))
+
+
+# runs the stages on a synthetic stream of `count` frames, and returns the stage records
+def run(count, stages=STAGES, gop='IBBPBBPBBPBB', frame_rate=25, fragment_duration=2.0, windows=(1.0,),
+        max_points=4000, trace_memory=True, seed=0):
+    profiler = Profiler(trace_memory=trace_memory)
+    frames = synthetic_frames(count, gop=gop, frame_rate=frame_rate, seed=seed)
+    if 'traces' in stages or 'html' in stages:
+        # imported once, outside of the measured stages
+        import plotly.graph_objs
+    stream = None
+    track = None
+
+    def stage(name):
+        return profiler.stage(name, frames=count)
+
+    # payloads are generated outside of the measured stages.
+    # The stream and track are built for the later stages, even if their own stages are not asked for.
+    later = set(stages) & {'gops', 'bitrate', 'join', 'traces', 'html'}
+    if 'parse_ffprobe' in stages or 'stream' in stages or (later and 'parse_ffprobe_compact' not in stages):
+        payload = ffprobe_json(frames, frame_rate)
+        with stage('parse_ffprobe'):
+            response = FFProbeResponse(json.loads(payload))
+            response.tables
+        del payload
+        with stage('stream'):
+            stream = Stream(origin=response, stream_index=0)
+        del response
+
+    if 'parse_ffprobe_compact' in stages:
+        lines = ffprobe_compact_lines(frames, frame_rate)
+        with stage('parse_ffprobe_compact'):
+            response = FFProbeCompactReader().read(lines)
+        del lines
+        if stream is None:
+            stream = Stream(origin=response, stream_index=0)
+        del response
+
+    if 'parse_mp4dump' in stages or 'track' in stages or 'join' in stages:
+        payload = mp4dump_json(frames, frame_rate, fragment_duration)
+        with stage('parse_mp4dump'):
+            boxes = json.loads(payload)
+        del payload
+        with stage('track'):
+            track = MP4Track(parser=MP4DumpResponse(boxes))
+        del boxes
+
+    if stream is not None:
+        if 'gops' in stages:
+            with stage('gops'):
+                stream.gop_table
+        if 'bitrate' in stages:
+            with stage('bitrate'):
+                bitrates = BitrateCalculator.from_stream(stream)
+                bitrates.average()
+                for window in windows:
+                    bitrates.peak(window)
+        if 'join' in stages and track is not None:
+            with stage('join'):
+                track.join_frames(stream)
+
+        if 'traces' in stages or 'html' in stages:
+            track = track or MP4Track()
+            with stage('traces'):
+                data = vviz.get_chart_data(stream, track, windows, max_points=max_points)
+                labels = stream.to_label(peak_windows=windows), track.to_label()
+            if 'html' in stages:
+                with tempfile.TemporaryDirectory() as directory, stage('html') as record:
+                    file = os.path.join(directory, 'benchmark')
+                    vviz.plot_data(data, file, title='benchmark',
+                                   time_range=(stream.frames[0].start_time, stream.frames[-1].end_time),
+                                   stream_label=labels[0], track_label=labels[1], resolution=[1200, 600],
+                                   formats=['interactive'], auto_open=False)
+                    record['html_size'] = os.path.getsize(file + '.html')
+
+    del stream, track
+    gc.collect()
+    # some stages are run to prepare the ones asked for
+    return [record for record in profiler.stages if record['name'] in stages]
+
+
+# Times the stages, then measures their memory in a second run (tracemalloc slows allocations down too much
+# for the timings to be meaningful)
+def benchmark(count, trace_memory=True, **params):
+    results = run(count, trace_memory=False, **params)
+    if trace_memory:
+        peaks = {record['name']: record['peak_memory'] for record in run(count, trace_memory=True, **params)}
+        for record in results:
+            record['peak_memory'] = peaks.get(record['name'])
+    return results
+
+
+# wall time of the stages compared with a previous run
+def compare(results, baseline):
+    previous = {(r['frames'], r['name']): r for r in baseline['results']}
+    print()
+    print("Compared with {} ({}):".format(baseline['metadata'].get('commit'), baseline['metadata'].get('date')))
+    for record in results:
+        old = previous.get((record['frames'], record['name']))
+        if old and old['wall'] > 0:
+            ratio = record['wall'] / old['wall']
+            print("{frames:>10} {name:<22} {old:8.3f}s -> {new:8.3f}s  x{ratio:.2f}{flag}".format(
+                frames=record['frames'], name=record['name'], old=old['wall'], new=record['wall'], ratio=ratio,
+                flag="  SLOWER" if ratio > 1.2 else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark of the analysis stages on synthetic ffprobe and mp4dump '
+                                                 'outputs, with time and memory per stage')
+    parser.add_argument('--sizes', dest='sizes', type=int, nargs='+',
+                        help='number of frames of the synthetic streams (default: %(default)s)',
+                        default=SIZES)
+    parser.add_argument('--stages', dest='stages', nargs='+', choices=STAGES,
+                        help='stages to run (default: all)',
+                        default=STAGES)
+    parser.add_argument('--gop', dest='gop',
+                        help='picture types of a GOP, repeated over the stream (default: %(default)s)',
+                        default='IBBPBBPBBPBB')
+    parser.add_argument('--frame-rate', dest='frame_rate', type=int,
+                        help='frame rate of the synthetic streams (default: %(default)s)',
+                        default=25)
+    parser.add_argument('--fragment-duration', dest='fragment_duration', type=float,
+                        help='duration (in seconds) of the fragments (default: %(default)s)',
+                        default=2.0)
+    parser.add_argument('--max-points', dest='max_points', type=int,
+                        help='see vviz --max-points (default: %(default)s)',
+                        default=4000)
+    parser.add_argument('--no-tracemalloc', dest='trace_memory', action='store_false',
+                        help='do not measure the memory allocated by each stage, which needs a second run '
+                             '(only the peak RSS is given)')
+    parser.add_argument('-o', '--output', dest='output',
+                        help='results file (default: %(default)s)',
+                        default='benchmark.json')
+    parser.add_argument('--compare', dest='compare',
+                        help='results file of a previous run, to compare with')
+    args = parser.parse_args()
+
+    if args.gop[0] != 'I' or set(args.gop) - set(FRAME_SIZES):
+        raise Exception("GOP pattern should start with I and only contain I, P and B")
+
+    metadata = OrderedDict([
+        ('commit', _commit()),
+        ('date', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('platform', platform.platform()),
+        ('gop', args.gop),
+        ('frame_rate', args.frame_rate),
+        ('fragment_duration', args.fragment_duration),
+        ('max_points', args.max_points),
+        ('tracemalloc', args.trace_memory),
+    ])
+
+    results = []
+    for count in args.sizes:
+        print("Benchmark with {} frames".format(count))
+        for record in benchmark(count, stages=args.stages, gop=args.gop, frame_rate=args.frame_rate,
+                                fragment_duration=args.fragment_duration, max_points=args.max_points,
+                                trace_memory=args.trace_memory):
+            _print_result(record)
+            results.append(record)
+
+    with open(args.output, 'w') as f:
+        json.dump(OrderedDict([('metadata', metadata), ('results', results)]), f, indent=2)
+    print("Results written to {}".format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,134 @@
+import numpy as np
+
+
+# Time-based bitrate calculations on frame start times (in seconds) and sizes (in bits).
+# All window sums are differences of a single prefix sum of the frame sizes, so any number of
+# windows can be computed without going back to the frames, and without assuming a constant frame rate.
+# When only parts of the stream were analysed (sampled overview), intervals gives the (start, end) times
+# that were covered: rates are then computed over the covered time only.
+# With durations (eg. of GOPs, when only keyframes were read), the bits of each item are spread evenly over its
+# duration instead of counting at its start, so that windows shorter than an item get their share of it.
+class BitrateCalculator(object):
+    def __init__(self, times, sizes, end_time=None, intervals=None, durations=None):
+        times = np.asarray(times, dtype=np.float64)
+        sizes = np.asarray(sizes, dtype=np.float64)
+        if durations is not None:
+            durations = np.asarray(durations, dtype=np.float64)
+
+        if len(times) > 1 and np.any(np.diff(times) < 0):
+            order = np.argsort(times, kind='mergesort')
+            times = times[order]
+            sizes = sizes[order]
+            if durations is not None:
+                durations = durations[order]
+
+        self._times = times
+        self._sizes = sizes
+        self._cumsum = np.concatenate(([0.0], np.cumsum(sizes)))
+
+        # cumulative bits at the start and end of each item, interpolated in between
+        self._spread = None
+        if durations is not None and len(times):
+            self._spread = (np.column_stack((times, times + durations)).ravel(),
+                            np.column_stack((self._cumsum[:-1], self._cumsum[1:])).ravel())
+
+        if end_time is None:
+            # last frame lasts as long as the one before it (no frames, eg. in an interval without video)
+            end_time = times[-1] + (times[-1] - times[-2] if len(times) > 1 else 0) if len(times) else 0.0
+        self._end_time = end_time
+
+        if not intervals:
+            intervals = [(self.start_time, end_time)]
+        intervals = np.array(sorted(intervals), dtype=np.float64).reshape(-1, 2)
+        self._interval_starts = intervals[:, 0]
+        self._interval_ends = intervals[:, 1]
+        self._covered = np.concatenate(([0.0], np.cumsum(self._interval_ends - self._interval_starts)))
+
+    @classmethod
+    def from_stream(cls, stream):
+        # with keyframes only, bitrates are computed per GOP, the size of each GOP being spread over its duration
+        if stream.keyframes_only:
+            gops = stream.gop_table
+            times = stream.start_seconds(gops['start_pts'])
+            end_time = times[-1] + gops['duration'][-1] if len(times) else None
+            return cls(times, gops['size'], end_time=end_time, intervals=stream.samples, durations=gops['duration'])
+
+        times = stream.start_seconds()
+        end_time = times[-1] + float(1 / stream.frame_rate) if len(times) else None
+        return cls(times, stream.table.size * 8, end_time=end_time, intervals=stream.samples)
+
+    @property
+    def times(self):
+        return self._times
+
+    @property
+    def start_time(self):
+        return self._times[0] if len(self._times) else 0.0
+
+    @property
+    def end_time(self):
+        return self._end_time
+
+    # index of the interval that contains each time (or precedes it, in a gap)
+    def _interval_of(self, t):
+        return np.clip(np.searchsorted(self._interval_starts, t, side='right') - 1, 0, len(self._interval_starts) - 1)
+
+    # analysed time from the start of the stream to each time
+    def covered_time(self, t):
+        t = np.asarray(t, dtype=np.float64)
+        idx = self._interval_of(t)
+        inside = np.clip(t - self._interval_starts[idx], 0, self._interval_ends[idx] - self._interval_starts[idx])
+        return self._covered[idx] + inside
+
+    # number of frames before each time. Sorted times (eg. the windows of all frames) are merged with the frame times
+    # in a single linear pass (a stable sort of two sorted runs), others are searched one by one.
+    def _count_before(self, t):
+        t = np.asarray(t, dtype=np.float64)
+        if t.ndim != 1 or np.any(np.diff(t) < 0):
+            return np.searchsorted(self._times, t, side='left')
+        # times come first, so that frames at the same time are not counted
+        order = np.argsort(np.concatenate((t, self._times)), kind='stable')
+        return np.flatnonzero(order < len(t)) - np.arange(len(t))
+
+    # number of bits in [start, end), for arrays of starts and ends
+    def bits_between(self, start, end):
+        if self._spread is not None:
+            knots, cumulative = self._spread
+            return np.interp(end, knots, cumulative) - np.interp(start, knots, cumulative)
+        return self._cumsum[self._count_before(end)] - self._cumsum[self._count_before(start)]
+
+    # average bitrate over the whole stream
+    def average(self):
+        duration = self._covered[-1]
+        return self._cumsum[-1] / duration if duration > 0 else 0.0
+
+    # average bitrate from the start of the stream to the end of each frame
+    def cumulative(self):
+        frame_ends = np.append(self._times[1:], self._end_time)
+        elapsed = self.covered_time(frame_ends)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(elapsed > 0, self._cumsum[1:] / elapsed, 0.0)
+
+    # average bitrate in a window of the given duration (in seconds) centered on each frame.
+    # At the edges of the stream, the window is cut to the part that contains frames.
+    def sliding(self, window):
+        start = np.maximum(self._times - window / 2, self.start_time)
+        end = np.minimum(self._times + window / 2, self._end_time)
+        span = self.covered_time(end) - self.covered_time(start)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(span > 0, self.bits_between(start, end) / span, 0.0)
+
+    # sliding bitrates for several window durations, by window
+    def sliding_many(self, windows):
+        return {window: self.sliding(window) for window in windows}
+
+    # highest average bitrate over any window of the given duration starting on a frame,
+    # returned with the start time of that window. Windows must be within an analysed interval
+    def peak(self, window):
+        starts = self._times[self._times + window <= self._interval_ends[self._interval_of(self._times)]]
+        if len(starts) == 0:
+            return self.average(), self.start_time
+
+        rates = self.bits_between(starts, starts + window) / window
+        idx = int(np.argmax(rates))
+        return rates[idx], starts[idx]
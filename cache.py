@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import zipfile
+import numpy as np
+import models
+import ffprobe_parser
+
+# bump when the content of cache entries changes
+CACHE_VERSION = 3
+
+
+def default_cache_dir():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'vviz')
+
+
+# version line of an external tool, or the identity of its executable if it can't tell its version
+def tool_version(executable, version_arg='-version'):
+    try:
+        output = subprocess.check_output('"{}" {}'.format(executable, version_arg), shell=True,
+                                         stderr=subprocess.DEVNULL)
+        lines = output.decode('utf-8', errors='replace').strip().splitlines()
+        if lines:
+            return lines[0]
+    except subprocess.CalledProcessError:
+        pass
+
+    path = shutil.which(executable) or executable
+    try:
+        stat = os.stat(path)
+        return "{} {} {}".format(path, stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        return path
+
+
+# On-disk cache of parsed ffprobe and MP4 box information, so that re-running vviz on the same file
+# (eg. with a different title or output format) does not run the tools again.
+# Entries are numpy .npz files, named after a hash of the file identity and of the probe arguments.
+# The least recently used entries are removed when the cache grows over max_size bytes.
+class AnalysisCache(object):
+    def __init__(self, directory=None, max_size=1000 * 1000 * 1000):
+        self._directory = directory or default_cache_dir()
+        self._max_size = max_size
+        os.makedirs(self._directory, exist_ok=True)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def key(self, filename, **params):
+        stat = os.stat(filename)
+        identity = dict(params,
+                        path=os.path.abspath(filename),
+                        size=stat.st_size,
+                        mtime=stat.st_mtime_ns,
+                        version=CACHE_VERSION)
+        return hashlib.sha1(json.dumps(identity, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + '.npz')
+
+    # arrays of an entry, or None if there is no entry. Unreadable entries (eg. truncated, or written by
+    # something else) and entries without the required arrays are removed, and count as missing
+    def _load(self, key, required=()):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+        except (OSError, ValueError, zipfile.BadZipFile):
+            arrays = None
+        if arrays is None or any(name not in arrays for name in required):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+
+        # mark as recently used
+        os.utime(path)
+        return arrays
+
+    def _store(self, key, arrays):
+        fd, tmp = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, self._path(key))
+        except Exception:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    @staticmethod
+    def _encode_json(value):
+        return np.frombuffer(json.dumps(value).encode('utf-8'), dtype=np.uint8)
+
+    @staticmethod
+    def _decode_json(array):
+        return json.loads(array.tobytes().decode('utf-8'))
+
+    def load_ffprobe(self, key):
+        arrays = self._load(key, required=('header',))
+        if arrays is None:
+            return None
+
+        tables = {}
+        gop_tables = {}
+        for name, data in arrays.items():
+            if name.startswith('frames_'):
+                table = models.FrameTable(capacity=len(data))
+                table.extend(data)
+                tables[int(name[len('frames_'):])] = table
+            elif name.startswith('gops_'):
+                gop_tables[int(name[len('gops_'):])] = data
+        header = self._decode_json(arrays['header'])
+        samples = None
+        if header.get('samples'):
+            samples = {int(stream_index): intervals for stream_index, intervals in header.pop('samples').items()}
+        return ffprobe_parser.FFProbeResponse(header, tables=tables, samples=samples, gop_tables=gop_tables or None)
+
+    def store_ffprobe(self, key, response):
+        header = {'streams': response.streams, 'format': response.format}
+        if response.samples:
+            header['samples'] = response.samples
+        arrays = {'header': self._encode_json(header)}
+        for stream_index, table in response.tables.items():
+            arrays['frames_{}'.format(stream_index)] = table.data
+        for stream_index, gops in (response.gop_tables or {}).items():
+            arrays['gops_{}'.format(stream_index)] = gops
+        self._store(key, arrays)
+
+    # fills the track, and returns False if there is no cache entry
+    def load_track(self, key, track):
+        arrays = self._load(key, required=('track', 'fragments'))
+        if arrays is None:
+            return False
+
+        info = self._decode_json(arrays['track'])
+        track.id = info['id']
+        track.time_scale = info['time_scale']
+        track.duration = info['duration']
+        track.set_fragment_table(arrays['fragments'], samples=arrays.get('samples'))
+        return True
+
+    def store_track(self, key, track):
+        self._store(key, {
+            'track': self._encode_json({'id': track.id, 'time_scale': track.time_scale, 'duration': track.duration}),
+            'fragments': track.get_fragment_table(),
+            'samples': track.get_sample_table(),
+        })
+
+    # removes the least recently used entries until the cache fits in max_size
+    def evict(self):
+        entries = []
+        for name in os.listdir(self._directory):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self._directory, name))
+                except FileNotFoundError:
+                    # removed by another writer
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self._max_size:
+                break
+            try:
+                os.remove(os.path.join(self._directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
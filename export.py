@@ -0,0 +1,114 @@
+from collections import OrderedDict
+import numpy as np
+import models
+
+# Columnar export of the analysis: frame, GOP and fragment tables written as Parquet or Arrow IPC files,
+# that downstream jobs can query (or memory-map, for Arrow) without probing the video again.
+# pyarrow is only needed for the export, and is imported when it is used.
+
+FORMATS = ['parquet', 'arrow']
+EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+# rows per row group (Parquet) or record batch (Arrow)
+ROW_GROUP_SIZE = 1000000
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        raise Exception("Exporting to Parquet or Arrow requires pyarrow (pip install pyarrow)")
+
+
+# frame table columns: times in seconds, sizes in bytes, picture types as names
+def frame_columns(stream):
+    table = stream.table
+    columns = OrderedDict()
+    columns['pts'] = table.pts
+    columns['time'] = models.ticks_to_seconds(table.pts, stream.time_base)
+    columns['size'] = table.size
+    columns['pict_type'] = table.pict_type
+    columns['key_frame'] = table.key_frame
+    columns['position'] = table.position
+    return columns
+
+
+# GOP table columns: frame indexes, size in bits, start and duration in seconds
+def gop_columns(stream):
+    gops = stream.gop_table
+    columns = OrderedDict((name, gops[name]) for name in gops.dtype.names)
+    columns['start_time'] = models.ticks_to_seconds(gops['start_pts'], stream.time_base)
+    return columns
+
+
+# fragment table columns, with the frame statistics of the fragments once frames are joined
+def fragment_columns(track):
+    fragments = track.get_fragment_table()
+    columns = OrderedDict((name, fragments[name]) for name in fragments.dtype.names)
+    if track.time_scale:
+        columns['start_time'] = fragments['decode_time'] / track.time_scale
+    if track.frame_stats is not None:
+        for name in track.frame_stats.dtype.names:
+            columns[name] = track.frame_stats[name]
+    return columns
+
+
+def _record_batch(pa, columns, start, end):
+    arrays = []
+    for name, values in columns.items():
+        values = values[start:end]
+        if name == 'pict_type':
+            # dictionary encoded, with the names of the picture types
+            names = [models.PICT_TYPE_NAMES.get(code, '?') for code in range(max(models.PICT_TYPE_NAMES) + 1)]
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(values.astype(np.int8)), pa.array(names)))
+        else:
+            # columns of structured arrays are strided views
+            arrays.append(pa.array(np.ascontiguousarray(values)))
+    return pa.RecordBatch.from_arrays(arrays, names=list(columns))
+
+
+# writes columns (numpy arrays of the same length) to a file, one row group or record batch at a time,
+# so that the data is not copied as a whole. metadata is stored in the schema (eg. time base).
+def write_columns(columns, file, format='parquet', metadata=None, row_group_size=ROW_GROUP_SIZE):
+    if format not in FORMATS:
+        raise Exception("Unknown export format {}".format(format))
+    pa = _import_pyarrow()
+
+    length = len(next(iter(columns.values()))) if columns else 0
+    schema = _record_batch(pa, columns, 0, 0).schema
+    if metadata:
+        schema = schema.with_metadata({key: str(value) for key, value in metadata.items()})
+
+    if format == 'parquet':
+        writer = pa.parquet.ParquetWriter(file, schema)
+    else:
+        writer = pa.ipc.new_file(file, schema)
+    try:
+        for start in range(0, max(length, 1), row_group_size):
+            batch = _record_batch(pa, columns, start, min(start + row_group_size, length))
+            if format == 'parquet':
+                writer.write_table(pa.Table.from_batches([batch], schema=schema))
+            else:
+                writer.write_batch(batch)
+    finally:
+        writer.close()
+
+
+# writes <prefix>.frames, <prefix>.gops and <prefix>.fragments files, and returns their names
+def export_analysis(stream, track, prefix, format='parquet', row_group_size=ROW_GROUP_SIZE):
+    metadata = OrderedDict([('stream', stream.index),
+                            ('time_base', stream.time_base),
+                            ('frame_rate', stream.frame_rate)])
+    tables = [('frames', frame_columns(stream)), ('gops', gop_columns(stream))]
+    if track is not None and len(track.fragments):
+        tables.append(('fragments', fragment_columns(track)))
+
+    files = []
+    for name, columns in tables:
+        file = "{}.{}.{}".format(prefix, name, EXTENSIONS[format])
+        write_columns(columns, file, format=format, metadata=metadata, row_group_size=row_group_size)
+        files.append(file)
+    return files
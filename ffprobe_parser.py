@@ -1,28 +1,78 @@
 import subprocess
-import json
+import math
+import multiprocessing
+import os
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import models
 
 
+# entries requested from ffprobe, to keep its output (and our parsing) to the minimum
+FRAME_ENTRIES = ['media_type', 'stream_index', 'key_frame', 'pkt_pts', 'pts', 'best_effort_timestamp',
+                 'pkt_size', 'pict_type']
+PACKET_ENTRIES = ['codec_type', 'stream_index', 'pts', 'dts', 'size', 'flags']
+# keyframes mode also reads the video packets (without decoding them) for the GOP sizes, and the byte position
+# of each keyframe and the file size in case packet sizes are missing
+KEYFRAME_ENTRIES = FRAME_ENTRIES + ['pkt_pos']
+KEYFRAME_PACKET_ENTRIES = ['codec_type', 'stream_index', 'pts', 'dts', 'size']
+
+MODES = ['frames', 'packets', 'keyframes']
+
+
 class FFProbeCommand(object):
-    def __init__(self, executable='ffprobe', filename=None, streams='v:0', intervals=None):
+    def __init__(self, executable='ffprobe', filename=None, streams='v:0', intervals=None, batch_size=10000,
+                 mode='frames'):
         interval_param = "-read_intervals {}".format(intervals) if intervals else ""
+        self._batch_size = batch_size
+        self._mode = mode
 
-        # TODO - pass parameters to restrict the ffprobe dimensions returned
+        # frames mode decodes every picture. packets mode only demuxes, which is much faster,
+        # but picture types then have to be inferred from the packets (see reorder_packets)
+        if mode == 'frames':
+            sections = "-show_frames -show_streams -show_entries frame={entries}:stream".format(
+                entries=",".join(FRAME_ENTRIES))
+        elif mode == 'packets':
+            sections = "-show_packets -show_streams -show_entries packet={entries}:stream".format(
+                entries=",".join(PACKET_ENTRIES))
+        elif mode == 'keyframes':
+            # only keyframes are decoded, which is enough for the GOP structure (see keyframe_gop_table),
+            # and packets are only demuxed
+            sections = "-skip_frame nokey -show_frames -show_packets -show_streams -show_format " \
+                       "-show_entries frame={entries}:packet={packet_entries}:stream:format=size,duration,start_time" \
+                .format(entries=",".join(KEYFRAME_ENTRIES), packet_entries=",".join(KEYFRAME_PACKET_ENTRIES))
+        elif mode == 'header':
+            # stream and container information only, without reading the content
+            sections = "-show_streams -show_format"
+        else:
+            raise Exception("Unknown ffprobe mode '{}'".format(mode))
+
+        # compact output is line oriented, which lets us parse frames while ffprobe is still running
         self._command = \
-            '"{ffexec}" -hide_banner -loglevel warning -select_streams {streams} {intervals} -show_frames -show_streams -print_format json {filename}' \
+            '"{ffexec}" -hide_banner -loglevel warning -select_streams {streams} {intervals} {sections} -print_format compact "{filename}"' \
             .format(ffexec=executable,
                     filename=filename,
                     intervals=interval_param,
+                    sections=sections,
                     streams=streams)
 
-        print("Executing ffprobe to extract stream and frame information")
+        print("Executing ffprobe to extract stream and {} information".format(mode.rstrip('s')))
         print(self._command)
         print()
 
     def call(self):
-        response = subprocess.check_output(self._command, shell=True, stderr=None)
-        jresponse = json.loads(response)
-        return FFProbeResponse(jresponse)
+        process = subprocess.Popen(self._command, shell=True, stdout=subprocess.PIPE, stderr=None)
+        reader = FFProbeCompactReader(batch_size=self._batch_size, mode=self._mode)
+        try:
+            response = reader.read(process.stdout)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, self._command)
+        return response
 
     # @property
     # def filename(self):
@@ -33,19 +83,432 @@ class FFProbeCommand(object):
     #     self._filename = new_filename
 
 
+def _to_float(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+# Process pool for ffprobe chunks. The analysis runs in a thread, next to the MP4 parser thread: worker processes
+# are spawned rather than forked, as a forked child could inherit a lock held by the other thread.
+def _process_pool(workers):
+    try:
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    except TypeError:
+        # Python 3.6 has no mp_context
+        return ProcessPoolExecutor(max_workers=workers)
+
+
+def _probe_interval(executable, filename, streams, interval, mode, batch_size):
+    return FFProbeCommand(executable=executable, filename=filename, streams=streams, intervals=interval,
+                          mode=mode, batch_size=batch_size).call()
+
+
+# Runs ffprobe on several time intervals of the file concurrently, and merges the results.
+# ffprobe seeks to the keyframe preceding the start of each interval, so every chunk starts on a keyframe
+# and overlaps with the end of the previous chunk. Each chunk is kept from its first keyframe onwards,
+# and the previous chunk up to that keyframe.
+# Chunks are also read for `overlap` seconds past their end: the frames presented just before a keyframe
+# (leading B-frames of an open GOP) are decoded after it, and would otherwise be in neither chunk.
+class FFProbeParallelCommand(object):
+    def __init__(self, executable='ffprobe', filename=None, streams='v:0', batch_size=10000, mode='frames',
+                 workers=None, min_chunk_duration=60, overlap=5):
+        self._executable = executable
+        self._filename = filename
+        self._streams = streams
+        self._batch_size = batch_size
+        self._mode = mode
+        self._workers = workers or os.cpu_count() or 1
+        self._min_chunk_duration = min_chunk_duration
+        self._overlap = overlap
+
+    def intervals(self, start, duration):
+        chunks = max(1, min(self._workers, int(math.ceil(duration / self._min_chunk_duration))))
+        bounds = [start + duration * idx / chunks for idx in range(chunks + 1)]
+        intervals = ["{:.6f}%{:.6f}".format(bounds[idx], bounds[idx + 1] + self._overlap) for idx in range(chunks)]
+        # read the last chunk until the end, in case the duration in the header is too short
+        intervals[-1] = "{:.6f}%".format(bounds[-2])
+        return intervals
+
+    def call(self):
+        # a single worker probes the whole file, without reading the header first
+        if self._workers < 2:
+            return _probe_interval(self._executable, self._filename, self._streams, None,
+                                   self._mode, self._batch_size)
+
+        header = FFProbeCommand(executable=self._executable, filename=self._filename, streams=self._streams,
+                                mode='header').call()
+        start, duration = header.get_time_range()
+
+        intervals = [None] if duration is None else self.intervals(start, duration)
+
+        if len(intervals) == 1:
+            return _probe_interval(self._executable, self._filename, self._streams, intervals[0],
+                                   self._mode, self._batch_size)
+
+        print("Probing {} intervals with {} workers".format(len(intervals), self._workers))
+        with _process_pool(self._workers) as pool:
+            responses = list(pool.map(_probe_interval,
+                                      [self._executable] * len(intervals),
+                                      [self._filename] * len(intervals),
+                                      [self._streams] * len(intervals),
+                                      intervals,
+                                      [self._mode] * len(intervals),
+                                      [self._batch_size] * len(intervals)))
+
+        return FFProbeResponse(header._json, tables=merge_frame_tables(responses))
+
+
+# Sampled overview of long files: instead of the whole file, ffprobe reads short windows
+# (eg. 10s every 5 minutes) spread evenly over its duration, in parallel.
+class FFProbeSampledCommand(object):
+    def __init__(self, executable='ffprobe', filename=None, streams='v:0', batch_size=10000, mode='frames',
+                 workers=None, sample_duration=10, sample_spacing=300):
+        self._executable = executable
+        self._filename = filename
+        self._streams = streams
+        self._batch_size = batch_size
+        self._mode = mode
+        self._workers = workers or os.cpu_count() or 1
+        self._sample_duration = sample_duration
+        self._sample_spacing = sample_spacing
+
+    # ffprobe intervals of the samples, or None if the samples would cover the whole file
+    def intervals(self, start, duration):
+        count = max(1, int(duration // self._sample_spacing))
+        if count * self._sample_duration >= duration:
+            return None
+        return ["{:.6f}%+{:.6f}".format(start + duration * idx / count, self._sample_duration) for idx in range(count)]
+
+    def call(self):
+        header = FFProbeCommand(executable=self._executable, filename=self._filename, streams=self._streams,
+                                mode='header').call()
+        start, duration = header.get_time_range()
+
+        intervals = self.intervals(start, duration) if duration else None
+        if intervals is None:
+            print("File too short to be sampled, probing all of it")
+            return _probe_interval(self._executable, self._filename, self._streams, None,
+                                   self._mode, self._batch_size)
+
+        print("Probing {} samples of {}s with {} workers".format(len(intervals), self._sample_duration, self._workers))
+        with _process_pool(self._workers) as pool:
+            responses = list(pool.map(_probe_interval,
+                                      [self._executable] * len(intervals),
+                                      [self._filename] * len(intervals),
+                                      [self._streams] * len(intervals),
+                                      intervals,
+                                      [self._mode] * len(intervals),
+                                      [self._batch_size] * len(intervals)))
+
+        tables, samples = merge_sampled_tables(responses, header)
+        return FFProbeResponse(header._json, tables=tables, samples=samples)
+
+
+# Stitches the frame tables of samples, by stream index.
+# Each sample is kept from its first keyframe. Frame positions are estimated from the frame times,
+# and the (start, end) times in seconds of each sample are returned with the tables.
+def merge_sampled_tables(responses, header):
+    tables = {}
+    samples = {}
+    for stream_index in sorted(set(idx for response in responses for idx in response.tables)):
+        jstream = header.get_stream_json(stream_index)
+        time_base = models.to_fraction(jstream['time_base'])
+        frame_rate = models.parse_rate(jstream.get('avg_frame_rate')) or models.parse_rate(jstream.get('r_frame_rate'))
+
+        parts = []
+        intervals = []
+        last_pts = None
+        for response in responses:
+            if stream_index not in response.tables:
+                continue
+            data = response.tables[stream_index].data
+            keyframes = np.flatnonzero(data['key_frame'])
+            if len(keyframes) == 0:
+                continue
+            data = data[keyframes[0]:]
+            if last_pts is not None:
+                data = data[data['pts'] > last_pts]
+            if len(data) == 0:
+                continue
+
+            times = models.ticks_to_seconds(data['pts'], time_base)
+            intervals.append([float(times.min()), float(times.max() + 1 / frame_rate)])
+            last_pts = data['pts'].max()
+            parts.append(data)
+
+        if not parts:
+            continue
+
+        merged = models.FrameTable(capacity=sum(len(part) for part in parts))
+        for part in parts:
+            merged.extend(part)
+
+        start_pts = jstream.get('start_pts')
+        if not isinstance(start_pts, int):
+            start_pts = int(merged.pts[0])
+        merged.position[:] = np.rint((merged.pts - start_pts) * float(time_base * frame_rate)).astype(np.int64) + 1
+
+        tables[stream_index] = merged
+        samples[stream_index] = intervals
+    return tables, samples
+
+
+# merges the frame tables of consecutive (and overlapping) ffprobe responses, by stream index
+def merge_frame_tables(responses):
+    tables = {}
+    for stream_index in sorted(set(idx for response in responses for idx in response.tables)):
+        chunks = [response.tables[stream_index].data for response in responses if stream_index in response.tables]
+
+        # each chunk starts at its first keyframe, and ends where the next chunk starts
+        starts = []
+        for data in chunks:
+            keyframes = data['pts'][data['key_frame']]
+            starts.append(keyframes[0] if len(keyframes) else None)
+        starts[0] = None
+
+        parts = []
+        for idx, data in enumerate(chunks):
+            keep = np.ones(len(data), dtype=np.bool_)
+            if starts[idx] is not None:
+                keep &= data['pts'] >= starts[idx]
+            following = [s for s in starts[idx + 1:] if s is not None]
+            if following:
+                keep &= data['pts'] < following[0]
+            parts.append(data[keep])
+
+        merged = models.FrameTable(capacity=sum(len(part) for part in parts))
+        for part in parts:
+            merged.extend(part)
+        merged.position[:] = np.arange(1, len(merged) + 1)
+        tables[stream_index] = merged
+    return tables
+
+
+# Incremental reader for ffprobe's compact output (one section per line, eg. "frame|key_frame=1|pkt_size=1234|...")
+# Frames are accumulated in small batches and flushed into per-stream FrameTables,
+# so memory does not depend on the size of the ffprobe output.
+class FFProbeCompactReader(object):
+    _separator = re.compile(r'(?<!\\)\|')
+
+    def __init__(self, batch_size=10000, mode='frames'):
+        self._batch_size = batch_size
+        self._mode = mode
+        self._streams = []
+        self._tables = {}
+        self._batches = {}
+        self._format = {}
+        self._count = 0
+        # byte positions of the frames, and pts and sizes of the packets (keyframes mode only), by stream index
+        self._offsets = {}
+        self._packets = {}
+
+    def read(self, lines):
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', errors='replace')
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+
+            fields = self._separator.split(line)
+            section = fields[0]
+            if section == 'frame':
+                self._add_frame(self._parse_fields(fields[1:]))
+            elif section == 'packet':
+                self._add_packet(self._parse_fields(fields[1:]))
+            elif section == 'stream':
+                self._streams.append(self._parse_fields(fields[1:]))
+            elif section == 'format':
+                self._format = self._parse_fields(fields[1:])
+
+        for stream_index in self._batches:
+            self._flush(stream_index)
+
+        if self._mode == 'packets':
+            for stream_index in self._tables:
+                self._tables[stream_index] = reorder_packets(self._tables[stream_index])
+
+        gop_tables = None
+        if self._mode == 'keyframes':
+            gop_tables = {}
+            file_size = self._format.get('size')
+            for jstream in self._streams:
+                stream_index = jstream.get('index')
+                if stream_index not in self._tables:
+                    continue
+                start_pts = jstream.get('start_pts')
+                duration_ts = jstream.get('duration_ts')
+                packets = self._packets.get(stream_index)
+                gop_tables[stream_index] = models.keyframe_gop_table(
+                    self._tables[stream_index],
+                    time_base=jstream['time_base'],
+                    frame_rate=models.parse_rate(jstream.get('avg_frame_rate')) or models.parse_rate(jstream.get('r_frame_rate')),
+                    end_pts=start_pts + duration_ts if isinstance(start_pts, int) and isinstance(duration_ts, int) else None,
+                    packets=(np.frombuffer(packets[0], dtype=np.int64),
+                             np.frombuffer(packets[1], dtype=np.int64)) if packets else None,
+                    offsets=self._offsets[stream_index],
+                    end_offset=file_size if isinstance(file_size, int) else None)
+                # frame numbers (estimated) rather than positions in ffprobe's output
+                self._tables[stream_index].position[:] = gop_tables[stream_index]['start'] + 1
+
+        return FFProbeResponse({'streams': self._streams, 'format': self._format}, tables=self._tables,
+                               gop_tables=gop_tables)
+
+    @staticmethod
+    def _parse_fields(fields):
+        entries = {}
+        for field in fields:
+            key, _, value = field.partition('=')
+            value = value.replace('\\|', '|').replace('\\\\', '\\')
+            try:
+                entries[key] = int(value)
+            except ValueError:
+                entries[key] = value
+        return entries
+
+    def _add_frame(self, entries):
+        self._count += 1
+        if entries.get('media_type') != 'video':
+            return
+
+        pts = None
+        for key in ('pkt_pts', 'pts', 'best_effort_timestamp'):
+            if isinstance(entries.get(key), int):
+                pts = entries[key]
+                break
+        if pts is None:
+            return
+
+        if self._mode == 'keyframes':
+            pkt_pos = entries.get('pkt_pos')
+            self._offsets.setdefault(entries['stream_index'], []).append(pkt_pos if isinstance(pkt_pos, int) else -1)
+
+        self._add_record(entries['stream_index'],
+                         (pts,
+                          entries['pkt_size'],
+                          models.PICT_TYPE_CODES.get(entries.get('pict_type'), models.PICT_TYPE_UNKNOWN),
+                          bool(entries.get('key_frame')),
+                          self._count))
+
+    def _add_packet(self, entries):
+        self._count += 1
+        if entries.get('codec_type') != 'video':
+            return
+
+        pts = entries.get('pts')
+        if not isinstance(pts, int):
+            pts = entries.get('dts')
+            if not isinstance(pts, int):
+                return
+
+        # keyframes mode only sums the packets in GOPs (see keyframe_gop_table)
+        if self._mode == 'keyframes':
+            packets = self._packets.setdefault(entries['stream_index'], (array('q'), array('q')))
+            packets[0].append(pts)
+            packets[1].append(entries['size'])
+            return
+
+        # picture type is unknown at this point, and only set once all packets are read
+        self._add_record(entries['stream_index'],
+                         (pts,
+                          entries['size'],
+                          models.PICT_TYPE_UNKNOWN,
+                          'K' in str(entries.get('flags', '')),
+                          self._count))
+
+    def _add_record(self, stream_index, record):
+        batch = self._batches.setdefault(stream_index, [])
+        batch.append(record)
+
+        if len(batch) >= self._batch_size:
+            self._flush(stream_index)
+
+    def _flush(self, stream_index):
+        batch = self._batches[stream_index]
+        if batch:
+            table = self._tables.setdefault(stream_index, models.FrameTable(capacity=self._batch_size))
+            table.extend(batch)
+            self._batches[stream_index] = []
+
+
+# Turns a table of packets (in decode order) into a table of frames in presentation order.
+# Picture types are inferred without decoding: key packets are IDR frames, packets presented
+# before a packet that was decoded earlier are B-frames, and all others are P-frames.
+# Non-IDR I-frames are therefore reported as P-frames (or as IDR frames if the container flags them as sync samples)
+def reorder_packets(table):
+    data = table.data
+    pts = data['pts']
+
+    decoded_max = np.maximum.accumulate(pts)
+    bframes = np.zeros(len(pts), dtype=np.bool_)
+    bframes[1:] = pts[1:] < decoded_max[:-1]
+
+    data['pict_type'] = np.where(data['key_frame'], models.PICT_TYPE_I,
+                                 np.where(bframes, models.PICT_TYPE_B, models.PICT_TYPE_P))
+
+    frames = data[np.argsort(pts, kind='mergesort')]
+    frames['position'] = np.arange(1, len(frames) + 1)
+
+    reordered = models.FrameTable(capacity=len(frames))
+    reordered.extend(frames)
+    return reordered
+
+
 class FFProbeResponse(object):
-    def __init__(self, j):
+    def __init__(self, j, tables=None, samples=None, gop_tables=None):
         self._json = j
+        # frame tables already built while reading ffprobe's output, by stream index
+        self._tables = tables
+        # in keyframes mode, the GOP tables (tables then only contain keyframes), by stream index
+        self._gop_tables = gop_tables
+        # for sampled overviews, (start, end) times in seconds of the samples, by stream index
+        self._samples = samples
 
     @property
     def streams(self):
         return self._json['streams']
 
     @property
-    def frames(self):
-        return self._json['frames']
+    def format(self):
+        return self._json.get('format', {})
+
+    @property
+    def samples(self):
+        return self._samples
+
+    @property
+    def gop_tables(self):
+        return self._gop_tables
+
+    # frame tables by stream index
+    # built in a single pass over the frames when the response comes from JSON
+    @property
+    def tables(self):
+        if self._tables is None:
+            tables = {}
+            frames = self._json.get('frames') or []
+            for idx, jframe in enumerate(frames):
+                if jframe['media_type'] == "video":
+                    table = tables.get(jframe['stream_index'])
+                    if table is None:
+                        table = tables[jframe['stream_index']] = models.FrameTable(capacity=len(frames))
+                    table.append_json(jframe, position=idx+1)
+            self._tables = tables
+        return self._tables
+
+    # start time and duration in seconds, from the first stream (or from the container)
+    def get_time_range(self):
+        start = None
+        duration = None
+        for entries in self.streams[:1] + [self.format]:
+            if start is None:
+                start = _to_float(entries.get('start_time'))
+            if duration is None:
+                duration = _to_float(entries.get('duration'))
+        return start or 0.0, duration
 
-    # TODO: cater for multiple streams
     def get_streams(self):
         streams = []
         if self._json['streams']:
@@ -57,21 +520,37 @@ class FFProbeResponse(object):
         else:
             raise Exception("No streams found in ffprobe response")
 
-    # TODO: cater for multiple streams
-    def get_frames_for_stream(self, stream):
-        frames = []
+    # ffprobe entries of a stream, by stream index
+    def get_stream_json(self, stream_index):
+        for jstream in self.streams:
+            if jstream.get('index') == stream_index:
+                return jstream
+        raise Exception("Stream {} not found in ffprobe response".format(stream_index))
+
+    # indexes of the video streams with frames, in order
+    def get_video_stream_indexes(self):
+        indexes = [jstream.get('index') for jstream in self.streams]
+        return [index for index in sorted(self.tables) if index in indexes]
+
+    def get_frame_table_for_stream(self, stream):
         if isinstance(stream, models.Stream):
-            if self._json['frames']:
-                for idx, jframe in enumerate(self._json['frames']):
-                    if jframe['media_type'] == "video" and jframe['stream_index'] == stream.index:
-                        frame = models.Frame(time_base=stream.time_base, frame_rate=stream.frame_rate, position=idx+1)
-                        frame.parse_from_json(jframe)
-
-                        frames.append(frame)
-                return frames
+            if stream.index in self.tables:
+                return self.tables[stream.index]
             else:
                 raise Exception("No frames found in ffprobe response")
         else:
             raise Exception("'stream' argument should be a Stream")
 
+    def get_gop_table_for_stream(self, stream):
+        if self._gop_tables:
+            return self._gop_tables.get(stream.index)
+        return None
 
+    def get_samples_for_stream(self, stream):
+        if self._samples:
+            return self._samples.get(stream.index)
+        return None
+
+    # frames are created on demand from the frame table
+    def get_frames_for_stream(self, stream):
+        return models.FrameList(self.get_frame_table_for_stream(stream), stream=stream)
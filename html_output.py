@@ -0,0 +1,124 @@
+import base64
+import gzip
+import html
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from models import EPOCH
+
+# Compact interactive charts: plotly.js is written once, next to the charts, instead of being inlined in each of them,
+# and numeric arrays (datetimes being converted to milliseconds since the epoch) are written as base64 encoded
+# binary arrays, decoded in the page, rather than as JSON text.
+
+HTML_MODES = ['standalone', 'compact']
+
+# shorter arrays are left as JSON
+MIN_ENCODED_LENGTH = 16
+
+TEMPLATE = """<html>
+<head>
+<meta charset="utf-8" />{refresh}
+<title>{title}</title>
+<script src="{plotlyjs}"></script>
+</head>
+<body style="margin:0;height:100%">
+<div id="chart" style="height:100%;width:100%"></div>
+<script>
+// arrays written as {{"dtype": ..., "bdata": <base64>}} are decoded into plain arrays
+var TYPES = {{"f8": Float64Array, "i4": Int32Array}};
+function decode(value) {{
+    if (Array.isArray(value)) {{
+        return value.map(decode);
+    }}
+    if (value !== null && typeof value === "object") {{
+        if (value.bdata !== undefined && TYPES[value.dtype]) {{
+            var bytes = Uint8Array.from(atob(value.bdata), function (c) {{ return c.charCodeAt(0); }});
+            return Array.from(new TYPES[value.dtype](bytes.buffer));
+        }}
+        var result = {{}};
+        for (var key in value) {{
+            result[key] = decode(value[key]);
+        }}
+        return result;
+    }}
+    return value;
+}}
+var figure = decode({figure});
+Plotly.newPlot("chart", figure.data, figure.layout, {{"showLink": false, "responsive": true}});
+</script>
+</body>
+</html>
+"""
+
+
+# milliseconds since the epoch, for datetimes (naive ones being in UTC)
+def to_epoch_ms(values):
+    if len(values) and getattr(values[0], 'tzinfo', None) is not None:
+        return np.array([(value - EPOCH) / timedelta(milliseconds=1) for value in values])
+    return np.array(values, dtype='datetime64[us]').astype(np.int64) / 1000.0
+
+
+def _encode_array(values):
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu' and len(values) and values.min() >= -2 ** 31 and values.max() < 2 ** 31:
+        return {'dtype': 'i4', 'bdata': base64.b64encode(values.astype('<i4').tobytes()).decode('ascii')}
+    return {'dtype': 'f8', 'bdata': base64.b64encode(values.astype('<f8').tobytes()).decode('ascii')}
+
+
+# a trace or layout property, with its numeric and datetime arrays encoded
+def encode_value(value):
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        if len(value) < MIN_ENCODED_LENGTH:
+            return [encode_value(item) for item in value] if not isinstance(value, np.ndarray) else value
+        values = np.asarray(value) if not isinstance(value, np.ndarray) else value
+        if values.dtype.kind == 'M':
+            return _encode_array(values.astype('datetime64[us]').astype(np.int64) / 1000.0)
+        if values.dtype.kind == 'O' and isinstance(values[0], datetime):
+            return _encode_array(to_epoch_ms(values.tolist()))
+        if values.dtype.kind in 'iuf':
+            return _encode_array(values)
+    return value
+
+
+# shared plotly.js file in a directory, written if it is not there yet. Returns its name.
+def write_plotlyjs(directory):
+    import plotly
+    name = "plotly-{}.min.js".format(plotly.offline.get_plotlyjs_version())
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(plotly.offline.get_plotlyjs())
+    return name
+
+
+# Writes a figure (plotly data and layout objects) as a compact HTML page, gzipped if asked for.
+# Datetimes on the x axis are written as numbers, so the axis is made a date axis explicitly.
+# Returns the name of the written file.
+def write_compact_html(data, layout, file, title='', refresh=None, compress=False):
+    from plotly.utils import PlotlyJSONEncoder
+
+    figure = {
+        'data': [encode_value(trace.to_plotly_json()) for trace in data],
+        'layout': layout.to_plotly_json(),
+    }
+    figure['layout'].setdefault('xaxis', {})['type'] = 'date'
+
+    plotlyjs = write_plotlyjs(os.path.dirname(os.path.abspath(file)))
+    page = TEMPLATE.format(
+        title=html.escape(title),
+        plotlyjs=plotlyjs,
+        figure=json.dumps(figure, cls=PlotlyJSONEncoder, separators=(',', ':')),
+        refresh='\n<meta http-equiv="refresh" content="{}" />'.format(refresh) if refresh else '')
+
+    if compress:
+        file += '.gz'
+        with gzip.open(file, 'wt', encoding='utf-8') as f:
+            f.write(page)
+    else:
+        with open(file, 'w', encoding='utf-8') as f:
+            f.write(page)
+    return file
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import argparse
+import copy
+import glob
+import os
+import re
+import time
+from collections import OrderedDict
+
+import numpy as np
+import vviz
+from ffprobe_parser import FFProbeCommand
+from mp4box_parser import MP4BoxParser
+from bitrate import BitrateCalculator
+from models import Stream, MP4Track, sizeof_fmt, ticks_to_seconds
+
+
+# sort key for segment names, so that segment_10 comes after segment_9
+def natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+# Incremental analysis of a live DASH/CMAF output: an init segment and media segments written to a directory.
+# Each new segment is probed on its own (with the init segment in front of it), and its frames and fragments
+# are appended to the streams and track. Only the last `history` seconds are kept, so memory does not grow.
+class LiveAnalysis(object):
+    def __init__(self, directory, init='init.mp4', pattern='*.m4s', history=600,
+                 ffprobe_exec='ffprobe', streams='v:0', mode='frames'):
+        # keyframes mode gives the GOPs of a whole file, which cannot be extended segment by segment
+        if mode == 'keyframes':
+            raise Exception("Keyframes mode is not supported for live analysis")
+        self._directory = directory
+        self._init = os.path.join(directory, init)
+        self._pattern = pattern
+        self._history = history
+        self._ffprobe_exec = ffprobe_exec
+        self._select_streams = streams
+        self._mode = mode
+
+        self._init_data = None
+        self._streams = OrderedDict()
+        self._track = MP4Track()
+        self._positions = {}
+        self._fragment_count = 0
+        # segments already analysed, and sizes of the segments that may still be written
+        self._seen = set()
+        self._pending = {}
+        # totals since the start of the analysis, by stream index: bits, and start and end times in seconds
+        self._totals = {}
+
+    @property
+    def streams(self):
+        return list(self._streams.values())
+
+    @property
+    def track(self):
+        return self._track
+
+    # new segments, in order. A segment is ready once its size has not changed since the previous poll
+    # (or right away if wait is False)
+    def poll(self, wait=True):
+        paths = sorted(glob.glob(os.path.join(self._directory, self._pattern)), key=natural_key)
+        names = set(paths)
+        # forget the segments removed by the packager
+        self._seen &= names
+
+        ready = []
+        for path in paths:
+            if path in self._seen:
+                continue
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            if size and (not wait or self._pending.get(path) == size):
+                ready.append(path)
+                self._pending.pop(path, None)
+            else:
+                self._pending[path] = size
+        self._pending = {path: size for path, size in self._pending.items() if path in names}
+        return ready
+
+    def _read_init(self):
+        if self._init_data is None:
+            if not os.path.exists(self._init):
+                raise Exception("Init segment {} not found".format(self._init))
+            with open(self._init, 'rb') as f:
+                self._init_data = f.read()
+            MP4BoxParser(data=self._init_data).get_info_for_track(self._track)
+
+    def add_segment(self, path):
+        self._read_init()
+        self._seen.add(path)
+
+        # frames: ffprobe reads the init segment and the media segment as a single file
+        response = FFProbeCommand(executable=self._ffprobe_exec,
+                                  filename="concat:{}|{}".format(self._init, path),
+                                  streams=self._select_streams,
+                                  mode=self._mode).call()
+        for index in response.get_video_stream_indexes():
+            data = response.tables[index].data.copy()
+            first = self._positions.get(index, 0)
+            data['position'] = np.arange(first + 1, first + len(data) + 1)
+            self._positions[index] = first + len(data)
+
+            if index in self._streams:
+                stream = self._streams[index]
+                stream.add_frames(data)
+            else:
+                stream = self._streams[index] = Stream(origin=response, stream_index=index)
+                stream.table.position[:] = data['position']
+            # the duration of the response is the duration of the segment
+            stream.duration = stream.frames_duration()
+
+            times = ticks_to_seconds(data['pts'], stream.time_base)
+            totals = self._totals.setdefault(index, dict(bits=0, start=float(times.min())))
+            totals['bits'] += int(data['size'].sum()) * 8
+            totals['end'] = float(times.max()) + float(1 / stream.frame_rate)
+
+        # fragments
+        with open(path, 'rb') as f:
+            data = self._init_data + f.read()
+        fragments = MP4BoxParser(data=data).get_fragments_for_track(self._track)
+        for fragment in fragments:
+            self._fragment_count += 1
+            fragment.position = self._fragment_count
+        self._track.add_fragments(fragments)
+
+    # removes what is older than the history duration
+    def trim(self):
+        for stream in self._streams.values():
+            if len(stream.table):
+                last = int(stream.table.pts.max())
+                stream.drop_frames_before(last - int(self._history / stream.time_base))
+                stream.duration = stream.frames_duration()
+
+        fragments = self._track.fragments
+        if fragments and self._track.time_scale:
+            last = fragments[-1]
+            end = last.decode_time + last.duration_ticks
+            self._track.drop_fragments_before(end - int(self._history * self._track.time_scale))
+
+    def status(self, peak_windows=()):
+        lines = []
+        for index, stream in self._streams.items():
+            totals = self._totals[index]
+            span = totals['end'] - totals['start']
+            bitrates = BitrateCalculator.from_stream(stream)
+            line = "stream {index}: {frames} frames, {gops} GOPs in the last {history:.0f}s, " \
+                   "avg bitrate {avg} (since start: {total})".format(
+                    index=index,
+                    frames=len(stream.table),
+                    gops=len(stream.gop_table),
+                    history=bitrates.end_time - bitrates.start_time,
+                    avg=sizeof_fmt(bitrates.average(), 'bps'),
+                    # unknown until the segments span some time
+                    total=sizeof_fmt(totals['bits'] / span, 'bps') if span > 0 else '-')
+            for window in peak_windows:
+                peak, _ = bitrates.peak(window)
+                line += ", peak ({}s) {}".format(window, sizeof_fmt(peak, 'bps'))
+            lines.append(line)
+        lines.append("fragments: {} in the last {:.0f}s".format(len(self._track.fragments), self._history))
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Live analysis of a directory where a packager writes DASH/CMAF '
+                                                 'segments, with a chart refreshed periodically')
+    parser.add_argument('directory', help='directory with the init segment and media segments')
+    parser.add_argument('--init', dest='init',
+                        help='name of the init segment (default: %(default)s)',
+                        default='init.mp4')
+    parser.add_argument('--pattern', dest='pattern',
+                        help='pattern of the media segments (default: %(default)s)',
+                        default='*.m4s')
+    parser.add_argument('--history', dest='history', type=float,
+                        help='duration (in seconds) of the analysis window (default: %(default)s)',
+                        default=600)
+    parser.add_argument('--refresh', dest='refresh', type=float,
+                        help='interval (in seconds) between chart updates (default: %(default)s)',
+                        default=10)
+    parser.add_argument('--poll', dest='poll', type=float,
+                        help='interval (in seconds) between checks for new segments (default: %(default)s)',
+                        default=1)
+    parser.add_argument('--once', dest='once', action='store_true',
+                        help='analyse the segments already in the directory, generate the chart and exit')
+    parser.add_argument('-o', '--output', dest='output',
+                        help='chart file, without extension (default: <directory>.live)')
+    vviz.add_analysis_arguments(parser)
+
+    args = parser.parse_args()
+    if args.mode == 'keyframes':
+        parser.error("--mode keyframes is not supported for live analysis")
+    if args.overview or args.intervals:
+        parser.error("--overview and --intervals are not supported for live analysis")
+
+    chart_args = copy.copy(args)
+    chart_args.path_to_file = args.output or os.path.normpath(args.directory) + '.live'
+    chart_args.intervals = None
+
+    analysis = LiveAnalysis(args.directory, init=args.init, pattern=args.pattern, history=args.history,
+                            ffprobe_exec=args.ffprobe_exec, streams=args.streams, mode=args.mode)
+
+    last_refresh = None
+    changed = False
+    try:
+        while True:
+            for path in analysis.poll(wait=not args.once):
+                print("New segment {}".format(path))
+                analysis.add_segment(path)
+                changed = True
+
+            if changed and (args.once or last_refresh is None or time.time() - last_refresh >= args.refresh):
+                analysis.trim()
+                print(analysis.status(peak_windows=args.window))
+                vviz.chart_streams(analysis.streams, analysis.track, chart_args,
+                                   auto_open=last_refresh is None and not args.once,
+                                   refresh=None if args.once else int(max(1, args.refresh)))
+                last_refresh = time.time()
+                changed = False
+
+            if args.once:
+                break
+            time.sleep(args.poll)
+    except KeyboardInterrupt:
+        print("Stopped")
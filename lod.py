@@ -0,0 +1,109 @@
+import numpy as np
+import models
+
+# frame categories, matching the frame bars of the chart
+CATEGORY_I = 0
+CATEGORY_IDR = 1
+CATEGORY_P = 2
+CATEGORY_B = 3
+CATEGORY_OTHER = 4
+
+CATEGORY_NAMES = ['I', 'IDR', 'P', 'B', '?']
+
+BIN_DTYPE = np.dtype([
+    ('index', np.int64),        # index of the largest frame of the bin, which represents it
+    ('count', np.int64),
+    ('min', np.int64),
+    ('max', np.int64),
+])
+
+
+# category of each row of a frame table (structured array)
+def frame_categories(frames):
+    categories = np.full(len(frames), CATEGORY_OTHER, dtype=np.int8)
+    iframes = frames['pict_type'] == models.PICT_TYPE_I
+    categories[iframes & ~frames['key_frame']] = CATEGORY_I
+    categories[iframes & frames['key_frame']] = CATEGORY_IDR
+    categories[frames['pict_type'] == models.PICT_TYPE_P] = CATEGORY_P
+    categories[frames['pict_type'] == models.PICT_TYPE_B] = CATEGORY_B
+    return categories
+
+
+# Level-of-detail reduction for frame traces on long streams.
+# Frames are grouped in a fixed number of time bins (about one per pixel of the chart).
+# Per bin and per frame category, only the largest frame is plotted, with the minimum size and number of frames
+# it stands for. The number of frames of each category in every bin is kept for hover texts.
+class FrameDecimator(object):
+    def __init__(self, times, frames, bins=4000):
+        self._times = np.asarray(times, dtype=np.float64)
+        self._frames = frames
+        self._bins = bins
+        self._categories = frame_categories(frames)
+
+        start = self._times[0] if len(self._times) else 0.0
+        end = self._times[-1] if len(self._times) else 0.0
+        self._bin_duration = (end - start) / bins if end > start else 1.0
+        self._bin_index = np.clip(((self._times - start) / self._bin_duration).astype(np.int64), 0, bins - 1)
+
+        # frame count per bin and category
+        self._composition = np.bincount(self._bin_index * len(CATEGORY_NAMES) + self._categories,
+                                        minlength=bins * len(CATEGORY_NAMES)).reshape(bins, len(CATEGORY_NAMES))
+
+    # duration of a bin, in seconds
+    @property
+    def bin_duration(self):
+        return self._bin_duration
+
+    # frame count of each category (columns, see CATEGORY_NAMES) in each bin (rows)
+    @property
+    def composition(self):
+        return self._composition
+
+    def bin_of(self, indexes):
+        return self._bin_index[indexes]
+
+    # indexes of all the frames of a category
+    def frames_for_category(self, category):
+        return np.flatnonzero(self._categories == category)
+
+    # one row per non-empty bin for the frames of a category (see BIN_DTYPE)
+    def bins_for_category(self, category):
+        indexes = self.frames_for_category(category)
+        if len(indexes) == 0:
+            return np.zeros(0, dtype=BIN_DTYPE)
+
+        # frames are in time order, so the frames of a bin are contiguous
+        bin_index = self._bin_index[indexes]
+        sizes = self._frames['size'][indexes]
+        starts = np.flatnonzero(np.concatenate(([True], bin_index[1:] != bin_index[:-1])))
+        counts = np.diff(np.append(starts, len(indexes)))
+
+        bins = np.zeros(len(starts), dtype=BIN_DTYPE)
+        bins['count'] = counts
+        bins['min'] = np.minimum.reduceat(sizes, starts)
+        bins['max'] = np.maximum.reduceat(sizes, starts)
+
+        # first frame of each bin with the max size
+        is_max = np.flatnonzero(sizes == np.repeat(bins['max'], counts))
+        _, first = np.unique(bin_index[is_max], return_index=True)
+        bins['index'] = indexes[is_max[first]]
+        return bins
+
+
+# indexes of the minimum and maximum value in each of the time bins, in time order.
+# Used to draw long lines with a bounded number of points, without losing their peaks.
+def minmax_indexes(times, values, bins=4000):
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) <= 2 * bins:
+        return np.arange(len(times))
+
+    bin_duration = (times[-1] - times[0]) / bins
+    bin_index = np.clip(((times - times[0]) / bin_duration).astype(np.int64), 0, bins - 1)
+    starts = np.flatnonzero(np.concatenate(([True], bin_index[1:] != bin_index[:-1])))
+    counts = np.diff(np.append(starts, len(times)))
+
+    group = np.repeat(np.arange(len(starts)), counts)
+    # position of the min and max of each group, by sorting on (group, value)
+    order = np.lexsort((values, group))
+    ends = np.append(starts[1:], len(times)) - 1
+    return np.unique(np.concatenate((order[starts], order[ends])))
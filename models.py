@@ -1,8 +1,133 @@
 from functools import reduce
-from datetime import datetime, timedelta
-import ffprobe_parser, mp4dump_parser
-import pytz
+from datetime import datetime, timedelta, timezone
+from fractions import Fraction
+import ffprobe_parser, mp4dump_parser, mp4box_parser
 import statistics
+import numpy as np
+from bitrate import BitrateCalculator
+
+
+# codes used for the pict_type column of a FrameTable
+PICT_TYPE_UNKNOWN = 0
+PICT_TYPE_I = 1
+PICT_TYPE_P = 2
+PICT_TYPE_B = 3
+
+PICT_TYPE_CODES = {
+    'I': PICT_TYPE_I,
+    'P': PICT_TYPE_P,
+    'B': PICT_TYPE_B,
+}
+PICT_TYPE_NAMES = {code: name for name, code in PICT_TYPE_CODES.items()}
+
+FRAME_DTYPE = np.dtype([
+    ('pts', np.int64),
+    ('size', np.int64),         # packet size, in bytes
+    ('pict_type', np.uint8),
+    ('key_frame', np.bool_),
+    ('position', np.int64),
+])
+
+GOP_DTYPE = np.dtype([
+    ('start', np.int64),            # index of the first frame
+    ('end', np.int64),              # index after the last frame
+    ('size', np.int64),             # in bits
+    ('closed', np.bool_),
+    ('start_pts', np.int64),
+    ('duration', np.float64),       # in seconds
+    ('size_source', np.uint8),      # see GOP_SIZE_SOURCE_NAMES
+])
+
+# where GOP sizes come from: the frames, or in keyframes mode the video packets, or (estimates) the fragments of the
+# MP4 track or the byte positions of the keyframes
+GOP_SIZE_FRAMES = 0
+GOP_SIZE_PACKETS = 1
+GOP_SIZE_FRAGMENTS = 2
+GOP_SIZE_POSITIONS = 3
+
+GOP_SIZE_SOURCE_NAMES = {
+    GOP_SIZE_FRAMES: 'frames',
+    GOP_SIZE_PACKETS: 'packets',
+    GOP_SIZE_FRAGMENTS: 'fragments (estimate)',
+    GOP_SIZE_POSITIONS: 'byte positions (estimate)',
+}
+
+FRAGMENT_DTYPE = np.dtype([
+    ('decode_time', np.int64),
+    ('sample_count', np.int64),
+    ('sample_duration', np.int64),  # default sample duration
+    ('duration', np.int64),         # sum of the sample durations
+    ('mdat_size', np.int64),        # mdat box size, in bytes
+    ('position', np.int64),
+])
+
+# frames of each fragment, from the join of a frame table with the fragments of a track
+FRAGMENT_STATS_DTYPE = np.dtype([
+    ('frames', np.int64),
+    ('i_frames', np.int64),         # IDR frames included
+    ('idr_frames', np.int64),
+    ('p_frames', np.int64),
+    ('b_frames', np.int64),
+    ('starts_on_idr', np.bool_),    # the first frame (by pts) is an IDR frame
+    ('largest_frame', np.int64),    # in bytes
+    ('largest_frame_position', np.int64),
+])
+
+# one row per sample of a fragment, as read from trun boxes (durations in track time scale units, sizes in bytes)
+SAMPLE_DTYPE = np.dtype([
+    ('duration', np.uint32),
+    ('size', np.uint32),
+    ('flags', np.uint32),
+    ('composition_offset', np.int32),
+])
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+# exact rational value of a time base or frame rate (eg. "1/90000", "30000/1001", 25 or 0.04)
+def to_fraction(value):
+    if value is None or isinstance(value, Fraction):
+        return value
+    if isinstance(value, float):
+        return Fraction(value).limit_denominator(1000000000)
+    return Fraction(value)
+
+
+# parses a frame rate as output by ffprobe, which is "0/0" when unknown
+def parse_rate(value):
+    try:
+        rate = to_fraction(value)
+    except (ValueError, TypeError, ZeroDivisionError):
+        return None
+    return rate or None
+
+
+# datetime for a (rational) number of seconds, exact to the microsecond
+def seconds_to_datetime(seconds):
+    return EPOCH + timedelta(microseconds=round(seconds * 1000000))
+
+
+# Timestamps are kept as integer ticks in the stream time base,
+# and only converted (in bulk) to seconds or datetimes for display
+
+# float seconds for an array of ticks
+def ticks_to_seconds(ticks, time_base):
+    time_base = to_fraction(time_base)
+    return np.asarray(ticks, dtype=np.float64) * time_base.numerator / time_base.denominator
+
+
+# datetime64 (microseconds) for an array of ticks, using integer arithmetic only
+def ticks_to_datetime64(ticks, time_base):
+    time_base = to_fraction(time_base)
+    seconds, remainder = np.divmod(np.asarray(ticks, dtype=np.int64) * time_base.numerator, time_base.denominator)
+    microseconds = seconds * 1000000 + (remainder * 1000000 + time_base.denominator // 2) // time_base.denominator
+    return microseconds.astype('datetime64[us]')
+
+
+# datetime64 (microseconds) for an array of float seconds
+def seconds_to_datetime64(seconds):
+    return np.rint(np.asarray(seconds, dtype=np.float64) * 1000000).astype(np.int64).astype('datetime64[us]')
 
 
 def sizeof_fmt(num, suffix='b'):
@@ -31,19 +156,270 @@ def time_to_str(ts, total_duration):
     return str[:-3]
 
 
+# Frame subclass for a pict_type / key_frame combination
+def frame_class_for(pict_type, key_frame):
+    if pict_type == 'B' or pict_type == PICT_TYPE_B:
+        return BFrame
+    if pict_type == 'P' or pict_type == PICT_TYPE_P:
+        return PFrame
+    if pict_type == 'I' or pict_type == PICT_TYPE_I:
+        if key_frame:
+            return IDRFrame
+        else:
+            return IFrame
+    return Frame
+
+
+# Columnar storage for frames: one structured numpy array (see FRAME_DTYPE)
+# instead of one Python object per frame
+class FrameTable(object):
+    def __init__(self, capacity=1024):
+        self._data = np.empty(max(capacity, 1), dtype=FRAME_DTYPE)
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    # structured array of all rows (view, not a copy)
+    @property
+    def data(self):
+        return self._data[:self._length]
+
+    @property
+    def pts(self):
+        return self.data['pts']
+
+    @property
+    def size(self):
+        return self.data['size']
+
+    @property
+    def pict_type(self):
+        return self.data['pict_type']
+
+    @property
+    def key_frame(self):
+        return self.data['key_frame']
+
+    @property
+    def position(self):
+        return self.data['position']
+
+    def _reserve(self, count):
+        needed = self._length + count
+        if needed > len(self._data):
+            # grow geometrically to keep appends amortised O(1)
+            data = np.empty(max(needed, len(self._data) * 2), dtype=FRAME_DTYPE)
+            data[:self._length] = self._data[:self._length]
+            self._data = data
+
+    def append(self, pts, size, pict_type, key_frame, position):
+        if isinstance(pict_type, str):
+            pict_type = PICT_TYPE_CODES.get(pict_type, PICT_TYPE_UNKNOWN)
+        self._reserve(1)
+        self._data[self._length] = (pts, size, pict_type, key_frame, position)
+        self._length += 1
+
+    # records is either a structured array with FRAME_DTYPE or a list of tuples in the same order
+    def extend(self, records):
+        if not isinstance(records, np.ndarray):
+            records = np.array(records, dtype=FRAME_DTYPE)
+        self._reserve(len(records))
+        self._data[self._length:self._length + len(records)] = records
+        self._length += len(records)
+
+    # removes the first rows, keeping the capacity
+    def drop_first(self, count):
+        count = min(count, self._length)
+        remaining = self._length - count
+        self._data[:remaining] = self._data[count:self._length]
+        self._length = remaining
+
+    def append_json(self, json, position):
+        self.append(pts=json['pkt_pts'],
+                    size=int(json['pkt_size']),
+                    pict_type=json['pict_type'],
+                    key_frame=json['key_frame'],
+                    position=position)
+
+    # boolean mask of the rows that match a Frame class, with the same semantics as isinstance (or type() if strict)
+    def mask_for_type(self, frame_type, strict=False):
+        codes = self.pict_type
+        if frame_type is BFrame:
+            return codes == PICT_TYPE_B
+        if frame_type is PFrame:
+            return codes == PICT_TYPE_P
+        if frame_type is IDRFrame:
+            return (codes == PICT_TYPE_I) & self.key_frame
+        if frame_type is IFrame:
+            if strict:
+                return (codes == PICT_TYPE_I) & ~self.key_frame
+            return codes == PICT_TYPE_I
+        if frame_type is Frame:
+            if strict:
+                return codes == PICT_TYPE_UNKNOWN
+            return np.ones(len(self), dtype=np.bool_)
+        raise Exception("Unknown frame type {}".format(frame_type))
+
+
+# GOP table (see GOP_DTYPE) from the keyframes of a stream only.
+# GOP sizes and frame counts are sums over the video packets (pts and size arrays, in any order), each packet
+# belonging to the GOP of the last keyframe presented before it. Without packets, frame indexes are estimated
+# from the timestamps and the frame rate, and GOP sizes from the byte positions of the keyframes (offsets): these
+# include interleaved data of other tracks and container headers, so they are a last resort.
+# end_pts and end_offset are the end of the stream and the size of the file, when known.
+def keyframe_gop_table(table, time_base, frame_rate, end_pts=None, packets=None, offsets=None, end_offset=None):
+    time_base = to_fraction(time_base)
+    pts = table.pts
+    gops = np.zeros(len(table), dtype=GOP_DTYPE)
+    if len(table) == 0:
+        return gops
+
+    # the last GOP lasts (and weighs) as long as the previous one when the end of the stream is unknown
+    if end_pts is None:
+        end_pts = pts[-1] + (pts[-1] - pts[-2] if len(pts) > 1 else int(1 / (time_base * frame_rate)))
+
+    ends_pts = np.append(pts[1:], end_pts)
+    gops['closed'] = (table.pict_type == PICT_TYPE_I) & table.key_frame
+    gops['start_pts'] = pts
+    gops['duration'] = ticks_to_seconds(ends_pts - pts, time_base)
+
+    if packets is not None and len(packets[0]):
+        packet_pts, packet_sizes = packets
+        # packets presented before the first keyframe (eg. of an open GOP) are counted in the first GOP
+        index = np.maximum(np.searchsorted(pts, packet_pts, side='right') - 1, 0)
+        counts = np.bincount(index, minlength=len(gops))
+        gops['end'] = np.cumsum(counts)
+        gops['start'] = gops['end'] - counts
+        gops['size'] = np.bincount(index, weights=packet_sizes, minlength=len(gops)).astype(np.int64) * 8
+        gops['size_source'] = GOP_SIZE_PACKETS
+        return gops
+
+    frame_numbers = np.rint((np.append(pts, end_pts) - pts[0]) * float(time_base * frame_rate)).astype(np.int64)
+    gops['start'] = frame_numbers[:-1]
+    gops['end'] = np.maximum(frame_numbers[1:], frame_numbers[:-1] + 1)
+    offsets = np.asarray(offsets if offsets is not None else [], dtype=np.int64)
+    if len(offsets) == len(gops) and (offsets >= 0).all():
+        if end_offset is None:
+            end_offset = offsets[-1] + (offsets[-1] - offsets[-2] if len(offsets) > 1 else 0)
+        gops['size'] = np.diff(np.append(offsets, end_offset)) * 8
+        gops['size_source'] = GOP_SIZE_POSITIONS
+    return gops
+
+
+# Per-fragment frame statistics (see FRAGMENT_STATS_DTYPE), for the fragment index of each frame (-1 for none).
+# Computed in bulk with bincount and unbuffered ufuncs, in linear time.
+def fragment_frame_stats(table, index, count):
+    stats = np.zeros(count, dtype=FRAGMENT_STATS_DTYPE)
+    inside = index >= 0
+    index = index[inside]
+    pict_type = table.pict_type[inside]
+    key_frame = table.key_frame[inside]
+    sizes = table.size[inside]
+    pts = table.pts[inside]
+    positions = table.position[inside]
+
+    idr = (pict_type == PICT_TYPE_I) & key_frame
+    stats['frames'] = np.bincount(index, minlength=count)
+    stats['i_frames'] = np.bincount(index[pict_type == PICT_TYPE_I], minlength=count)
+    stats['idr_frames'] = np.bincount(index[idr], minlength=count)
+    stats['p_frames'] = np.bincount(index[pict_type == PICT_TYPE_P], minlength=count)
+    stats['b_frames'] = np.bincount(index[pict_type == PICT_TYPE_B], minlength=count)
+
+    # first frame of each fragment
+    first_pts = np.full(count, np.iinfo(np.int64).max)
+    np.minimum.at(first_pts, index, pts)
+    stats['starts_on_idr'][index[idr & (pts == first_pts[index])]] = True
+
+    # largest frame of each fragment, the first one if several have the same size
+    largest = np.zeros(count, dtype=np.int64)
+    np.maximum.at(largest, index, sizes)
+    is_largest = sizes == largest[index]
+    largest_position = np.full(count, np.iinfo(np.int64).max)
+    np.minimum.at(largest_position, index[is_largest], positions[is_largest])
+    stats['largest_frame'] = largest
+    stats['largest_frame_position'] = np.where(stats['frames'] > 0, largest_position, -1)
+    return stats
+
+
+# Sequence of frames backed by a FrameTable.
+# Frame objects are only created when an item is accessed.
+class FrameList(object):
+    def __init__(self, table, stream=None, indexes=None):
+        self._table = table
+        self._stream = stream
+        self._indexes = indexes
+
+    def __len__(self):
+        if self._indexes is None:
+            return len(self._table)
+        return len(self._indexes)
+
+    # structured array with the rows of this selection
+    @property
+    def table(self):
+        if self._indexes is None:
+            return self._table.data
+        return self._table.data[self._indexes]
+
+    def _row(self, idx):
+        if self._indexes is None:
+            return self._table.data[idx]
+        return self._table.data[self._indexes[idx]]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            indexes = np.arange(len(self._table)) if self._indexes is None else self._indexes
+            return FrameList(self._table, stream=self._stream, indexes=indexes[idx])
+
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("frame index out of range")
+
+        row = self._row(idx)
+        frame = frame_class_for(row['pict_type'], row['key_frame'])()
+        frame.pkt_pts = int(row['pts'])
+        frame.pkt_size = int(row['size'])
+        frame.pict_type = PICT_TYPE_NAMES.get(int(row['pict_type']), '?')
+        frame.key_frame = int(row['key_frame'])
+        frame.media_type = 'video'
+        frame.position = int(row['position'])
+        if self._stream is not None:
+            frame.time_base = self._stream.time_base
+            frame.frame_rate = self._stream.frame_rate
+        return frame
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
 class Stream(object):
     def __init__(self, origin=None, stream_index=0):
         self._frame_rate = None
         self._time_base = None
         self._duration = None
-        self._frames = []
+        self._table = FrameTable()
+        self._gop_table = None
         self.index = stream_index
+        # (start, end) times in seconds of the analysed windows, if the stream was only sampled
+        self.samples = None
+        # GOP table of a keyframes-only scan (the frame table then only has the keyframes)
+        self._keyframe_gop_table = None
 
         if (origin):
             if (isinstance(origin, ffprobe_parser.FFProbeResponse)):
                 self._origin = origin
-                self.parse_from_json(origin.streams[self.index])
-                self._frames = origin.get_frames_for_stream(self)
+                self.parse_from_json(origin.get_stream_json(self.index))
+                self.table = origin.get_frame_table_for_stream(self)
+                self.samples = origin.get_samples_for_stream(self)
+                self._keyframe_gop_table = origin.get_gop_table_for_stream(self)
+                # streams without a known duration (eg. MKV or live captures): duration of the container,
+                # or else of the frames
+                if self.duration is None:
+                    duration = ffprobe_parser._to_float(origin.format.get('duration'))
+                    self.duration = timedelta(seconds=duration) if duration is not None else self.frames_duration()
             else:
                 raise Exception("Argument 'origin' should be of type FFProbeResponse")
 
@@ -53,7 +429,8 @@ class Stream(object):
 
     @frame_rate.setter
     def frame_rate(self, frame_rate):
-        self._frame_rate = frame_rate
+        self._frame_rate = to_fraction(frame_rate)
+        self._invalidate()
 
     @property
     def time_base(self):
@@ -61,7 +438,8 @@ class Stream(object):
 
     @time_base.setter
     def time_base(self, time_base):
-        self._time_base = time_base
+        self._time_base = to_fraction(time_base)
+        self._invalidate()
 
     @property
     def duration(self):
@@ -82,52 +460,151 @@ class Stream(object):
     # returns all frames
     @property
     def frames(self):
-        return self._frames
+        return FrameList(self._table, stream=self)
+
+    # columnar frame data
+    @property
+    def table(self):
+        return self._table
+
+    @table.setter
+    def table(self, table):
+        self._table = table
+        self._invalidate()
 
     # returns all frames of a particular type
     def get_frames_for_type(self, frame_type=None, strict=False):
         if frame_type:
-            fs = []
-            for f in self.frames:
-                if strict:
-                    if type(f) == frame_type:
-                        fs.append(f)
-                else:
-                    if isinstance(f, frame_type):
-                        fs.append(f)
-            return fs
+            indexes = np.flatnonzero(self._table.mask_for_type(frame_type, strict=strict))
+            return FrameList(self._table, stream=self, indexes=indexes)
         else:
             return self.frames
 
     def add_frame(self, frame):
-        self._frames.append(frame)
+        self._table.append(pts=frame.pkt_pts,
+                           size=frame.pkt_size,
+                           pict_type=frame.pict_type,
+                           key_frame=frame.key_frame,
+                           position=frame.position if frame.position is not None else len(self._table) + 1)
+        self._invalidate()
+
+    # appends rows of frames (see FrameTable.extend), eg. from a new segment of a live stream
+    def add_frames(self, records):
+        self._table.extend(records)
+        self._invalidate()
+
+    # removes the frames before a pts, from a GOP start so that the remaining GOPs are complete.
+    # Returns the number of frames removed
+    def drop_frames_before(self, pts):
+        table = self._table
+        gop_starts = np.flatnonzero((table.pict_type == PICT_TYPE_I) & (table.pts >= pts))
+        count = int(gop_starts[0]) if len(gop_starts) else 0
+        if count:
+            table.drop_first(count)
+            self._invalidate()
+        return count
+
+    # time from the start of the first frame to the end of the last one
+    def frames_duration(self):
+        pts = self._table.pts
+        if len(pts) == 0:
+            return timedelta(0)
+        frame_duration = 1 / self.frame_rate if self.frame_rate else 0
+        return timedelta(microseconds=round((int(pts.max() - pts.min()) * self.time_base + frame_duration) * 1000000))
+
+    # start times of the given pts values (or of all frames), as a datetime64 array
+    def start_times(self, pts=None):
+        if pts is None:
+            pts = self._table.pts
+        return ticks_to_datetime64(pts, self.time_base)
+
+    # start times of the given pts values (or of all frames), in seconds
+    def start_seconds(self, pts=None):
+        if pts is None:
+            pts = self._table.pts
+        return ticks_to_seconds(pts, self.time_base)
+
+    # True if only the keyframes were read (see keyframe_gop_table)
+    @property
+    def keyframes_only(self):
+        return self._keyframe_gop_table is not None
 
-    # Scan frames and extract gops
+    # GOP boundaries and aggregates, computed in bulk from the frame table (see GOP_DTYPE)
+    # A new GOP starts at every I-frame. Cached until frames are added.
+    @property
+    def gop_table(self):
+        if self._keyframe_gop_table is not None:
+            return self._keyframe_gop_table
+        if self._gop_table is None:
+            table = self._table
+            starts = np.flatnonzero(table.pict_type == PICT_TYPE_I)
+            if len(table) and (len(starts) == 0 or starts[0] != 0):
+                starts = np.concatenate(([0], starts))
+            ends = np.append(starts[1:], len(table))
+
+            gops = np.zeros(len(starts), dtype=GOP_DTYPE)
+            gops['start'] = starts
+            gops['end'] = ends
+            if len(starts):
+                pts = table.pts
+                gops['size'] = np.add.reduceat(table.size, starts) * 8
+                # a GOP is closed if it contains an IDR frame, which can only be its first frame
+                gops['closed'] = (table.pict_type[starts] == PICT_TYPE_I) & table.key_frame[starts]
+                gops['start_pts'] = pts[starts]
+                gops['duration'] = ticks_to_seconds(pts[ends - 1] - pts[starts], self.time_base) + float(1 / self.frame_rate)
+            self._gop_table = gops
+        return self._gop_table
+
+    # GOP objects, created on demand from the gop table
     @property
     def gops(self):
-        gops = []
-        gop = GOP(position=1)
-        gops.append(gop)
-        for idx, frame in enumerate(self.frames):
-            if isinstance(frame, IFrame):
-                if len(gop.frames):
-                    # GOP open and new iframe. Time to close GOP
-                    gop = GOP(position=len(gops)+1)
-                    gops.append(gop)
-
-            gop.add_frame(frame)
+        if len(self._table) == 0:
+            return [GOP(position=1)]
+        return GOPList(self)
 
-        return gops
+    # where the GOP sizes come from (see GOP_SIZE_SOURCE_NAMES)
+    @property
+    def gop_size_source(self):
+        gops = self.gop_table
+        return GOP_SIZE_SOURCE_NAMES[int(gops['size_source'][0]) if len(gops) else GOP_SIZE_FRAMES]
+
+    # In keyframes mode without the sizes of the packets, GOP sizes are estimated from the fragments of an MP4 track,
+    # the size of each fragment being spread evenly over its duration
+    def set_gop_sizes_from_fragments(self, track):
+        fragments = track.get_fragment_table()
+        if not self.keyframes_only or len(fragments) == 0 or not track.time_scale:
+            return
+
+        starts = fragments['decode_time'] / track.time_scale
+        ends = starts + fragments['duration'] / track.time_scale
+        bits = np.cumsum(fragments['mdat_size'] * 8.0)
+        times = np.column_stack((starts, ends)).ravel()
+        cumulative = np.column_stack((np.append(0.0, bits[:-1]), bits)).ravel()
+
+        gops = self._keyframe_gop_table
+        gop_starts = ticks_to_seconds(gops['start_pts'], self.time_base)
+        gop_ends = gop_starts + gops['duration']
+        gops['size'] = np.rint(np.interp(gop_ends, times, cumulative) - np.interp(gop_starts, times, cumulative))
+        gops['size_source'] = GOP_SIZE_FRAGMENTS
+
+    def _invalidate(self):
+        self._gop_table = None
 
     def parse_from_json(self, json):
         self._json = json
-        self.frame_rate = eval(json['avg_frame_rate'])
-        self.time_base = eval(json['time_base'])
-        self.duration = timedelta(seconds=json['duration_ts'] * self.time_base)
+        self.frame_rate = parse_rate(json.get('avg_frame_rate')) or parse_rate(json.get('r_frame_rate'))
+        self.time_base = json['time_base']
+        if isinstance(json.get('duration_ts'), int):
+            self.duration = timedelta(microseconds=round(json['duration_ts'] * self.time_base * 1000000))
+        else:
+            # "N/A" when unknown
+            duration = ffprobe_parser._to_float(json.get('duration'))
+            self.duration = timedelta(seconds=duration) if duration is not None else None
         self.index = json['index']
 
-    def to_label(self):
-        avg_bitrate = statistics.mean([f.bitrate for f in self.frames])
+    def to_label(self, peak_windows=()):
+        bitrates = BitrateCalculator.from_stream(self)
+        avg_bitrate = bitrates.average()
 
         span = "<i>analysis for timespan <br>{} to {}</i>".format(
             time_to_str(self.frames[0].start_time, self.duration),
@@ -138,6 +615,29 @@ class Stream(object):
             avg=sizeof_fmt(avg_bitrate, 'bps'),
         )
 
+        # sampled overview: statistics of the sampled windows, extrapolated to the whole stream
+        if self.samples:
+            covered = bitrates.covered_time(bitrates.end_time)
+            span = "<i>sampled overview: {count} windows<br>{covered:.0f}s ({ratio:.1%}) of {start} to {end}</i>".format(
+                count=len(self.samples),
+                covered=covered,
+                ratio=covered / max(self.duration.total_seconds(), covered),
+                start=time_to_str(self.frames[0].start_time, self.duration),
+                end=time_to_str(self.frames[-1].end_time, self.duration)
+            )
+            analysis = "avg bitrate (sampled): <b>{avg}</b><br>est. size: <b>{size}</b><br>est. frames: <b>{frames}</b><br>".format(
+                avg=sizeof_fmt(avg_bitrate, 'bps'),
+                size=sizeof_fmt(avg_bitrate * self.duration.total_seconds(), 'b'),
+                frames=int(round(len(self._table) * self.duration.total_seconds() / covered))
+            )
+        for window in peak_windows:
+            peak, _ = bitrates.peak(window)
+            analysis += "peak bitrate ({window}s){sampled}: <b>{peak}</b><br>".format(
+                window=window,
+                sampled=" (sampled)" if self.samples else "",
+                peak=sizeof_fmt(peak, 'bps'),
+            )
+
         label = "resolution: <b>{w}x{h}</b><br>duration: <b>{duration}</b><br><br>{span}<br>{analysis}".format(
             duration=str(self.duration)[:-3],
             analysis=analysis,
@@ -163,34 +663,41 @@ class Frame(object):
         return "frame"
 
     def parse_from_json(self, json):
-        self._json = json
         self.pkt_pts = json['pkt_pts']
         self.pkt_size = int(json['pkt_size'])
         self.pict_type = json['pict_type']
         self.key_frame = json['key_frame']
         self.media_type = json['media_type']
-        if self.pict_type == 'B':
-            self.__class__ = BFrame
-        if self.pict_type == 'P':
-            self.__class__ = PFrame
-        if self.pict_type == 'I':
-            if self.key_frame:
-                self.__class__ = IDRFrame
-            else:
-                self.__class__ = IFrame
+        self.__class__ = frame_class_for(self.pict_type, self.key_frame)
 
     # size in bits
     @property
     def size(self):
         return self.pkt_size * 8
 
+    @property
+    def time_base(self):
+        return self._time_base
+
+    @time_base.setter
+    def time_base(self, time_base):
+        self._time_base = to_fraction(time_base)
+
+    @property
+    def frame_rate(self):
+        return self._frame_rate
+
+    @frame_rate.setter
+    def frame_rate(self, frame_rate):
+        self._frame_rate = to_fraction(frame_rate)
+
     # duration in sec
     # TODO - it would be better to use pkt_duration_time, particularly for variable framerate
     # However, ffprobe doesn't output it every time...
     @property
     def duration(self):
         if self.frame_rate:
-            return timedelta(seconds=1 / self.frame_rate)
+            return timedelta(microseconds=round(1000000 / self.frame_rate))
         else:
             raise Exception("No framerate defined on the frame")
 
@@ -199,21 +706,23 @@ class Frame(object):
     def bitrate(self):
         # To get instantaneous frame bitrate we must consider the frame rate
         if self.frame_rate:
-            return self.size * self.frame_rate
+            return float(self.size * self.frame_rate)
         else:
             raise Exception("No framerate defined on the frame")
 
     @property
     def start_time(self):
         if self.time_base:
-            return datetime.fromtimestamp(self.pkt_pts * self.time_base, tz=pytz.UTC)
+            return seconds_to_datetime(self.pkt_pts * self.time_base)
         else:
             raise Exception("No timebase defined on the frame")
 
     @property
     def end_time(self):
         if self.time_base:
-            return datetime.fromtimestamp((self.pkt_pts * self.time_base) + self.duration.total_seconds(), tz=pytz.UTC)
+            if not self.frame_rate:
+                raise Exception("No framerate defined on the frame")
+            return seconds_to_datetime(self.pkt_pts * self.time_base + 1 / self.frame_rate)
         else:
             raise Exception("No timebase defined on the frame")
 
@@ -274,37 +783,81 @@ class IDRFrame(IFrame):
         return repr(self)
 
 
+# Sequence of the GOPs of a stream. GOP objects are only created when an item is accessed.
+class GOPList(object):
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __len__(self):
+        return len(self._stream.gop_table)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("GOP index out of range")
+        return GOP(position=idx + 1, stream=self._stream, row=self._stream.gop_table[idx])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
 class GOP(object):
-    def __init__(self, position=None):
+    def __init__(self, position=None, stream=None, row=None):
         self.closed = False
         self.position = position
         self._frames = []
+        # GOPs of a stream are views on its gop table
+        self._stream = stream
+        self._row = row
+        if row is not None:
+            self.closed = bool(row['closed'])
 
     @property
     def frames(self):
+        if self._row is not None:
+            # only the keyframe is known in keyframes mode
+            if self._stream.keyframes_only:
+                return self._stream.frames[self.position - 1:self.position]
+            return self._stream.frames[int(self._row['start']):int(self._row['end'])]
         return self._frames
 
     @property
     def length(self):
+        if self._row is not None:
+            return int(self._row['end'] - self._row['start'])
         return len(self.frames)
 
     @property
     def size(self):
+        if self._row is not None:
+            return int(self._row['size'])
         return reduce(lambda x, y: x + y.size, self.frames, 0)
 
     @property
     def start_time(self):
+        if self._row is not None:
+            return seconds_to_datetime(int(self._row['start_pts']) * self._stream.time_base)
         return self.frames[0].start_time
 
     @property
     def end_time(self):
+        if self._row is not None:
+            return self.start_time + self.duration
         return self.frames[-1].end_time
 
     @property
     def duration(self):
+        if self._row is not None:
+            return timedelta(seconds=float(self._row['duration']))
         return self.end_time - self.start_time
 
     def add_frame(self, frame):
+        if self._row is not None:
+            raise Exception("Frames can't be added to the GOP of a stream")
         self._frames.append(frame)
 
         if isinstance(frame, IDRFrame):
@@ -319,7 +872,7 @@ class GOP(object):
         gtype = 'CLOSED' if self.closed else 'OPEN'
 
         return 'GOP: {frames} {count} {gtype}'.format(frames=frames_repr,
-                                                      count=len(self.frames),
+                                                      count=self.length,
                                                       gtype=gtype)
 
     def to_label(self):
@@ -339,6 +892,10 @@ class MP4Track(object):
         self._duration = None
         self._parser = None
         self._fragments = []
+        # sorted start and end ticks of the fragments, built on demand
+        self._fragment_index = None
+        # frames of each fragment (see join_frames)
+        self._frame_stats = None
         self.id = track_id
 
         if parser:
@@ -365,13 +922,119 @@ class MP4Track(object):
     def fragments(self):
         return self._fragments
 
+    def add_fragments(self, fragments):
+        for fragment in fragments:
+            fragment.track = self
+            self._fragments.append(fragment)
+        self._fragment_index = None
+        self._frame_stats = None
+
+    # removes the fragments that end before a decode time (in time scale units)
+    def drop_fragments_before(self, decode_time):
+        self._fragments = [f for f in self._fragments if f.decode_time + f.duration_ticks > decode_time]
+        self._fragment_index = None
+        self._frame_stats = None
+
+    # start and end of each fragment, in time scale units (fragments are in decode order)
+    @property
+    def fragment_starts(self):
+        return self._get_fragment_index()[0]
+
+    @property
+    def fragment_ends(self):
+        return self._get_fragment_index()[1]
+
+    # Assigns the frames of a stream to the fragments that contain them (by pts), and computes the frame
+    # statistics of each fragment. Returns the fragment index of each frame (-1 if not in a fragment).
+    def join_frames(self, stream):
+        table = stream.table
+        if len(table) and len(self._fragments) and self.time_scale:
+            index = self.fragment_at(table.pts, stream.time_base)
+        else:
+            index = np.full(len(table), -1, dtype=np.int64)
+        self._frame_stats = fragment_frame_stats(table, index, len(self._fragments))
+        for fragment, stats in zip(self._fragments, self._frame_stats):
+            fragment.frame_stats = stats
+        return index
+
+    # frame statistics of the fragments (see FRAGMENT_STATS_DTYPE), or None if no frames were joined
+    @property
+    def frame_stats(self):
+        return self._frame_stats
+
+    def _get_fragment_index(self):
+        if self._fragment_index is None:
+            table = self.get_fragment_table()
+            starts = table['decode_time']
+            ends = starts + table['duration']
+            # ends are made non-decreasing, so that they can be searched as well
+            self._fragment_index = (starts, np.maximum.accumulate(ends) if len(ends) else ends)
+        return self._fragment_index
+
+    # ticks in the track time scale, for a datetime or for ticks in another time base
+    def to_ticks(self, time, time_base=None):
+        if isinstance(time, datetime):
+            microseconds = (time - EPOCH) // timedelta(microseconds=1)
+            return (microseconds * self.time_scale + 500000) // 1000000
+        if time_base is not None:
+            time_base = to_fraction(time_base) * self.time_scale
+            return np.asarray(time, dtype=np.int64) * time_base.numerator // time_base.denominator
+        return time
+
+    # slice of the fragments that overlap [start, end), in ticks or datetimes, found by bisection
+    def overlapping(self, start, end):
+        lo = int(np.searchsorted(self.fragment_ends, self.to_ticks(start), side='right'))
+        hi = int(np.searchsorted(self.fragment_starts, self.to_ticks(end), side='left'))
+        return slice(lo, max(lo, hi))
+
+    # index of the fragment that contains a time (ticks, or pts in time_base), or -1.
+    # Also works on arrays of times.
+    def fragment_at(self, time, time_base=None):
+        ticks = self.to_ticks(time, time_base)
+        idx = np.searchsorted(self.fragment_starts, ticks, side='right') - 1
+        inside = (idx >= 0) & (ticks < self.fragment_ends[np.maximum(idx, 0)]) if len(self.fragment_starts) else False
+        result = np.where(inside, idx, -1)
+        return int(result) if np.ndim(result) == 0 else result
+
     def create_from_parser(self, parser):
-        if isinstance(parser, mp4dump_parser.MP4DumpResponse):
+        if isinstance(parser, (mp4dump_parser.MP4DumpResponse, mp4box_parser.MP4BoxParser)):
             self._parser = parser
             parser.get_info_for_track(self)
             self._fragments = parser.get_fragments_for_track(self)
+            self._fragment_index = None
+            self._frame_stats = None
         else:
-            raise Exception("Argument 'origin' should be of type MP4DumpResponse")
+            raise Exception("Argument 'origin' should be of type MP4DumpResponse or MP4BoxParser")
+
+    # fragments as a structured array (see FRAGMENT_DTYPE)
+    def get_fragment_table(self):
+        return np.array([(f.decode_time, f.sample_count, f.sample_duration or 0, f.duration_ticks, f.mdat_size, f.position)
+                         for f in self.fragments], dtype=FRAGMENT_DTYPE)
+
+    # samples of all the fragments, in order (see SAMPLE_DTYPE).
+    # Fragments without sample information (eg. from mp4dump) do not contribute.
+    def get_sample_table(self):
+        samples = [f.samples for f in self.fragments if f.samples is not None]
+        return np.concatenate(samples) if samples else np.zeros(0, dtype=SAMPLE_DTYPE)
+
+    # samples are split between the fragments by sample count, if there are samples for all of them
+    def set_fragment_table(self, table, samples=None):
+        self._fragments = []
+        self._fragment_index = None
+        self._frame_stats = None
+        if samples is not None and len(samples) != table['sample_count'].sum():
+            samples = None
+        first = 0
+        for row in table:
+            fragment = Fragment(track=self, position=int(row['position']))
+            fragment.decode_time = int(row['decode_time'])
+            fragment.sample_count = int(row['sample_count'])
+            fragment.sample_duration = int(row['sample_duration'])
+            fragment.mdat_size = int(row['mdat_size'])
+            if samples is not None:
+                fragment.samples = samples[first:first + fragment.sample_count]
+                first += fragment.sample_count
+            self._fragments.append(fragment)
 
     def to_label(self):
         label = ""
@@ -396,11 +1059,21 @@ class Fragment(object):
         self._mdat = None
         self._track = None
 
+        # values read from the moof and mdat boxes, in track time scale units and bytes
+        self.decode_time = None
+        self.sample_count = None
+        self.sample_duration = None
+        self.mdat_size = None
+        self._samples = None
+        # frame statistics (see FRAGMENT_STATS_DTYPE), once frames are joined to the track
+        self.frame_stats = None
+
         self.track = track
         self.moof = moof
         self.mdat = mdat
         self.position = position
 
+    # moof box, as output by mp4dump
     @property
     def moof(self):
         return self._moof
@@ -408,7 +1081,10 @@ class Fragment(object):
     @moof.setter
     def moof(self, moof):
         self._moof = moof
+        if moof:
+            mp4dump_parser.read_moof(self, moof)
 
+    # mdat box, as output by mp4dump
     @property
     def mdat(self):
         return self._mdat
@@ -416,6 +1092,8 @@ class Fragment(object):
     @mdat.setter
     def mdat(self, mdat):
         self._mdat = mdat
+        if mdat:
+            self.mdat_size = mdat['size']
 
     @property
     def track(self):
@@ -425,20 +1103,35 @@ class Fragment(object):
     def track(self, track):
         self._track = track
 
+    # samples read from the trun boxes (see SAMPLE_DTYPE), or None if only the sample count is known
+    @property
+    def samples(self):
+        return self._samples
+
+    @samples.setter
+    def samples(self, samples):
+        self._samples = samples
+        if samples is not None:
+            self.sample_count = len(samples)
+
+    # duration in track time scale units: exact with the samples, else from the default sample duration
+    @property
+    def duration_ticks(self):
+        if self._samples is not None:
+            return int(self._samples['duration'].sum(dtype=np.int64))
+        return (self.sample_duration or 0) * (self.sample_count or 0)
+
     @property
     def start_time(self):
-        decodeTime = self.moof['children'][1]['children'][1]['base media decode time']
-        return datetime.fromtimestamp(decodeTime / self.track.time_scale, tz=pytz.UTC)
+        return seconds_to_datetime(Fraction(self.decode_time, self.track.time_scale))
 
     @property
     def length(self):
-        sampleCount = self.moof['children'][1]['children'][2]['sample count']
-        return sampleCount
+        return self.sample_count
 
     @property
     def duration(self):
-        sampleDuration = self.moof['children'][1]['children'][0]['default sample duration']
-        return timedelta(seconds=sampleDuration * self.length / self.track.time_scale)
+        return timedelta(microseconds=round(Fraction(self.duration_ticks * 1000000, self.track.time_scale)))
 
     @property
     def end_time(self):
@@ -446,7 +1139,7 @@ class Fragment(object):
 
     @property
     def size(self):
-        return self.mdat['size'] * 8
+        return self.mdat_size * 8
 
     def to_label(self):
         str = "Fragment {pos}<br>{nb_pic} samples<br>from {start}<br>length <b>{duration}</b><br>{size}".format(
@@ -456,4 +1149,18 @@ class Fragment(object):
             start=time_to_str(self.start_time, self.duration),
             duration="{}s".format(self.duration.total_seconds())
         )
+        if self._samples is not None and self._samples['size'].any():
+            sizes = self._samples['size']
+            str += "<br>sample size: min {min}, avg {avg}, max {max}".format(
+                min=sizeof_fmt(int(sizes.min()) * 8, suffix='b'),
+                avg=sizeof_fmt(float(sizes.mean()) * 8, suffix='b'),
+                max=sizeof_fmt(int(sizes.max()) * 8, suffix='b'))
+        stats = self.frame_stats
+        if stats is not None and stats['frames']:
+            str += "<br>{frames} frames: {i} I ({idr} IDR), {p} P, {b} B<br>{start}<br>largest frame: {largest} (#{pos})".format(
+                frames=stats['frames'], i=stats['i_frames'], idr=stats['idr_frames'],
+                p=stats['p_frames'], b=stats['b_frames'],
+                start="starts on IDR" if stats['starts_on_idr'] else "<b>does not start on IDR</b>",
+                largest=sizeof_fmt(int(stats['largest_frame']) * 8, suffix='b'),
+                pos=stats['largest_frame_position'])
         return str
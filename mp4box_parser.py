@@ -0,0 +1,312 @@
+import mmap
+import struct
+import numpy as np
+import models
+
+
+# tfhd flags
+TFHD_BASE_DATA_OFFSET = 0x000001
+TFHD_SAMPLE_DESCRIPTION_INDEX = 0x000002
+TFHD_DEFAULT_SAMPLE_DURATION = 0x000008
+TFHD_DEFAULT_SAMPLE_SIZE = 0x000010
+TFHD_DEFAULT_SAMPLE_FLAGS = 0x000020
+
+# trun flags
+TRUN_DATA_OFFSET = 0x000001
+TRUN_FIRST_SAMPLE_FLAGS = 0x000004
+TRUN_SAMPLE_DURATION = 0x000100
+TRUN_SAMPLE_SIZE = 0x000200
+TRUN_SAMPLE_FLAGS = 0x000400
+TRUN_SAMPLE_COMPOSITION_TIME_OFFSET = 0x000800
+
+# per-sample fields of a trun, in the order they are stored
+TRUN_FIELDS = [
+    (TRUN_SAMPLE_DURATION, 'duration'),
+    (TRUN_SAMPLE_SIZE, 'size'),
+    (TRUN_SAMPLE_FLAGS, 'flags'),
+    (TRUN_SAMPLE_COMPOSITION_TIME_OFFSET, 'composition_offset'),
+]
+
+# boxes that only contain other boxes, and that we need to look into
+CONTAINER_BOXES = ['moov', 'trak', 'mdia', 'mvex', 'moof', 'traf']
+
+
+# A box header: type, offset of the box in the buffer, header size and total size (header included)
+class Box(object):
+    def __init__(self, box_type, offset, header_size, size):
+        self.type = box_type
+        self.offset = offset
+        self.header_size = header_size
+        self.size = size
+
+    @property
+    def payload(self):
+        return self.offset + self.header_size
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+
+# In-process replacement for mp4dump.
+# The file is memory-mapped, and only the headers of the boxes we need are read:
+# payloads (mdat in particular) are skipped by offset.
+class MP4BoxParser(object):
+    def __init__(self, filename=None, data=None):
+        self._filename = filename
+        self._data = data
+
+        if filename:
+            print("Parsing {} to extract track and fragment information".format(filename))
+            print()
+
+    def _open(self):
+        if self._data is not None:
+            return memoryview(self._data), None
+
+        f = open(self._filename, 'rb')
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            f.close()
+            raise Exception("Cannot parse empty file {}".format(self._filename))
+        return buf, f
+
+    @staticmethod
+    def _close(buf, f):
+        if f:
+            buf.close()
+            f.close()
+
+    # iterate over the boxes between 2 offsets, stopping at the first incomplete box
+    @staticmethod
+    def iter_boxes(buf, start=0, end=None):
+        if end is None:
+            end = len(buf)
+        offset = start
+        while offset + 8 <= end:
+            size, box_type = struct.unpack_from('>I4s', buf, offset)
+            header_size = 8
+            if size == 1:
+                if offset + 16 > end:
+                    break
+                size = struct.unpack_from('>Q', buf, offset + 8)[0]
+                header_size = 16
+            elif size == 0:
+                size = end - offset
+
+            if size < header_size:
+                raise Exception("Invalid size for box '{}' at offset {}".format(box_type, offset))
+            if offset + size > end:
+                break
+
+            yield Box(box_type.decode('latin-1'), offset, header_size, size)
+            offset += size
+
+    @classmethod
+    def find_boxes(cls, buf, parent, box_type):
+        return [box for box in cls.iter_boxes(buf, parent.payload, parent.end) if box.type == box_type]
+
+    @classmethod
+    def find_box(cls, buf, parent, box_type):
+        for box in cls.iter_boxes(buf, parent.payload, parent.end):
+            if box.type == box_type:
+                return box
+        return None
+
+    # version and flags of a full box
+    @staticmethod
+    def _full_box_header(buf, box):
+        value = struct.unpack_from('>I', buf, box.payload)[0]
+        return value >> 24, value & 0xFFFFFF
+
+    @classmethod
+    def _read_mvhd(cls, buf, box):
+        version, _ = cls._full_box_header(buf, box)
+        if version == 1:
+            timescale, duration = struct.unpack_from('>IQ', buf, box.payload + 4 + 16)
+        else:
+            timescale, duration = struct.unpack_from('>II', buf, box.payload + 4 + 8)
+        return timescale, duration
+
+    @classmethod
+    def _read_tkhd_track_id(cls, buf, box):
+        version, _ = cls._full_box_header(buf, box)
+        return struct.unpack_from('>I', buf, box.payload + 4 + (16 if version == 1 else 8))[0]
+
+    @classmethod
+    def _read_mehd(cls, buf, box):
+        version, _ = cls._full_box_header(buf, box)
+        return struct.unpack_from('>Q' if version == 1 else '>I', buf, box.payload + 4)[0]
+
+    @classmethod
+    def _read_tfhd(cls, buf, box):
+        _, flags = cls._full_box_header(buf, box)
+        offset = box.payload + 4
+        tfhd = {'track_id': struct.unpack_from('>I', buf, offset)[0]}
+        offset += 4
+        if flags & TFHD_BASE_DATA_OFFSET:
+            offset += 8
+        if flags & TFHD_SAMPLE_DESCRIPTION_INDEX:
+            offset += 4
+        for flag, name in [(TFHD_DEFAULT_SAMPLE_DURATION, 'duration'),
+                           (TFHD_DEFAULT_SAMPLE_SIZE, 'size'),
+                           (TFHD_DEFAULT_SAMPLE_FLAGS, 'flags')]:
+            if flags & flag:
+                tfhd[name] = struct.unpack_from('>I', buf, offset)[0]
+                offset += 4
+        return tfhd
+
+    @classmethod
+    def _read_tfdt(cls, buf, box):
+        version, _ = cls._full_box_header(buf, box)
+        return struct.unpack_from('>Q' if version == 1 else '>I', buf, box.payload + 4)[0]
+
+    # samples of a trun (see models.SAMPLE_DTYPE). The per-sample fields are decoded in one go with numpy,
+    # the fields missing from the trun come from the defaults (tfhd, then trex).
+    @classmethod
+    def _read_trun(cls, buf, box, defaults):
+        version, flags = cls._full_box_header(buf, box)
+        count = struct.unpack_from('>I', buf, box.payload + 4)[0]
+        offset = box.payload + 8
+        if flags & TRUN_DATA_OFFSET:
+            offset += 4
+        first_sample_flags = None
+        if flags & TRUN_FIRST_SAMPLE_FLAGS:
+            first_sample_flags = struct.unpack_from('>I', buf, offset)[0]
+            offset += 4
+
+        # composition offsets are signed in version 1
+        fields = [(name, '>i4' if name == 'composition_offset' and version == 1 else '>u4')
+                  for flag, name in TRUN_FIELDS if flags & flag]
+        entry = np.dtype(fields)
+        if offset + count * entry.itemsize > box.end:
+            raise Exception("Invalid sample count {} for box 'trun' at offset {}".format(count, box.offset))
+
+        samples = np.zeros(count, dtype=models.SAMPLE_DTYPE)
+        for name in ('duration', 'size', 'flags'):
+            samples[name] = defaults.get(name, 0)
+        if fields:
+            # copied out of the buffer, which can be a memory map closed after parsing
+            entries = np.frombuffer(buf, dtype=entry, count=count, offset=offset)
+            for name, _ in fields:
+                samples[name] = entries[name]
+            del entries
+        if first_sample_flags is not None and count:
+            samples['flags'][0] = first_sample_flags
+        return samples
+
+    # moov information: movie time scale and duration, and per track: id, media time scale and sample defaults
+    def _read_moov(self, buf, moov):
+        info = {'tracks': []}
+        for box in self.iter_boxes(buf, moov.payload, moov.end):
+            if box.type == 'mvhd':
+                info['timescale'], info['duration'] = self._read_mvhd(buf, box)
+            elif box.type == 'trak':
+                trak = {}
+                tkhd = self.find_box(buf, box, 'tkhd')
+                if tkhd:
+                    trak['track_id'] = self._read_tkhd_track_id(buf, tkhd)
+                mdia = self.find_box(buf, box, 'mdia')
+                mdhd = self.find_box(buf, mdia, 'mdhd') if mdia else None
+                if mdhd:
+                    trak['timescale'], trak['duration'] = self._read_mvhd(buf, mdhd)
+                info['tracks'].append(trak)
+            elif box.type == 'mvex':
+                for child in self.iter_boxes(buf, box.payload, box.end):
+                    if child.type == 'mehd':
+                        info['fragment_duration'] = self._read_mehd(buf, child)
+                    elif child.type == 'trex':
+                        # version/flags, track_ID, default_sample_description_index,
+                        # default_sample_duration, default_sample_size, default_sample_flags
+                        track_id, _, duration, size, flags = struct.unpack_from('>IIIII', buf, child.payload + 4)
+                        info.setdefault('trex', {})[track_id] = {'duration': duration, 'size': size, 'flags': flags}
+        return info
+
+    @staticmethod
+    def _select_track(info, track):
+        for trak in info['tracks']:
+            if track.id is None or trak.get('track_id') == track.id:
+                return trak
+        return {}
+
+    def get_info_for_track(self, track):
+        if isinstance(track, models.MP4Track):
+            buf, f = self._open()
+            try:
+                for box in self.iter_boxes(buf):
+                    if box.type == 'moov':
+                        info = self._read_moov(buf, box)
+                        trak = self._select_track(info, track)
+
+                        duration = info.get('duration') or info.get('fragment_duration')
+                        if duration and info.get('timescale'):
+                            track.duration = duration / info['timescale']
+                        if track.id is None:
+                            track.id = trak.get('track_id')
+                        if not track.time_scale:
+                            track.time_scale = trak.get('timescale')
+
+                    # scale factor for decode timings
+                    if box.type == 'sidx':
+                        track.time_scale = struct.unpack_from('>I', buf, box.payload + 4 + 4)[0]
+                    # fragments come after the header boxes
+                    if box.type == 'moof':
+                        break
+            finally:
+                self._close(buf, f)
+        else:
+            raise Exception("'track' argument should be a MP4Track")
+
+    def get_fragments_for_track(self, track):
+        fragments = []
+        fragment = None
+        defaults = {}
+        count = 1
+
+        if isinstance(track, models.MP4Track):
+            buf, f = self._open()
+            try:
+                for box in self.iter_boxes(buf):
+                    if box.type == 'moov':
+                        info = self._read_moov(buf, box)
+                        defaults = info.get('trex', {}).get(self._select_track(info, track).get('track_id'), {})
+
+                    # start of a fragment
+                    if box.type == 'moof':
+                        fragment = self._read_moof(buf, box, track, defaults)
+
+                    # mdat is the last element required to create a fragment
+                    # no moof would mean non-fragmented MP4
+                    if box.type == 'mdat' and fragment:
+                        fragment.mdat_size = box.size
+                        fragment.position = count
+                        fragments.append(fragment)
+                        fragment = None
+                        count += 1
+            finally:
+                self._close(buf, f)
+
+            return fragments
+        else:
+            raise Exception("'track' argument should be a MP4Track")
+
+    def _read_moof(self, buf, moof, track, defaults):
+        for traf in self.find_boxes(buf, moof, 'traf'):
+            tfhd_box = self.find_box(buf, traf, 'tfhd')
+            if not tfhd_box:
+                continue
+            tfhd = self._read_tfhd(buf, tfhd_box)
+            if track.id is not None and tfhd['track_id'] != track.id:
+                continue
+
+            traf_defaults = dict(defaults, **{name: tfhd[name] for name in ('duration', 'size', 'flags') if name in tfhd})
+            fragment = models.Fragment(track=track)
+            fragment.sample_duration = traf_defaults.get('duration')
+            tfdt = self.find_box(buf, traf, 'tfdt')
+            fragment.decode_time = self._read_tfdt(buf, tfdt) if tfdt else 0
+            truns = [self._read_trun(buf, trun, traf_defaults) for trun in self.find_boxes(buf, traf, 'trun')]
+            fragment.samples = np.concatenate(truns) if truns else np.zeros(0, dtype=models.SAMPLE_DTYPE)
+            return fragment
+        return None
@@ -1,11 +1,67 @@
 import subprocess
 import json
+import numpy as np
 import models
 
+# per-sample fields of the trun entries (output with --verbosity 1), and the matching sample defaults
+TRUN_ENTRY_FIELDS = [('d', 'duration'), ('s', 'size'), ('f', 'flags'), ('c', 'composition_offset')]
+SAMPLE_DEFAULTS = [('default sample duration', 'duration'),
+                   ('default sample size', 'size'),
+                   ('default sample flags', 'flags')]
+
+
+# children of a box with a given name
+def find_children(box, name):
+    return [child for child in box.get('children', []) if child['name'] == name]
+
+
+def find_child(box, name):
+    children = find_children(box, name)
+    return children[0] if children else None
+
+
+# sample defaults of a tfhd or trex box
+def sample_defaults(box):
+    return {field: box[key] for key, field in SAMPLE_DEFAULTS if key in box} if box else {}
+
+
+# samples of a trun box (see models.SAMPLE_DTYPE), from its entries or from the defaults
+def read_trun(trun, defaults):
+    entries = trun.get('entries') or []
+    samples = np.zeros(trun['sample count'], dtype=models.SAMPLE_DTYPE)
+    for key, field in TRUN_ENTRY_FIELDS:
+        if entries and key in entries[0]:
+            samples[field] = [entry[key] for entry in entries]
+        elif field in defaults:
+            samples[field] = defaults[field]
+    if 'first sample flags' in trun and len(samples):
+        samples['flags'][0] = trun['first sample flags']
+    return samples
+
+
+# fills a fragment from a moof box, for a track (or the first track if track_id is None).
+# Boxes are looked up by name, as their order can vary.
+def read_moof(fragment, moof, track_id=None, defaults=None):
+    for traf in find_children(moof, 'traf'):
+        tfhd = find_child(traf, 'tfhd')
+        if tfhd is None or (track_id is not None and tfhd.get('track ID') != track_id):
+            continue
+
+        traf_defaults = dict(defaults or {}, **sample_defaults(tfhd))
+        fragment.sample_duration = traf_defaults.get('duration')
+        tfdt = find_child(traf, 'tfdt')
+        fragment.decode_time = tfdt['base media decode time'] if tfdt else 0
+        truns = [read_trun(trun, traf_defaults) for trun in find_children(traf, 'trun')]
+        fragment.samples = np.concatenate(truns) if truns else np.zeros(0, dtype=models.SAMPLE_DTYPE)
+        return True
+    return False
+
 
 class MP4DumpCommand(object):
     def __init__(self, executable='mp4dump', filename=None):
-        self._command = '"{mp4dump}" --format json {filename}'.format(mp4dump=executable, filename=filename)
+        # verbosity 1 outputs the entries of trun boxes
+        self._command = '"{mp4dump}" --format json --verbosity 1 {filename}'.format(mp4dump=executable,
+                                                                                  filename=filename)
 
         print("Executing mp4dump to extract track and fragment information")
         print(self._command)
@@ -21,13 +77,29 @@ class MP4DumpResponse(object):
     def __init__(self, j):
         self._json = j
 
-    # TODO: cater for multiple tracks
+    # trak box of a track, or the first one if the track has no id
+    @staticmethod
+    def _find_trak(moov, track):
+        for trak in find_children(moov, 'trak'):
+            tkhd = find_child(trak, 'tkhd')
+            if track.id is None or (tkhd and tkhd.get('id') == track.id):
+                return trak
+        return None
+
     def get_info_for_track(self, track):
         if isinstance(track, models.MP4Track):
             for idx, box in enumerate(self._json):
                 if box['name'] == 'moov':
-                    # TODO - crude!  put more logic for multiple use cases (variable structure)
-                    track.duration = box['children'][0]['duration'] / box['children'][0]['timescale']
+                    mvhd = find_child(box, 'mvhd')
+                    if mvhd and mvhd.get('timescale'):
+                        track.duration = mvhd['duration'] / mvhd['timescale']
+                    trak = self._find_trak(box, track)
+                    if trak:
+                        if track.id is None:
+                            track.id = find_child(trak, 'tkhd').get('id')
+                        mdhd = find_child(find_child(trak, 'mdia') or {}, 'mdhd')
+                        if mdhd and not track.time_scale:
+                            track.time_scale = mdhd['timescale']
 
                 # scale factor for decode timings
                 if box['name'] == 'sidx':
@@ -35,15 +107,21 @@ class MP4DumpResponse(object):
         else:
             raise Exception("'track' argument should be a MP4Track")
 
-    # TODO: cater for multiple tracks
     def get_fragments_for_track(self, track):
         fragments = []
         moof = None
         mdat = None
+        defaults = {}
         count = 1
 
         if isinstance(track, models.MP4Track):
             for box in self._json:
+                if box['name'] == 'moov':
+                    for trex in find_children(find_child(box, 'mvex') or {}, 'trex'):
+                        if track.id is None or trex.get('track id') == track.id:
+                            defaults = sample_defaults(trex)
+                            break
+
                 # start of a fragment
                 if box['name'] == 'moof':
                     moof = box
@@ -55,9 +133,11 @@ class MP4DumpResponse(object):
                     # mdat is the last element required to create a fragment
                     # no moof would mean non-fragmented MP4
                     if moof and mdat:
-                        fragment = models.Fragment(moof=moof, mdat=mdat, track=track, position=count)
-                        fragments.append(fragment)
-                        count+=1
+                        fragment = models.Fragment(mdat=mdat, track=track, position=count)
+                        if read_moof(fragment, moof, track.id, defaults):
+                            fragments.append(fragment)
+                            count += 1
+                        moof = None
 
             return fragments
         else:
@@ -0,0 +1,133 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from models import sizeof_fmt
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+# peak resident set size of the process so far, in bytes (None if unknown)
+def max_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _fmt_bytes(value):
+    return '-' if value is None else sizeof_fmt(value, 'B')
+
+
+# Measures the stages of an analysis: wall-clock and CPU time, and peak RSS of the process at the end of the stage.
+# With trace_memory, also the peak memory allocated during the stage, with tracemalloc: it slows allocations down
+# (Python stages run several times slower), so times are then skewed.
+# Stages are recorded in the order they end. Stages can run in threads, or inside other stages: memory is then only
+# measured by the outer stage, and CPU time is the time of the whole process.
+class Profiler(object):
+    def __init__(self, trace_memory=False):
+        self._trace_memory = trace_memory
+        self._stages = []
+        self._counts = OrderedDict()
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @property
+    def stages(self):
+        return self._stages
+
+    # number of objects (eg. frames, GOPs and fragments) of the analysis
+    @property
+    def counts(self):
+        return self._counts
+
+    def count(self, name, value):
+        self._counts[name] = value
+
+    # context manager measuring a stage. The record is yielded, so that the stage can add its own values
+    @contextmanager
+    def stage(self, name, **values):
+        record = OrderedDict(name=name)
+        record.update(values)
+
+        with self._lock:
+            tracing = self._trace_memory and not tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.start()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record['start'] = wall - self._origin
+            record['wall'] = time.perf_counter() - wall
+            record['cpu'] = time.process_time() - cpu
+            if tracing:
+                record['peak_memory'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            record['max_rss'] = max_rss()
+            record['thread'] = threading.current_thread().name
+            with self._lock:
+                self._stages.append(record)
+
+    # table of the stages, in the order they started, and of the object counts
+    def summary(self):
+        lines = ["{:<32} {:>9} {:>9} {:>10} {:>10}".format('stage', 'wall (s)', 'cpu (s)', 'peak mem', 'max rss')]
+        for record in sorted(self._stages, key=lambda record: record['start']):
+            name = record['name']
+            if 'stream' in record:
+                name = "{} (stream {})".format(name, record['stream'])
+            lines.append("{:<32} {:>9.3f} {:>9.3f} {:>10} {:>10}".format(
+                name, record['wall'], record['cpu'], _fmt_bytes(record.get('peak_memory')),
+                _fmt_bytes(record.get('max_rss'))))
+        if self._counts:
+            lines.append(", ".join("{}: {}".format(name, value) for name, value in self._counts.items()))
+        return "\n".join(lines)
+
+    # stages as Chrome trace events (complete events, in microseconds), that can be loaded in chrome://tracing
+    # or https://ui.perfetto.dev. Each thread gets its own row.
+    def write_trace(self, file):
+        pid = os.getpid()
+        threads = []
+        events = []
+        for record in self._stages:
+            if record['thread'] not in threads:
+                threads.append(record['thread'])
+            events.append(OrderedDict([
+                ('name', record['name']),
+                ('cat', 'vviz'),
+                ('ph', 'X'),
+                ('ts', round(record['start'] * 1000000)),
+                ('dur', round(record['wall'] * 1000000)),
+                ('pid', pid),
+                ('tid', threads.index(record['thread'])),
+                ('args', OrderedDict((key, value) for key, value in record.items()
+                                     if key not in ('name', 'start', 'wall', 'thread'))),
+            ]))
+        for tid, thread in enumerate(threads):
+            events.append(OrderedDict([('name', 'thread_name'), ('ph', 'M'), ('pid', pid), ('tid', tid),
+                                       ('args', {'name': thread})]))
+
+        with open(file, 'w') as f:
+            json.dump(OrderedDict([('traceEvents', events),
+                                   ('displayTimeUnit', 'ms'),
+                                   ('otherData', self._counts)]), f, indent=1)
+
+
+# a stage of the profiler, or nothing (the record is then discarded) if there is no profiler
+@contextmanager
+def stage(profiler, name, **values):
+    if profiler is None:
+        yield OrderedDict(name=name)
+    else:
+        with profiler.stage(name, **values) as record:
+            yield record
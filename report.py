@@ -0,0 +1,137 @@
+import csv
+import json
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from bitrate import BitrateCalculator
+
+# Summary statistics of streams and tracks, as flat rows (one per file and video stream)
+# that can be written as CSV or JSON.
+# Bitrates are in bits per second, sizes in bits and durations in seconds.
+
+REPORT_FORMATS = ['json', 'csv']
+
+
+def _describe(prefix, values, row):
+    values = np.asarray(values, dtype=np.float64)
+    row[prefix + '_avg'] = float(values.mean()) if len(values) else None
+    row[prefix + '_min'] = float(values.min()) if len(values) else None
+    row[prefix + '_max'] = float(values.max()) if len(values) else None
+    row[prefix + '_stdev'] = float(values.std(ddof=1)) if len(values) > 1 else None
+
+
+def stream_stats(stream, peak_windows=()):
+    row = OrderedDict()
+    row['stream'] = stream.index
+    row['width'] = stream.width
+    row['height'] = stream.height
+    # estimated from the GOPs when only keyframes were read
+    row['frames'] = int(stream.gop_table['end'][-1]) if stream.keyframes_only else len(stream.table)
+
+    bitrates = BitrateCalculator.from_stream(stream)
+    row['duration'] = bitrates.end_time - bitrates.start_time
+    row['avg_bitrate'] = bitrates.average()
+    for window in peak_windows:
+        peak, start = bitrates.peak(window)
+        row['peak_bitrate_{}s'.format(window)] = peak
+        row['peak_start_{}s'.format(window)] = start - bitrates.start_time
+
+    gops = stream.gop_table
+    row['gops'] = len(gops)
+    row['closed_gops'] = int(gops['closed'].sum())
+    _describe('gop_frames', gops['end'] - gops['start'], row)
+    _describe('gop_duration', gops['duration'], row)
+    _describe('gop_size', gops['size'], row)
+    # estimated in keyframes mode when packet sizes are missing
+    row['gop_size_source'] = stream.gop_size_source
+    return row
+
+
+def track_stats(track):
+    row = OrderedDict()
+    fragments = track.get_fragment_table() if track else np.zeros(0)
+    row['fragments'] = len(fragments)
+    if len(fragments):
+        _describe('fragment_size', fragments['mdat_size'] * 8, row)
+        _describe('fragment_duration', fragments['duration'] / track.time_scale, row)
+    else:
+        _describe('fragment_size', [], row)
+        _describe('fragment_duration', [], row)
+    if track and track.frame_stats is not None and len(fragments):
+        row['fragments_not_on_idr'] = int((~track.frame_stats['starts_on_idr']).sum())
+    # sizes of the samples, when the fragments list them
+    samples = track.get_sample_table() if track else np.zeros(0)
+    _describe('sample_size', samples['size'] * 8 if len(samples) and samples['size'].any() else [], row)
+    return row
+
+
+# one row per fragment, with the frame statistics of the fragments once frames are joined (see MP4Track.join_frames)
+def fragment_rows(track):
+    rows = []
+    fragments = track.get_fragment_table() if track else np.zeros(0)
+    stats = track.frame_stats if track else None
+    for idx, fragment in enumerate(fragments):
+        row = OrderedDict()
+        row['fragment'] = int(fragment['position'])
+        row['start'] = fragment['decode_time'] / track.time_scale
+        row['duration'] = fragment['duration'] / track.time_scale
+        row['size'] = int(fragment['mdat_size']) * 8
+        row['samples'] = int(fragment['sample_count'])
+        if stats is not None:
+            for name in stats.dtype.names:
+                row[name] = stats[idx][name].item()
+        rows.append(row)
+    return rows
+
+
+# one row per video stream of a file: stream statistics, and statistics of the fragments of the track
+def analysis_rows(path, streams, track, peak_windows=()):
+    rows = []
+    for stream in streams:
+        # only keyframes are known in keyframes mode
+        if track is not None and not stream.keyframes_only:
+            track.join_frames(stream)
+        row = OrderedDict(file=path)
+        row.update(stream_stats(stream, peak_windows=peak_windows))
+        row.update(track_stats(track))
+        rows.append(row)
+    return rows
+
+
+# file name, or standard output for None or '-'
+@contextmanager
+def _open_output(file, newline=None):
+    if file is None or file == '-':
+        yield sys.stdout
+    else:
+        with open(file, 'w', newline=newline) as f:
+            yield f
+
+
+def write_csv(rows, file):
+    # rows can have different columns (eg. a failed analysis only has an error)
+    columns = []
+    for row in rows:
+        columns += [column for column in row if column not in columns]
+
+    with _open_output(file, newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_json(rows, file):
+    with _open_output(file) as f:
+        json.dump(rows, f, indent=2)
+        f.write('\n')
+
+
+def write_report(rows, file, format=None):
+    format = format or ('json' if file and file.endswith('.json') else 'csv')
+    if format == 'json':
+        write_json(rows, file)
+    elif format == 'csv':
+        write_csv(rows, file)
+    else:
+        raise Exception("Unknown report format {}".format(format))
@@ -1,13 +1,70 @@
 import unittest
+import argparse
+import contextlib
+import io
 import json
 from ffprobe_parser import *
 from mp4dump_parser import *
 from models import *
-from datetime import datetime, timedelta
+from mp4box_parser import *
+from cache import AnalysisCache
+from bitrate import BitrateCalculator
+from lod import *
+from report import stream_stats, track_stats, fragment_rows, analysis_rows, write_report
+from export import export_analysis, frame_columns
+import benchmark
+import vviz
+from profiler import Profiler
+from live import LiveAnalysis
+from html_output import encode_value, write_compact_html
+import base64
+import gzip
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import os
+import struct
+import tempfile
 
 
 def sec2ts(sec):
-    return datetime.fromtimestamp(sec, tz=pytz.UTC)
+    return datetime.fromtimestamp(sec, tz=timezone.utc)
+
+
+def mp4box(box_type, payload=b'', *children):
+    payload += b''.join(children)
+    return struct.pack('>I4s', 8 + len(payload), box_type.encode()) + payload
+
+
+def mp4fullbox(box_type, version, flags, payload=b'', *children):
+    return mp4box(box_type, struct.pack('>I', (version << 24) | flags) + payload, *children)
+
+
+# fragmented MP4 with one track, and one moof/mdat pair per (decode time, sample count, mdat payload size).
+# A fourth item lists (duration, size) per sample, written in the trun.
+def fmp4(fragments, track_id=2, timescale=10000000, sample_duration=400000):
+    data = mp4box('ftyp', b'isom\x00\x00\x00\x01iso5')
+    data += mp4box('moov', b'',
+                   mp4fullbox('mvhd', 0, 0, struct.pack('>IIII', 0, 0, 1000, 250200)),
+                   mp4box('trak', b'',
+                          mp4fullbox('tkhd', 0, 7, struct.pack('>III', 0, 0, track_id)),
+                          mp4box('mdia', b'', mp4fullbox('mdhd', 0, 0, struct.pack('>IIII', 0, 0, timescale, 0)))),
+                   mp4box('mvex', b'', mp4fullbox('trex', 0, 0, struct.pack('>IIIII', track_id, 1, 0, 0, 0))))
+    data += mp4fullbox('sidx', 0, 0, struct.pack('>II', track_id, timescale))
+    for sequence, fragment in enumerate(fragments, start=1):
+        decode_time, sample_count, mdat_size = fragment[:3]
+        if len(fragment) > 3:
+            trun = mp4fullbox('trun', 0, 0x301, struct.pack('>Ii', sample_count, 0) +
+                              b''.join(struct.pack('>II', *sample) for sample in fragment[3]))
+        else:
+            trun = mp4fullbox('trun', 0, 0x1, struct.pack('>Ii', sample_count, 0))
+        data += mp4box('moof', b'',
+                       mp4fullbox('mfhd', 0, 0, struct.pack('>I', sequence)),
+                       mp4box('traf', b'',
+                              mp4fullbox('tfhd', 0, 0x28, struct.pack('>III', track_id, sample_duration, 0x1010000)),
+                              mp4fullbox('tfdt', 1, 0, struct.pack('>Q', decode_time)),
+                              trun))
+        data += mp4box('mdat', b'\x00' * mdat_size)
+    return data
 
 
 class Test(unittest.TestCase):
@@ -43,6 +100,22 @@ class Test(unittest.TestCase):
         self.assertEquals(frame.duration, timedelta(seconds=0.04))
         self.assertEquals(frame.end_time, sec2ts(0.08))
 
+    def test_timestamps(self):
+        self.assertEquals(to_fraction("30000/1001"), Fraction(30000, 1001))
+        self.assertEquals(to_fraction(self.timebase), Fraction(1, 10000000))
+        self.assertIsNone(parse_rate("0/0"))
+
+        ticks = np.array([0, 1001, 3003, 900900900])
+        self.assertEquals(list(ticks_to_seconds(ticks, "1/30000")), [0, 1001 / 30000, 3003 / 30000, 900900900 / 30000])
+        self.assertEquals(list(ticks_to_datetime64(ticks, "1/30000").astype(np.int64)),
+                          [0, 33367, 100100, 30030030000])
+
+        # no floating point drift on large timestamps
+        frame = Frame(time_base="1/90000", frame_rate="30000/1001")
+        frame.pkt_pts = 8100000000 + 3003
+        self.assertEquals(frame.start_time, EPOCH + timedelta(seconds=90000, microseconds=33367))
+        self.assertEquals(frame.end_time, EPOCH + timedelta(seconds=90000, microseconds=66733))
+
     def test_iframes(self):
         iframe = Frame()
         iframe.parse_from_json({
@@ -143,7 +216,7 @@ class Test(unittest.TestCase):
 
 
     def test_ffprobe_parser(self):
-        json = self.externaldata['test1']
+        json = self.externaldata['ffprobe_test1']
         ffresp = FFProbeResponse(json)
         streams = ffresp.get_streams()
         self.assertEquals(len(streams), 1)
@@ -159,7 +232,7 @@ class Test(unittest.TestCase):
 
 
     def test_stream_from_ffprobe(self):
-        json = self.externaldata['test1']
+        json = self.externaldata['ffprobe_test1']
         ffresp = FFProbeResponse(json)
         stream0 = Stream(origin=ffresp, stream_index=0)
         self.assertEquals(len(stream0.frames), 21)
@@ -177,6 +250,202 @@ class Test(unittest.TestCase):
         self.assertEquals(str(stream0.gops[0]), "GOP: IBBBP 5 CLOSED")
         self.assertEquals(str(stream0.gops[1]), "GOP: iBBPB 5 OPEN")
 
+    def test_ffprobe_compact_reader(self):
+        json = self.externaldata['ffprobe_test1']
+        lines = []
+        for jframe in json['frames']:
+            lines.append("frame|" + "|".join("{}={}".format(k, v) for k, v in jframe.items()) + "\n")
+        lines.append("stream|index=0|width=1280|height=720|avg_frame_rate=50/1|time_base=1/10000000|duration_ts=2502000000|tag:handler_name=Video \\| Handler\n")
+
+        reader = FFProbeCompactReader(batch_size=4)
+        ffresp = reader.read(line.encode() for line in lines)
+        self.assertEquals(ffresp.streams[0]['width'], 1280)
+        self.assertEquals(ffresp.streams[0]['tag:handler_name'], "Video | Handler")
+
+        stream0 = Stream(origin=ffresp, stream_index=0)
+        expected = Stream(origin=FFProbeResponse(json), stream_index=0)
+        self.assertEquals(len(stream0.frames), 21)
+        self.assertTrue((stream0.table.data == expected.table.data).all())
+        self.assertEquals(str(stream0.gops[1]), "GOP: iBBPB 5 OPEN")
+
+    def test_ffprobe_unknown_duration(self):
+        lines = ["stream|index=0|width=640|height=360|avg_frame_rate=25/1|time_base=1/1000|duration_ts=N/A|duration=N/A\n"]
+        for i in range(50):
+            lines.append("frame|media_type=video|stream_index=0|key_frame={}|pts={}|pkt_size=100|pict_type={}\n".format(
+                int(i % 25 == 0), i * 40, 'I' if i % 25 == 0 else 'P'))
+
+        # duration of the frames, or of the container when it is known
+        stream0 = Stream(origin=FFProbeCompactReader().read(lines), stream_index=0)
+        self.assertEquals(stream0.duration, timedelta(seconds=2))
+        stream0 = Stream(origin=FFProbeCompactReader().read(lines + ["format|duration=2.5\n"]), stream_index=0)
+        self.assertEquals(stream0.duration, timedelta(seconds=2.5))
+
+    def test_ffprobe_multiple_streams(self):
+        frames = []
+        for i in range(6):
+            frames.append({"media_type": "video", "stream_index": 0, "pkt_pts": i * 100, "pkt_size": 1000 + i,
+                           "key_frame": int(i == 0), "pict_type": "I" if i == 0 else "P"})
+            frames.append({"media_type": "audio", "stream_index": 1, "pkt_pts": i, "pkt_size": 10})
+            frames.append({"media_type": "video", "stream_index": 2, "pkt_pts": i * 100, "pkt_size": 500 + i,
+                           "key_frame": int(i % 3 == 0), "pict_type": "I" if i % 3 == 0 else "B"})
+        ffresp = FFProbeResponse({
+            "frames": frames,
+            "streams": [
+                {"index": 0, "codec_type": "video", "avg_frame_rate": "25/1", "time_base": "1/2500"},
+                {"index": 1, "codec_type": "audio", "time_base": "1/48000"},
+                {"index": 2, "codec_type": "video", "avg_frame_rate": "25/1", "time_base": "1/2500"},
+            ]
+        })
+
+        self.assertEquals(sorted(ffresp.tables), [0, 2])
+        self.assertEquals(ffresp.get_video_stream_indexes(), [0, 2])
+
+        stream2 = Stream(origin=ffresp, stream_index=2)
+        self.assertEquals(list(stream2.table.size), [500, 501, 502, 503, 504, 505])
+        self.assertEquals(len(stream2.gop_table), 2)
+        self.assertEquals(len(Stream(origin=ffresp, stream_index=0).gop_table), 1)
+
+    def test_ffprobe_packets(self):
+        # decode order: I P B B P B B I B B P
+        decode_order = [(0, 'K_'), (3, '__'), (1, '__'), (2, '__'), (6, '__'), (4, '__'), (5, '__'),
+                        (9, 'K_'), (7, '__'), (8, '__'), (10, '__')]
+        lines = ["packet|codec_type=video|stream_index=0|pts={}|dts={}|size={}|flags={}".format(
+            pts * 200000, idx * 200000, 1000 + idx, flags) for idx, (pts, flags) in enumerate(decode_order)]
+        lines.append("stream|index=0|width=1280|height=720|avg_frame_rate=50/1|time_base=1/10000000|duration_ts=2200000")
+
+        reader = FFProbeCompactReader(mode='packets')
+        stream0 = Stream(origin=reader.read(lines), stream_index=0)
+        self.assertEquals(list(stream0.table.pts), [pts * 200000 for pts in range(11)])
+        self.assertEquals(list(stream0.table.position), list(range(1, 12)))
+        self.assertEquals(stream0.frames[1].pkt_size, 1002)
+        self.assertEquals([str(gop) for gop in stream0.gops], ["GOP: IBBPBBPBB 9 CLOSED", "GOP: IP 2 CLOSED"])
+
+    def test_ffprobe_parallel(self):
+        command = FFProbeParallelCommand(workers=4, min_chunk_duration=60, overlap=5)
+        self.assertEquals(command.intervals(10, 600), ["10.000000%165.000000", "160.000000%315.000000",
+                                                      "310.000000%465.000000", "460.000000%"])
+        self.assertEquals(command.intervals(0, 90), ["0.000000%50.000000", "45.000000%"])
+
+        def chunk(first, last):
+            table = FrameTable()
+            for idx in range(first, last):
+                table.append(pts=idx * 200000, size=idx, pict_type='I' if idx % 5 == 0 else 'P',
+                             key_frame=idx % 5 == 0, position=idx - first + 1)
+            return FFProbeResponse({'streams': []}, tables={0: table})
+
+        # chunks overlap from the keyframe before their start
+        tables = merge_frame_tables([chunk(0, 12), chunk(10, 23), chunk(20, 30)])
+        self.assertEquals(list(tables[0].size), list(range(30)))
+        self.assertEquals(list(tables[0].position), list(range(1, 31)))
+
+    def test_ffprobe_parallel_open_gop(self):
+        # open GOPs of 10 frames: the 2 B-frames presented before each I-frame are decoded after it.
+        # A chunk boundary lands on the I-frame at pts 10
+        def frames(pts_range):
+            table = FrameTable()
+            for pts in pts_range:
+                table.append(pts=pts, size=pts, pict_type='I' if pts % 10 == 0 else 'B' if pts % 10 >= 8 else 'P',
+                             key_frame=pts % 10 == 0, position=pts + 1)
+            return FFProbeResponse({'streams': []}, tables={0: table})
+
+        # read past the boundary, the first chunk has the B-frames of the next GOP (and more, removed when merging).
+        # The second chunk starts at the keyframe: its leading B-frames cannot be decoded
+        tables = merge_frame_tables([frames(range(0, 15)), frames(range(10, 30))])
+        self.assertEquals(list(tables[0].pts), list(range(30)))
+        # without the overlap, the first chunk would stop at the keyframe, and pts 8 and 9 be lost
+        tables = merge_frame_tables([frames(range(0, 8)), frames(range(10, 30))])
+        self.assertEquals(len(tables[0]), 28)
+
+    def test_ffprobe_single_worker(self):
+        with tempfile.TemporaryDirectory() as directory:
+            executable = os.path.join(directory, 'ffprobe')
+            log = os.path.join(directory, 'calls.log')
+            with open(executable, 'w') as f:
+                f.write("#!/bin/sh\n"
+                        "echo \"$@\" >> {}\n"
+                        "echo 'stream|index=0|codec_type=video|time_base=1/25|avg_frame_rate=25/1|duration=1.0'\n"
+                        "echo 'frame|media_type=video|stream_index=0|key_frame=1|pts=0|pkt_size=100|pict_type=I'\n"
+                        .format(log))
+            os.chmod(executable, 0o755)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                response = FFProbeParallelCommand(executable=executable, filename='test.mp4', workers=1).call()
+            self.assertEquals(len(response.tables[0]), 1)
+            # a single ffprobe process, without the header probe
+            with open(log) as f:
+                calls = f.read().splitlines()
+            self.assertEquals(len(calls), 1)
+            self.assertTrue('-show_frames' in calls[0])
+
+    def test_concurrent_tool_errors(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument('path_to_file')
+        vviz.add_analysis_arguments(parser)
+
+        with tempfile.TemporaryDirectory() as directory:
+            failing = os.path.join(directory, 'failing')
+            with open(failing, 'w') as f:
+                f.write("#!/bin/sh\nexit 3\n")
+            os.chmod(failing, 0o755)
+            video = os.path.join(directory, 'video.mp4')
+            with open(video, 'wb') as f:
+                f.write(fmp4([(0, 48, 1000)]))
+
+            def errors(*options):
+                args = parser.parse_args([video, '--no-cache', '--ffprobe-exec', failing] + list(options))
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output), self.assertRaises(Exception) as context:
+                    vviz.read_streams_and_track(args)
+                printed = [line for line in output.getvalue().splitlines() if line.startswith('Error: ')]
+                return str(context.exception), printed
+
+            # the MP4 parser still runs to completion when ffprobe fails
+            message, printed = errors()
+            self.assertTrue(message.startswith("Cannot analyse {} (ffprobe failed: ".format(video)))
+            self.assertTrue('exit status 3' in message)
+            self.assertFalse('MP4 box parser' in message)
+            self.assertEquals(len(printed), 1)
+
+            # both errors are reported, in the order of the tools
+            message, printed = errors('--mp4-parser', 'mp4dump', '--mp4dump-exec', failing)
+            self.assertEquals(len(printed), 2)
+            self.assertTrue(all(line.startswith("Error: ") for line in printed))
+            self.assertTrue(message.index('ffprobe failed: ') < message.index('; mp4dump failed: '))
+
+    def test_frame_table(self):
+        table = FrameTable(capacity=2)
+        table.append(pts=200000, size=104000, pict_type='I', key_frame=1, position=1)
+        table.append(pts=400000, size=4440, pict_type='B', key_frame=0, position=2)
+        table.extend([(600000, 1324, PICT_TYPE_B, False, 3),
+                      (800000, 10612, PICT_TYPE_P, False, 4),
+                      (1000000, 90000, PICT_TYPE_I, False, 5)])
+        self.assertEquals(len(table), 5)
+        self.assertEquals(list(table.pts), [200000, 400000, 600000, 800000, 1000000])
+        self.assertEquals(table.mask_for_type(IFrame).sum(), 2)
+        self.assertEquals(table.mask_for_type(IFrame, strict=True).sum(), 1)
+        self.assertEquals(table.mask_for_type(BFrame).sum(), 2)
+
+        stream = Stream()
+        stream.time_base = self.timebase
+        stream.frame_rate = self.framerate
+        stream.table = table
+
+        bframes = stream.get_frames_for_type(BFrame)
+        self.assertEquals(len(bframes), 2)
+        self.assertEquals(type(bframes[0]), BFrame)
+        self.assertEquals(bframes[-1].position, 3)
+        self.assertEquals(bframes[-1].start_time, sec2ts(0.06))
+        self.assertEquals([str(f) for f in stream.frames[1:4]], ['B', 'B', 'P'])
+
+        self.assertEquals(len(stream.gops), 2)
+        self.assertEquals(list(stream.gop_table['size']), [(104000+4440+1324+10612)*8, 90000*8])
+        self.assertEquals(stream.gops[-1].duration, timedelta(seconds=0.02))
+
+        stream.add_frame(bframes[0])
+        self.assertEquals(len(stream.frames), 6)
+        self.assertEquals(str(stream.frames[-1]), 'B')
+        self.assertEquals(str(stream.gops[-1]), "GOP: iB 2 OPEN")
+
     def test_fragment(self):
         moof = {
           "name":"moof",
@@ -252,6 +521,519 @@ class Test(unittest.TestCase):
         last = track0.fragments[-1]
         self.assertEquals(last.start_time, sec2ts(13.44))
 
+    def test_live_window(self):
+        # 3 GOPs of 5 frames, added as segments
+        stream0 = Stream()
+        stream0.frame_rate = 25
+        stream0.time_base = "1/12800"
+        for segment in range(3):
+            stream0.add_frames([(i * 512, 1000 + i, PICT_TYPE_I if i % 5 == 0 else PICT_TYPE_P, i % 5 == 0, i + 1)
+                                for i in range(segment * 5, segment * 5 + 5)])
+        self.assertEquals(len(stream0.gop_table), 3)
+
+        # frames are removed from the start of the GOP following the cut
+        self.assertEquals(stream0.drop_frames_before(3 * 512), 5)
+        self.assertEquals(stream0.table.position[0], 6)
+        self.assertEquals(len(stream0.gop_table), 2)
+        self.assertEquals(stream0.drop_frames_before(5 * 512), 0)
+
+        track0 = MP4Track(parser=MP4BoxParser(data=fmp4([(0, 48, 66047), (19200000, 48, 50000)])))
+        track0.drop_fragments_before(19200000)
+        self.assertEquals([f.position for f in track0.fragments], [2])
+
+    def test_live_analysis(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # ffprobe outputs 5 frames (a GOP) per segment, from the segment number
+            executable = os.path.join(directory, 'ffprobe')
+            with open(executable, 'w') as f:
+                f.write("#!/bin/sh\n"
+                        "segment=$(echo \"$@\" | sed 's/.*seg_\\([0-9]*\\).*/\\1/')\n"
+                        "echo 'stream|index=0|width=640|height=360|avg_frame_rate=25/1|time_base=1/12800|duration=0.2'\n"
+                        "for i in 0 1 2 3 4; do\n"
+                        "  echo \"frame|media_type=video|stream_index=0|key_frame=$((i == 0))|pts=$(((segment * 5 + i) * 512))"
+                        "|pkt_size=1000|pict_type=$([ $i = 0 ] && echo I || echo P)\"\n"
+                        "done\n")
+            os.chmod(executable, 0o755)
+            init = fmp4([])
+            with open(os.path.join(directory, 'init.mp4'), 'wb') as f:
+                f.write(init)
+            for segment in range(3):
+                with open(os.path.join(directory, 'seg_{}.m4s'.format(segment)), 'wb') as f:
+                    f.write(fmp4([(segment * 2000000, 5, 5000)])[len(init):])
+
+            analysis = LiveAnalysis(directory, history=0.3, ffprobe_exec=executable)
+            with contextlib.redirect_stdout(io.StringIO()):
+                for path in analysis.poll(wait=False):
+                    analysis.add_segment(path)
+            stream0 = analysis.streams[0]
+            self.assertEquals(len(stream0.table), 15)
+            self.assertEquals(len(stream0.gop_table), 3)
+            # duration of the frames received, not of the first segment
+            self.assertEquals(stream0.duration, timedelta(seconds=0.6))
+            self.assertEquals(len(analysis.track.fragments), 3)
+
+            analysis.trim()
+            self.assertEquals(len(stream0.table), 5)
+            self.assertEquals(stream0.duration, timedelta(seconds=0.2))
+
+            self.assertTrue("since start: 200.0Kbps" in analysis.status())
+
+            with self.assertRaises(Exception):
+                LiveAnalysis(directory, mode='keyframes')
+
+            # a single frame, then no time span (eg. segments without a duration)
+            with open(executable, 'w') as f:
+                f.write("#!/bin/sh\n"
+                        "echo 'stream|index=0|width=640|height=360|avg_frame_rate=25/1|time_base=1/12800'\n"
+                        "echo 'frame|media_type=video|stream_index=0|key_frame=1|pts=0|pkt_size=1000|pict_type=I'\n")
+            analysis = LiveAnalysis(directory, ffprobe_exec=executable)
+            with contextlib.redirect_stdout(io.StringIO()):
+                analysis.add_segment(os.path.join(directory, 'seg_0.m4s'))
+            self.assertTrue("1 frames" in analysis.status())
+            self.assertTrue("since start: 200.0Kbps" in analysis.status())
+            analysis._totals[0]['end'] = analysis._totals[0]['start']
+            self.assertTrue("since start: -" in analysis.status())
+
+    def test_bitrate(self):
+        # 1s at 10fps with 1000 bit frames, then 1s at 5fps with 4000 bit frames (variable frame rate)
+        times = [i * 0.1 for i in range(10)] + [1 + i * 0.2 for i in range(5)]
+        sizes = [1000] * 10 + [4000] * 5
+        bitrates = BitrateCalculator(times, sizes, end_time=2.0)
+
+        self.assertAlmostEqual(bitrates.average(), 15000)
+        self.assertAlmostEqual(bitrates.cumulative()[9], 10000)
+        self.assertAlmostEqual(bitrates.cumulative()[-1], 15000)
+
+        sliding = bitrates.sliding_many([1.0, 2.0])
+        self.assertAlmostEqual(sliding[1.0][2], 10000)
+        # window cut at the end of the stream
+        self.assertAlmostEqual(sliding[1.0][-2], 16000 / 0.9)
+        self.assertAlmostEqual(sliding[2.0][10], 15000)
+
+        peak, start = bitrates.peak(1.0)
+        self.assertAlmostEqual(peak, 21000)
+        self.assertAlmostEqual(start, 0.9)
+
+        # sorted windows are merged with the frame times, others are searched
+        self.assertEquals(list(bitrates.bits_between([0.0, 0.1, 1.0], [0.1, 1.0, 2.0])), [1000, 9000, 20000])
+        self.assertEquals(list(bitrates.bits_between([1.0, 0.1, 0.0], [2.0, 1.0, 0.1])), [20000, 9000, 1000])
+
+        # no frames, eg. in an interval without video
+        empty = BitrateCalculator([], [])
+        self.assertEquals(len(empty.sliding(1.0)), 0)
+        self.assertEquals(len(empty.cumulative()), 0)
+        self.assertEquals(empty.average(), 0.0)
+        self.assertEquals(empty.peak(1.0), (0.0, 0.0))
+
+    def test_webgl_frame_traces(self):
+        stream0 = Stream(origin=FFProbeResponse(self.externaldata['ffprobe_test1']), stream_index=0)
+        bars = vviz.get_frame_data_from_stream(stream0, renderer='svg')
+        segments = vviz.get_frame_data_from_stream(stream0, renderer='webgl')
+        self.assertEquals([trace.type for trace in segments], ['scattergl'] * 4)
+
+        for bar, trace in zip(bars, segments):
+            self.assertEquals(trace.name, bar.name)
+            # one vertical segment per frame: (x, 0), (x, size) and a gap
+            self.assertEquals(list(trace.x), [x for x in bar.x for _ in range(3)])
+            y = np.asarray(trace.y).reshape(-1, 3)
+            self.assertEquals(list(y[:, 0]), [0] * len(bar.y))
+            self.assertEquals(list(y[:, 1]), list(bar.y))
+            self.assertTrue(np.isnan(y[:, 2]).all())
+            # same hover text as the bars
+            self.assertEquals(list(trace.text), [text for text in bar.text for _ in range(3)])
+        self.assertEquals(sum(len(trace.x) for trace in segments), 21 * 3)
+
+    def test_frame_decimator(self):
+        # 1 IDR frame then P frames of growing sizes, 10 frames per second
+        table = FrameTable()
+        for i in range(100):
+            table.append(pts=i, size=10000 if i == 0 else i, pict_type=PICT_TYPE_I if i == 0 else PICT_TYPE_P,
+                         key_frame=i == 0, position=i + 1)
+        decimator = FrameDecimator(table.pts / 10, table.data, bins=10)
+
+        self.assertAlmostEqual(decimator.bin_duration, 0.99)
+        self.assertEquals(list(decimator.composition[0]), [0, 1, 9, 0, 0])
+        self.assertEquals(decimator.composition.sum(), 100)
+
+        bins = decimator.bins_for_category(CATEGORY_P)
+        self.assertEquals(len(bins), 10)
+        self.assertEquals(bins['count'].sum(), 99)
+        self.assertEquals((bins[0]['min'], bins[0]['max'], bins[0]['index']), (1, 9, 9))
+        self.assertEquals(len(decimator.bins_for_category(CATEGORY_IDR)), 1)
+        self.assertEquals(len(decimator.bins_for_category(CATEGORY_B)), 0)
+
+        # peaks are kept
+        values = np.zeros(1000)
+        values[123] = 5
+        values[456] = -5
+        indexes = minmax_indexes(np.arange(1000), values, bins=10)
+        self.assertTrue(len(indexes) <= 20)
+        self.assertTrue(123 in indexes and 456 in indexes)
+        self.assertEquals(list(indexes), sorted(indexes))
+
+    def test_report(self):
+        stream0 = Stream(origin=FFProbeResponse(self.externaldata['ffprobe_test1']), stream_index=0)
+        row = stream_stats(stream0, peak_windows=[0.1])
+        self.assertEquals(row['frames'], 21)
+        self.assertEquals(row['gops'], len(stream0.gops))
+        self.assertAlmostEqual(row['avg_bitrate'], BitrateCalculator.from_stream(stream0).average())
+        self.assertTrue('peak_bitrate_0.1s' in row)
+
+        track0 = MP4Track(parser=MP4BoxParser(data=fmp4([(0, 48, 66047), (19200000, 48, 50000)])))
+        row = track_stats(track0)
+        self.assertEquals(row['fragments'], 2)
+        self.assertEquals(row['fragment_size_max'], 66055 * 8)
+        self.assertEquals(row['fragment_duration_avg'], 1.92)
+
+        with tempfile.TemporaryDirectory() as directory:
+            rows = [OrderedDict([('file', 'a.mp4'), ('frames', 21)]), OrderedDict([('file', 'b.mp4'), ('error', 'failed')])]
+            write_report(rows, os.path.join(directory, 'summary.csv'))
+            with open(os.path.join(directory, 'summary.csv')) as f:
+                self.assertEquals(f.read().splitlines(), ['file,frames,error', 'a.mp4,21,', 'b.mp4,,failed'])
+
+        # headless report, on standard output
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            write_report(analysis_rows('test.mp4', [stream0], track0), '-', format='json')
+        rows = json.loads(output.getvalue())
+        self.assertEquals(rows[0]['file'], 'test.mp4')
+        self.assertEquals(rows[0]['frames'], 21)
+        self.assertEquals(rows[0]['fragments'], 2)
+
+    def test_sampled_overview(self):
+        command = FFProbeSampledCommand(filename='test.mp4', sample_duration=10, sample_spacing=300)
+        self.assertEquals(command.intervals(0, 900), ["0.000000%+10.000000", "300.000000%+10.000000", "600.000000%+10.000000"])
+        self.assertEquals(command.intervals(0, 10), None)
+
+        # 2 samples of 1s at 10fps (starting with 2 frames before the keyframe), 1000 bit frames
+        def sample(start):
+            lines = ["frame|media_type=video|stream_index=0|key_frame={}|pkt_pts={}|pkt_size=125|pict_type={}".format(
+                int(i == start), i, "I" if i == start else "P") for i in range(start - 2, start + 10)]
+            return FFProbeCompactReader().read(lines)
+        header = FFProbeResponse({"streams": [{"index": 0, "avg_frame_rate": "10/1", "time_base": "1/10", "start_pts": 0,
+                                               "width": 1280, "height": 720, "duration": "20"}]})
+        tables, samples = merge_sampled_tables([sample(0), sample(100)], header)
+        self.assertEquals(samples[0], [[0.0, 1.0], [10.0, 11.0]])
+        self.assertEquals(list(tables[0].position[9:12]), [10, 101, 102])
+
+        stream0 = Stream(origin=FFProbeResponse(header._json, tables=tables, samples=samples), stream_index=0)
+        bitrates = BitrateCalculator.from_stream(stream0)
+        # rates only count the sampled time
+        self.assertAlmostEqual(bitrates.average(), 10000)
+        self.assertAlmostEqual(bitrates.cumulative()[-1], 10000)
+        self.assertAlmostEqual(bitrates.sliding(1.0)[9], 10000 * 0.5 / 0.5)
+        self.assertEquals(bitrates.peak(1.0), (10000, 0.0))
+        self.assertTrue("sampled overview: 2 windows" in stream0.to_label())
+
+    def test_keyframes_only(self):
+        # keyframes every 2s at 25fps, stream of 5s
+        lines = ["frame|media_type=video|stream_index=0|key_frame=1|pkt_pts={}|pkt_size=5000|pict_type=I|pkt_pos={}".format(
+            pts, pos) for pts, pos in [(0, 0), (25600, 40000), (51200, 90000)]]
+        lines.append("stream|index=0|width=1280|height=720|avg_frame_rate=25/1|time_base=1/12800|start_pts=0|duration_ts=64000")
+        lines.append("format|size=100000")
+        stream0 = Stream(origin=FFProbeCompactReader(mode='keyframes').read(lines), stream_index=0)
+
+        self.assertTrue(stream0.keyframes_only)
+        gops = stream0.gop_table
+        self.assertEquals(list(gops['start']), [0, 50, 100])
+        self.assertEquals(list(gops['end']), [50, 100, 125])
+        self.assertEquals(list(gops['size']), [320000, 400000, 80000])
+        self.assertEquals(list(gops['duration']), [2.0, 2.0, 1.0])
+        self.assertEquals(list(stream0.table.position), [1, 51, 101])
+        self.assertEquals(stream0.gops[1].length, 50)
+        self.assertEquals(stream0.gops[1].start_time, sec2ts(2))
+        self.assertAlmostEqual(BitrateCalculator.from_stream(stream0).average(), 800000 / 5)
+        # without packets, sizes are the distances between keyframes
+        self.assertEquals(stream0.gop_size_source, 'byte positions (estimate)')
+        self.assertEquals(stream_stats(stream0)['gop_size_source'], 'byte positions (estimate)')
+
+        # video packets (in decode order, with a B-frame) give the frames and sizes of the GOPs
+        packets = ["packet|codec_type=video|stream_index=0|pts={}|dts={}|size={}".format(
+            i * 512, i * 512, 5000 if i % 50 == 0 else 100) for i in range(120)]
+        packets[4], packets[5] = packets[5], packets[4]
+        packets += ["packet|codec_type=video|stream_index=0|pts={}|dts=N/A|size=100".format(i * 512) for i in range(120, 125)]
+        packets.insert(60, "packet|codec_type=audio|stream_index=1|pts=0|dts=0|size=700")
+        stream0 = Stream(origin=FFProbeCompactReader(mode='keyframes').read(packets + lines), stream_index=0)
+        gops = stream0.gop_table
+        self.assertEquals(list(gops['start']), [0, 50, 100])
+        self.assertEquals(list(gops['end']), [50, 100, 125])
+        self.assertEquals(list(gops['size']), [(5000 + 49 * 100) * 8, (5000 + 49 * 100) * 8, (5000 + 24 * 100) * 8])
+        self.assertEquals(stream0.gop_size_source, 'packets')
+
+        # without byte positions, sizes come from the fragments (1s each)
+        lines = [line.replace("|pkt_pos=", "|pkt_pos=N/A|x=") for line in lines]
+        stream0 = Stream(origin=FFProbeCompactReader(mode='keyframes').read(lines), stream_index=0)
+        track0 = MP4Track(parser=MP4BoxParser(data=fmp4([(i * 10000000, 25, 1000 * (i + 1)) for i in range(5)],
+                                                        sample_duration=400000)))
+        stream0.set_gop_sizes_from_fragments(track0)
+        self.assertEquals(list(stream0.gop_table['size']), [(1008 + 2008) * 8, (3008 + 4008) * 8, 5008 * 8])
+        self.assertEquals(stream0.gop_size_source, 'fragments (estimate)')
+
+    def test_keyframes_bitrates(self):
+        # 10s at 25fps, 2s GOPs of a 5000 bytes I-frame and 1000 bytes P-frames
+        frames = []
+        packets = []
+        for i in range(250):
+            key = i % 50 == 0
+            frames.append("frame|media_type=video|stream_index=0|key_frame={}|pts={}|pkt_size={}|pict_type={}".format(
+                int(key), i * 512, 5000 if key else 1000, 'I' if key else 'P'))
+            packets.append("packet|codec_type=video|stream_index=0|pts={}|dts={}|size={}".format(
+                i * 512, i * 512, 5000 if key else 1000))
+        header = ["stream|index=0|width=1280|height=720|avg_frame_rate=25/1|time_base=1/12800|start_pts=0|duration_ts=128000"]
+        full = Stream(origin=FFProbeCompactReader().read(frames + header), stream_index=0)
+        keyframes = Stream(origin=FFProbeCompactReader(mode='keyframes').read(
+            [line for line in frames if 'key_frame=1' in line] + packets + header), stream_index=0)
+
+        full_rates = BitrateCalculator.from_stream(full)
+        keyframe_rates = BitrateCalculator.from_stream(keyframes)
+        self.assertAlmostEqual(keyframe_rates.average(), full_rates.average())
+        # windows shorter than a GOP get their share of the GOP, rather than all of it
+        self.assertAlmostEqual(keyframe_rates.peak(1.0)[0], (5000 + 49 * 1000) * 8 / 2)
+        self.assertTrue(full_rates.average() <= keyframe_rates.peak(1.0)[0] <= full_rates.peak(1.0)[0])
+        self.assertAlmostEqual(keyframe_rates.sliding(1.0)[0], (5000 + 49 * 1000) * 8 / 2)
+        self.assertAlmostEqual(keyframe_rates.peak(4.0)[0], full_rates.peak(4.0)[0], delta=full_rates.peak(4.0)[0] * 0.01)
+        self.assertEquals(stream_stats(keyframes, peak_windows=[1.0])['peak_bitrate_1.0s'], 216000)
+
+    def test_track_from_mp4box_parser(self):
+        data = fmp4([(0, 48, 66047), (19200000, 48, 50000), (38400000, 12, 10000)])
+        track0 = MP4Track(parser=MP4BoxParser(data=data))
+
+        self.assertEquals(track0.id, 2)
+        self.assertEquals(track0.time_scale, 10000000)
+        self.assertEquals(track0.duration, 250.2)
+        self.assertEquals(len(track0.fragments), 3)
+
+        frag0 = track0.fragments[0]
+        self.assertEquals(frag0.position, 1)
+        self.assertEquals(frag0.start_time, sec2ts(0))
+        self.assertEquals(frag0.duration, timedelta(seconds=0.04*48))
+        self.assertEquals(frag0.size, 66055*8)
+
+        last = track0.fragments[-1]
+        self.assertEquals(last.start_time, sec2ts(3.84))
+        self.assertEquals(last.length, 12)
+
+        # fragments of other tracks are ignored
+        self.assertEquals(len(MP4Track(parser=MP4BoxParser(data=data), track_id=1).fragments), 0)
+
+    def test_fragment_index(self):
+        # 3 fragments of 1.92s, 1.92s and 0.48s
+        track0 = MP4Track(parser=MP4BoxParser(data=fmp4([(0, 48, 66047), (19200000, 48, 50000), (38400000, 12, 10000)])))
+        self.assertEquals(list(track0.fragment_starts), [0, 19200000, 38400000])
+        self.assertEquals(list(track0.fragment_ends), [19200000, 38400000, 43200000])
+
+        self.assertEquals(track0.overlapping(0, 19200000), slice(0, 1))
+        self.assertEquals(track0.overlapping(19199999, 19200001), slice(0, 2))
+        self.assertEquals(track0.overlapping(sec2ts(2), sec2ts(10)), slice(1, 3))
+        self.assertEquals(track0.overlapping(sec2ts(5), sec2ts(10)), slice(3, 3))
+        self.assertEquals([f.position for f in track0.fragments[track0.overlapping(sec2ts(1), sec2ts(2))]], [1, 2])
+
+        self.assertEquals(track0.fragment_at(19200000), 1)
+        self.assertEquals(track0.fragment_at(43200000), -1)
+        # pts in another time base (1/90000)
+        self.assertEquals(list(track0.fragment_at([0, 90000 * 2, 90000 * 5], time_base="1/90000")), [0, 1, -1])
+
+    def test_trun_samples(self):
+        # first fragment with per-sample durations and sizes, second with the tfhd defaults
+        samples = [(400000, 1000), (400000, 300), (800000, 500)]
+        track0 = MP4Track(parser=MP4BoxParser(data=fmp4([(0, 3, 1800, samples), (1600000, 4, 1000)])))
+        frag0, frag1 = track0.fragments
+        self.assertEquals(frag0.length, 3)
+        self.assertEquals(frag0.duration_ticks, 1600000)
+        self.assertEquals(frag0.duration, timedelta(seconds=0.16))
+        self.assertEquals(list(frag0.samples['size']), [1000, 300, 500])
+        # first sample flags come from the tfhd defaults
+        self.assertEquals(list(frag0.samples['flags']), [0x1010000] * 3)
+        self.assertEquals(frag1.duration_ticks, 1600000)
+        self.assertEquals(list(frag1.samples['size']), [0] * 4)
+        self.assertEquals(list(track0.fragment_ends), [1600000, 3200000])
+        self.assertEquals(list(track0.get_fragment_table()['duration']), [1600000, 1600000])
+        self.assertEquals(len(track0.get_sample_table()), 7)
+        self.assertIn("sample size: min 2.4Kb, avg 4.8Kb, max 8.0Kb", frag0.to_label())
+        self.assertEquals(track_stats(track0)['sample_size_max'], 8000)
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = AnalysisCache(directory=directory)
+            key = cache.key('test_cases.json', tool='native')
+            cache.store_track(key, track0)
+            track1 = MP4Track()
+            self.assertTrue(cache.load_track(key, track1))
+            self.assertEquals(list(track1.fragments[0].samples['duration']), [400000, 400000, 800000])
+            self.assertEquals(track1.fragments[1].duration_ticks, 1600000)
+
+        # mp4dump boxes are found by name, in any order, with the entries of the trun
+        moof = {"name": "moof", "children": [
+            {"name": "traf", "children": [
+                {"name": "tfdt", "base media decode time": 800000},
+                {"name": "tfhd", "track ID": 2, "default sample duration": 400000},
+                {"name": "trun", "sample count": 2, "entries": [{"d": 200000, "s": 10}, {"d": 600000, "s": 20}]},
+            ]},
+            {"name": "mfhd", "sequence number": 1},
+        ]}
+        fragment = Fragment(moof, {"name": "mdat", "size": 38}, MP4Track(track_id=2), 1)
+        self.assertEquals(fragment.decode_time, 800000)
+        self.assertEquals(fragment.duration_ticks, 800000)
+        self.assertEquals(list(fragment.samples['size']), [10, 20])
+
+    def test_fragment_join(self):
+        # fragments of 1.92s, 1.92s and 0.48s, and 25fps frames with IDR frames at 0s and 2.4s
+        track0 = MP4Track(parser=MP4BoxParser(data=fmp4([(0, 48, 66047), (19200000, 48, 50000), (38400000, 12, 10000)])))
+        stream0 = Stream()
+        stream0.frame_rate = 25
+        stream0.time_base = "1/12800"
+        stream0.add_frames([(i * 512, 5000 if i in (0, 60) else 1000 + i % 3,
+                             PICT_TYPE_I if i in (0, 60) else PICT_TYPE_B if i % 3 else PICT_TYPE_P,
+                             i in (0, 60), i + 1) for i in range(110)])
+
+        index = track0.join_frames(stream0)
+        self.assertEquals(list(index[[0, 47, 48, 95, 96, 107, 108]]), [0, 0, 1, 1, 2, 2, -1])
+        stats = track0.frame_stats
+        self.assertEquals(list(stats['frames']), [48, 48, 12])
+        self.assertEquals(list(stats['idr_frames']), [1, 1, 0])
+        self.assertEquals(list(stats['p_frames']), [15, 15, 4])
+        self.assertEquals(list(stats['starts_on_idr']), [True, False, False])
+        self.assertEquals(list(stats['largest_frame']), [5000, 5000, 1002])
+        self.assertEquals(list(stats['largest_frame_position']), [1, 61, 99])
+        self.assertIn("48 frames: 1 I (1 IDR), 15 P, 32 B<br>starts on IDR", track0.fragments[0].to_label())
+
+        rows = fragment_rows(track0)
+        self.assertEquals(rows[1]['start'], 1.92)
+        self.assertEquals(rows[1]['starts_on_idr'], False)
+        self.assertEquals(track_stats(track0)['fragments_not_on_idr'], 2)
+
+    def test_export(self):
+        stream0 = Stream(origin=FFProbeResponse(self.externaldata['ffprobe_test1']), stream_index=0)
+        columns = frame_columns(stream0)
+        self.assertEquals(len(columns['pts']), 21)
+        self.assertEquals(list(columns['time'][:2]), [float(f.start_time.timestamp()) for f in stream0.frames[:2]])
+
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        with tempfile.TemporaryDirectory() as directory:
+            files = export_analysis(stream0, None, os.path.join(directory, 'test'), row_group_size=8)
+            self.assertEquals([os.path.basename(f) for f in files], ['test.frames.parquet', 'test.gops.parquet'])
+            frames = pq.ParquetFile(files[0])
+            self.assertEquals(frames.metadata.num_row_groups, 3)
+            table = frames.read()
+            self.assertEquals(table.num_rows, 21)
+            self.assertEquals(table.column('pict_type').to_pylist()[:5], ['I', 'B', 'B', 'B', 'P'])
+            self.assertEquals(table.schema.metadata[b'time_base'], str(stream0.time_base).encode())
+
+    def test_benchmark(self):
+        # 8s at 25fps, in fragments of 2s
+        frames = benchmark.synthetic_frames(200, gop='IPBB')
+        stream0 = Stream(origin=FFProbeResponse(json.loads(benchmark.ffprobe_json(frames))), stream_index=0)
+        self.assertEquals(len(stream0.gop_table), 50)
+        self.assertEquals(len(FFProbeCompactReader().read(benchmark.ffprobe_compact_lines(frames)).tables[0]), 200)
+        track0 = MP4Track(parser=MP4DumpResponse(json.loads(benchmark.mp4dump_json(frames))))
+        self.assertEquals(len(track0.fragments), 4)
+        self.assertEquals(track0.fragments[1].start_time, sec2ts(2))
+        self.assertEquals(int(track0.get_sample_table()['size'].sum()), int(frames[1].sum()))
+
+        records = benchmark.run(200, stages=['gops', 'join'], trace_memory=False)
+        self.assertEquals([record['name'] for record in records], ['gops', 'join'])
+        self.assertTrue(all(record['frames'] == 200 and record['wall'] >= 0 for record in records))
+
+    def test_profiler(self):
+        profiler = Profiler(trace_memory=True)
+        with profiler.stage('read') as record:
+            with profiler.stage('ffprobe'):
+                data = list(range(100000))
+            record['frames'] = len(data)
+        profiler.count('frames', len(data))
+
+        ffprobe, read = profiler.stages
+        self.assertEquals(read['frames'], 100000)
+        self.assertTrue(read['wall'] >= ffprobe['wall'])
+        # memory is measured by the outer stage only
+        self.assertTrue(read['peak_memory'] > 100000 * 8)
+        self.assertFalse('peak_memory' in ffprobe)
+        self.assertEquals(profiler.summary().splitlines()[1].split()[0], 'read')
+
+        with tempfile.TemporaryDirectory() as directory:
+            profiler.write_trace(os.path.join(directory, 'trace.json'))
+            with open(os.path.join(directory, 'trace.json')) as f:
+                trace = json.load(f)
+            self.assertEquals([event['name'] for event in trace['traceEvents']], ['ffprobe', 'read', 'thread_name'])
+            self.assertEquals(trace['traceEvents'][1]['ph'], 'X')
+            self.assertEquals(trace['otherData'], {'frames': 100000})
+
+        # times only, by default
+        profiler = Profiler()
+        with profiler.stage('read'):
+            pass
+        self.assertFalse('peak_memory' in profiler.stages[0])
+        self.assertTrue(profiler.stages[0]['wall'] >= 0)
+
+    def test_compact_html(self):
+        import plotly.graph_objs as go
+        times = [datetime(2019, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=i) for i in range(20)]
+        encoded = encode_value({'x': times, 'y': np.arange(20), 'text': ['frame'] * 20, 'width': [1, 2]})
+        self.assertEquals(encoded['y']['dtype'], 'i4')
+        self.assertEquals(np.frombuffer(base64.b64decode(encoded['y']['bdata']), dtype='<i4').tolist(), list(range(20)))
+        epoch_ms = np.frombuffer(base64.b64decode(encoded['x']['bdata']), dtype='<f8')
+        self.assertEquals(epoch_ms[1] - epoch_ms[0], 1000)
+        self.assertEquals(epoch_ms[0], 1546300800000)
+        # text and short arrays are left as JSON
+        self.assertEquals(encoded['text'], ['frame'] * 20)
+        self.assertEquals(encoded['width'], [1, 2])
+
+        with tempfile.TemporaryDirectory() as directory:
+            data = [go.Scatter(x=times, y=np.arange(20) * 1.5, name='bitrate')]
+            file = write_compact_html(data, go.Layout(), os.path.join(directory, 'a.html'), title='a')
+            gz_file = write_compact_html(data, go.Layout(), os.path.join(directory, 'b.html'), compress=True)
+            self.assertEquals(gz_file, os.path.join(directory, 'b.html.gz'))
+            js = [name for name in os.listdir(directory) if name.endswith('.js')]
+            self.assertEquals(len(js), 1)
+            with open(file) as f:
+                page = f.read()
+            with gzip.open(gz_file, 'rt') as f:
+                self.assertEquals(f.read().replace('<title></title>', '<title>a</title>'), page)
+            self.assertTrue('<script src="{}"></script>'.format(js[0]) in page)
+            self.assertTrue('"bdata"' in page)
+            self.assertFalse('2019-01-01T' in page)
+
+    def test_analysis_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = AnalysisCache(directory=directory)
+            key = cache.key('test_cases.json', streams='v:0', intervals=None)
+            self.assertNotEquals(key, cache.key('test_cases.json', streams='v:1', intervals=None))
+            self.assertIsNone(cache.load_ffprobe(key))
+
+            cache.store_ffprobe(key, FFProbeResponse(self.externaldata['ffprobe_test1']))
+            stream0 = Stream(origin=cache.load_ffprobe(key), stream_index=0)
+            self.assertEquals(len(stream0.frames), 21)
+            self.assertEquals(stream0.width, 1280)
+            self.assertEquals(str(stream0.gops[0]), "GOP: IBBBP 5 CLOSED")
+
+            track_key = cache.key('test_cases.json', tool='native')
+            cache.store_track(track_key, MP4Track(parser=MP4DumpResponse(self.externaldata['mp4dump_test1'])))
+            track0 = MP4Track()
+            self.assertTrue(cache.load_track(track_key, track0))
+            self.assertEquals(track0.time_scale, 10000000)
+            self.assertEquals(len(track0.fragments), 8)
+            self.assertEquals(track0.fragments[-1].start_time, sec2ts(13.44))
+            self.assertEquals(track0.fragments[0].duration, timedelta(seconds=0.04*48))
+
+            # least recently used entries are evicted first
+            os.utime(os.path.join(directory, key + '.npz'), (0, 0))
+            AnalysisCache(directory=directory, max_size=os.path.getsize(os.path.join(directory, track_key + '.npz'))).evict()
+            self.assertIsNone(cache.load_ffprobe(key))
+            self.assertTrue(cache.load_track(track_key, MP4Track()))
+
+            # corrupt or foreign entries are cache misses, and are removed
+            with open(os.path.join(directory, key + '.npz'), 'wb') as f:
+                f.write(b'PK\x03\x04 truncated')
+            self.assertIsNone(cache.load_ffprobe(key))
+            self.assertFalse(os.path.exists(os.path.join(directory, key + '.npz')))
+            np.savez(os.path.join(directory, key + '.npz'), other=np.zeros(3))
+            self.assertIsNone(cache.load_ffprobe(key))
+            self.assertFalse(os.path.exists(os.path.join(directory, key + '.npz')))
+            self.assertTrue(cache.load_track(track_key, MP4Track()))
+            self.assertFalse(cache.load_track(key, MP4Track()))
+
 
 if __name__ == 'main':
     unittest.main()
\ No newline at end of file
@@ -1,29 +1,45 @@
 #!/usr/bin/env python
 from __future__ import print_function
 import argparse
+import contextlib
 import os
+import sys
+import webbrowser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 
 from ffprobe_parser import *
 from mp4dump_parser import *
+from mp4box_parser import *
+from cache import AnalysisCache, tool_version
+from bitrate import BitrateCalculator
+from lod import FrameDecimator, minmax_indexes, CATEGORY_I, CATEGORY_IDR, CATEGORY_P, CATEGORY_B, CATEGORY_NAMES
 from models import *
+from report import analysis_rows, fragment_rows, write_report, REPORT_FORMATS
+from export import export_analysis, FORMATS as EXPORT_FORMATS
+from profiler import Profiler, stage
+from html_output import write_compact_html, HTML_MODES
 
-import plotly
-import plotly.graph_objs as go
-import plotly.io as pio
-import pandas as pd
-import scipy
-import pytz
-import statistics
+import numpy as np
+
+# plotly and pandas are only imported by the functions that build charts, so that
+# runs without charts (eg. --report) do not pay for their import time
+
+# how frames and bitrates are drawn in interactive charts
+RENDERERS = ['svg', 'webgl']
 
 
 def test_pandas(frames):
+    import pandas as pd
     df = pd.DataFrame.from_records([f.to_dict() for f in frames], index='start_time')
     print(df)
 
 def sec2ts(sec):
-    return datetime.fromtimestamp(sec, tz=pytz.UTC)
+    return datetime.fromtimestamp(sec, tz=timezone.utc)
 
 def get_fragment_data_from_track(track, start_time=None, end_time=None):
+    import plotly.graph_objs as go
+
     data = []
 
     fragments = track.fragments
@@ -32,7 +48,7 @@ def get_fragment_data_from_track(track, start_time=None, end_time=None):
         return data
 
     if (start_time and end_time):
-        fragments = list(filter(lambda f: f.start_time < end_time and f.end_time > start_time, fragments))
+        fragments = fragments[track.overlapping(start_time, end_time)]
 
     frag_bar = go.Bar(
         x=[f.start_time for f in fragments],
@@ -57,51 +73,122 @@ def get_fragment_data_from_track(track, start_time=None, end_time=None):
 
     return data
 
-def get_frame_data_from_stream(stream):
+def get_frame_data_from_stream(stream, max_points=None, renderer='svg'):
     bars = [
-        dict(type=IFrame, color='#FFBB00', label='I-frame'),
-        dict(type=IDRFrame, color='#FF0000', label='IDR frame'),
-        dict(type=PFrame, color='#6AFA00', label='P-frame'),
-        dict(type=BFrame, color='#1900FF', label='B-frame'),
+        dict(type=IFrame, category=CATEGORY_I, color='#FFBB00', label='I-frame'),
+        dict(type=IDRFrame, category=CATEGORY_IDR, color='#FF0000', label='IDR frame'),
+        dict(type=PFrame, category=CATEGORY_P, color='#6AFA00', label='P-frame'),
+        dict(type=BFrame, category=CATEGORY_B, color='#1900FF', label='B-frame'),
     ]
 
     data = []
 
+    # Too many frames to draw them all: P and B frames are aggregated in time bins, I and IDR frames are always kept
+    decimator = None
+    if max_points and len(stream.table) > max_points:
+        decimator = FrameDecimator(stream.start_seconds(), stream.table.data, bins=max_points)
+
     # Bars for frames (per type)
     for b in bars:
-        frames = stream.get_frames_for_type(b['type'], strict=True)
-
-        d = go.Bar(
-            x=[f.start_time for f in frames],
-            y=[f.size for f in frames],
-            text=["frame {}".format(f.position) for f in frames],
-            width=[f.duration.total_seconds()*1000 for f in frames],
-            offset=[0 for f in frames],
-            name=b['label'],
-            marker=dict(
-                color=b['color']
+        if decimator and b['category'] in (CATEGORY_P, CATEGORY_B):
+            x, y, text, width = get_binned_frames(stream, decimator, b['category'])
+        else:
+            frames = stream.get_frames_for_type(b['type'], strict=True).table
+            x = stream.start_times(frames['pts'])
+            y = frames['size'] * 8
+            text = ["frame {}".format(p) for p in frames['position']]
+            width = float(1000 / stream.frame_rate)
+
+        data.append(get_frame_trace(x, y, text, width, b, renderer))
+
+    return data
+
+def get_frame_trace(x, y, text, width, bar, renderer):
+    import plotly.graph_objs as go
+
+    if renderer == 'webgl':
+        # one vertical segment per frame, from 0 to the frame size, segments being separated by gaps
+        count = len(y)
+        y_segments = np.full((count, 3), np.nan)
+        y_segments[:, 0] = 0
+        y_segments[:, 1] = y
+        return go.Scattergl(
+            x=np.repeat(np.asarray(x), 3),
+            y=y_segments.ravel(),
+            text=np.repeat(np.asarray(text, dtype=object), 3),
+            mode='lines',
+            connectgaps=False,
+            name=bar['label'],
+            line=dict(
+                width=2,
+                color=bar['color']
             ),
             hoverinfo="x+y+text+name"
         )
 
-        data.append(d)
-
-    return data
+    return go.Bar(
+        x=x,
+        y=y,
+        text=text,
+        width=width,
+        offset=0,
+        name=bar['label'],
+        marker=dict(
+            color=bar['color']
+        ),
+        hoverinfo="x+y+text+name"
+    )
 
-def get_bitrate_data_from_stream(stream, window):
-    # turn frames into a pandas DataFrame indexed on start time
-    df = pd.DataFrame.from_records([f.to_dict() for f in stream.frames], index='start_time')
+# time, size, hover text and width of each bin of the frames of a category
+def get_binned_frames(stream, decimator, category):
+    bins = decimator.bins_for_category(category)
+    table = stream.table
+    bin_index = decimator.bin_of(bins['index'])
+    composition = decimator.composition[bin_index]
+    first_time = stream.start_seconds(table.pts[:1])[0]
+
+    text = []
+    for row, counts in zip(bins, composition):
+        text.append("{count} frames, largest is frame {position}<br>{min} to {max}<br>{composition}".format(
+            count=row['count'],
+            position=table.position[row['index']],
+            min=sizeof_fmt(row['min'] * 8),
+            max=sizeof_fmt(row['max'] * 8),
+            composition=", ".join("{} {}".format(n, name) for name, n in zip(CATEGORY_NAMES, counts) if n)
+        ))
+
+    x = seconds_to_datetime64(first_time + bin_index * decimator.bin_duration)
+    return x, bins['max'] * 8, text, decimator.bin_duration * 1000
+
+def get_bitrate_data_from_stream(stream, windows, max_points=None, renderer='svg'):
+    import plotly.graph_objs as go
+
+    bitrates = BitrateCalculator.from_stream(stream)
+    x = stream.start_times()
+
+    # long lines are reduced to the min and max points of time bins,
+    # and broken between the samples of a sampled overview
+    def reduce(values):
+        x_reduced, y_reduced = x, values
+        if max_points:
+            indexes = minmax_indexes(bitrates.times, values, bins=max_points)
+            x_reduced, y_reduced = x[indexes], values[indexes]
+        if stream.samples:
+            breaks = seconds_to_datetime64([end for _, end in stream.samples[:-1]])
+            positions = np.searchsorted(x_reduced, breaks)
+            x_reduced = np.insert(x_reduced, positions, breaks)
+            y_reduced = np.insert(y_reduced.astype(np.float64), positions, np.nan)
+        return x_reduced, y_reduced
+
+    scatter = go.Scattergl if renderer == 'webgl' else go.Scatter
 
     data = []
 
     # Bitrate
-    means_expanding = df['bitrate'] \
-        .expanding() \
-        .mean()
-
-    bitrate_expanding = go.Scatter(
-        x=means_expanding.index,
-        y=means_expanding.values,
+    x_cumulative, y_cumulative = reduce(bitrates.cumulative())
+    bitrate_expanding = scatter(
+        x=x_cumulative,
+        y=y_cumulative,
         name="bitrate <br>(cumul mean)",
         yaxis='y3',
         mode="lines",
@@ -115,57 +202,56 @@ def get_bitrate_data_from_stream(stream, window):
     )
     data.append(bitrate_expanding)
 
-    # TODO - doesn't seem that using center=False provides the correct results.
-    # Peaks not aligned with i-frames as I assume it should
-    means_rolling = df['bitrate'] \
-        .rolling(window=int(stream.frame_rate * window),
-                 win_type='triang',
-                 center=True,
-                 min_periods=0
-                 ) \
-        .mean()
-
-    bitrate_rolling = go.Scatter(
-        x=means_rolling.index,
-        y=means_rolling.values,
-        name="bitrate <br>(sliding - {}s)".format(window),
-        yaxis='y3',
-        mode="lines",
-        line=dict(
-            width=1,
-            color="#9467BD"
-        ),
-        hoverinfo="x+y",
-        fill="tonexty",
-        fillcolor="rgba(225,213,246,0.4)"
-        # stackgroup='bitrates'
-        # legendgroup="bitrates",
-    )
-    data.append(bitrate_rolling)
-
-
+    colors = ["#9467BD", "#C49C94", "#E377C2", "#7F7F7F"]
+    for idx, (window, means_sliding) in enumerate(sorted(bitrates.sliding_many(windows).items())):
+        x_sliding, y_sliding = reduce(means_sliding)
+        bitrate_sliding = scatter(
+            x=x_sliding,
+            y=y_sliding,
+            name="bitrate <br>(sliding - {}s)".format(window),
+            yaxis='y3',
+            mode="lines",
+            line=dict(
+                width=1,
+                color=colors[idx % len(colors)]
+            ),
+            hoverinfo="x+y",
+        )
+        # only the shortest window is filled, the others would hide it
+        if idx == 0:
+            bitrate_sliding.fill = "tonexty"
+            bitrate_sliding.fillcolor = "rgba(225,213,246,0.4)"
+        data.append(bitrate_sliding)
 
     return data
 
 def get_gop_data_from_stream(stream):
+    import plotly.graph_objs as go
+
     data = []
     gops = stream.gops
+    gop_table = stream.gop_table
 
     bars = [
         dict(closed=True, color='rgb(235, 188, 188)', label='Closed GOP'),
         dict(closed=False, color='rgb(234, 220, 190)', label='Open GOP'),
     ]
 
+    # keyframes mode without packet sizes
+    estimated = stream.gop_size_source in (GOP_SIZE_SOURCE_NAMES[GOP_SIZE_FRAGMENTS],
+                                           GOP_SIZE_SOURCE_NAMES[GOP_SIZE_POSITIONS])
+
     for bar in bars:
         # Bars for GOPs
-        goplist = list(filter(lambda g: g.closed == bar['closed'], gops))
+        indexes = np.flatnonzero(gop_table['closed'] == bar['closed'])
+        goplist = gop_table[indexes]
         gop_bar = go.Bar(
-            x=[gop.start_time for gop in goplist],
-            y=[gop.size for gop in goplist],
-            text=[gop.length for gop in goplist],
-            width=[gop.duration.total_seconds()*1000 for gop in goplist],
+            x=stream.start_times(goplist['start_pts']),
+            y=goplist['size'],
+            text=goplist['end'] - goplist['start'],
+            width=goplist['duration'] * 1000,
             offset=0,
-            name=bar['label'],
+            name=bar['label'] + (" (estimated size)" if estimated else ""),
             marker=dict(
                 color=bar['color'],
                 line=dict(
@@ -176,7 +262,7 @@ def get_gop_data_from_stream(stream):
             yaxis='y2',
             textposition='auto',
             hoverinfo="text",
-            hovertext=[gop.to_label() for gop in stream.gops],
+            hovertext=[gops[idx].to_label() for idx in indexes],
             legendgroup='gops'
         )
         data.append(gop_bar)
@@ -184,7 +270,159 @@ def get_gop_data_from_stream(stream):
     return data
 
 
-def plot_data(data, file, title, stream_label, track_label, resolution, formats):
+def read_ffprobe_response(args, cache=None):
+    key = None
+    if cache:
+        key = cache.key(args.path_to_file,
+                        tool=tool_version(args.ffprobe_exec),
+                        streams=args.streams,
+                        intervals=args.intervals,
+                        mode=args.mode,
+                        overview=[args.sample_duration, args.sample_spacing] if args.overview else None)
+        fresponse = cache.load_ffprobe(key)
+        if fresponse:
+            print("Using cached stream and frame information from {}".format(cache.directory))
+            return fresponse
+
+    # keyframes mode only decodes keyframes, which is fast enough without chunks or samples
+    if args.intervals or args.mode == 'keyframes':
+        ffprobe = FFProbeCommand(executable=args.ffprobe_exec,
+                                 filename=args.path_to_file,
+                                 intervals=args.intervals,
+                                 streams=args.streams,
+                                 mode=args.mode)
+    elif args.overview:
+        ffprobe = FFProbeSampledCommand(executable=args.ffprobe_exec,
+                                        filename=args.path_to_file,
+                                        streams=args.streams,
+                                        mode=args.mode,
+                                        workers=args.workers,
+                                        sample_duration=args.sample_duration,
+                                        sample_spacing=args.sample_spacing)
+    else:
+        ffprobe = FFProbeParallelCommand(executable=args.ffprobe_exec,
+                                         filename=args.path_to_file,
+                                         streams=args.streams,
+                                         mode=args.mode,
+                                         workers=args.workers)
+    fresponse = ffprobe.call()
+
+    if cache:
+        cache.store_ffprobe(key, fresponse)
+    return fresponse
+
+
+# one Stream per selected video stream, from a single probe
+def read_streams(args, cache=None, profiler=None):
+    # ffprobe's output is parsed while it is read
+    with stage(profiler, 'ffprobe'):
+        fresponse = read_ffprobe_response(args, cache)
+    with stage(profiler, 'streams'):
+        indexes = fresponse.get_video_stream_indexes()
+        if not indexes:
+            raise Exception("No video frames found in ffprobe response")
+        return [Stream(origin=fresponse, stream_index=index) for index in indexes]
+
+
+def read_track(args, cache=None, profiler=None):
+    with stage(profiler, 'mp4dump' if args.mp4_parser == 'mp4dump' else 'MP4 box parser'):
+        return _read_track(args, cache)
+
+
+def _read_track(args, cache=None):
+    key = None
+    track = MP4Track()
+    if cache:
+        key = cache.key(args.path_to_file,
+                        tool=tool_version(args.mp4dump_exec) if args.mp4_parser == 'mp4dump' else 'native')
+        if cache.load_track(key, track):
+            print("Using cached track and fragment information from {}".format(cache.directory))
+            return track
+
+    if args.mp4_parser == 'mp4dump':
+        mp4dump = MP4DumpCommand(executable=args.mp4dump_exec,
+                                 filename=args.path_to_file)
+        mresponse = mp4dump.call()
+    else:
+        mresponse = MP4BoxParser(filename=args.path_to_file)
+    track.create_from_parser(mresponse)
+
+    if cache:
+        cache.store_track(key, track)
+    return track
+
+
+# ffprobe and the MP4 parser read the file independently, so they run at the same time.
+# Models are built in the same threads, as soon as each tool is done.
+# Returns the streams and the track, or raises an exception listing the tools that failed.
+def read_streams_and_track(args, cache=None, profiler=None):
+    stages = [
+        ('ffprobe', read_streams),
+        ('mp4dump' if args.mp4_parser == 'mp4dump' else 'MP4 box parser', read_track),
+    ]
+
+    results = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        futures = {executor.submit(function, args, cache, profiler): name for name, function in stages}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                print("Error: {} failed on {}: {}".format(name, args.path_to_file, e))
+                errors[name] = e
+
+    # the error of each tool, eg. for the summary report of batch.py
+    if errors:
+        raise Exception("Cannot analyse {} ({})".format(args.path_to_file, "; ".join(
+            "{} failed: {}".format(name, errors[name]) for name, _ in stages if name in errors)))
+
+    streams, track = results[stages[0][0]], results[stages[1][0]]
+
+    # keyframes without packet sizes: GOP sizes from the fragments, rather than from the byte positions of the keyframes
+    for stream in streams:
+        if stream.keyframes_only and not (stream.gop_table['size_source'] == GOP_SIZE_PACKETS).all():
+            stream.set_gop_sizes_from_fragments(track)
+
+    return streams, track
+
+
+# all traces of the chart of a stream
+def get_chart_data(stream, track, windows, max_points=None, renderer='svg', interval=None, profiler=None):
+    data = []
+    with stage(profiler, 'frame traces', stream=stream.index):
+        data += get_frame_data_from_stream(stream, max_points=max_points, renderer=renderer)
+    with stage(profiler, 'bitrate traces', stream=stream.index):
+        data += get_bitrate_data_from_stream(stream, windows, max_points=max_points, renderer=renderer)
+    with stage(profiler, 'fragment traces', stream=stream.index):
+        # filtering necessary as mp4dump does not offer command line parameters for it
+        if (interval):
+            data += get_fragment_data_from_track(track,
+                                                 start_time=stream.frames[0].start_time,
+                                                 end_time=stream.frames[-1].end_time)
+        else:
+            data += get_fragment_data_from_track(track)
+    with stage(profiler, 'GOP traces', stream=stream.index):
+        data += get_gop_data_from_stream(stream)
+    return data
+
+
+# (start, end) datetimes of the parts of a stream that were not analysed, in a sampled overview
+def get_gaps_from_stream(stream):
+    if not stream.samples:
+        return []
+    ends = seconds_to_datetime64([end for _, end in stream.samples[:-1]]).tolist()
+    starts = seconds_to_datetime64([start for start, _ in stream.samples[1:]]).tolist()
+    return list(zip(ends, starts))
+
+
+def plot_data(data, file, title, time_range, stream_label, track_label, resolution, formats, auto_open=True,
+              refresh=None, gaps=(), html='standalone', compress=False):
+    import plotly
+    import plotly.graph_objs as go
+    import plotly.io as pio
+
     filename = os.path.basename(file)
 
     layout = go.Layout(
@@ -203,10 +441,7 @@ def plot_data(data, file, title, stream_label, track_label, resolution, formats)
                 size=12,
                 color='rgb(107, 107, 107)'
             ),
-            range=[
-                stream.frames[0].start_time,
-                stream.frames[-1].end_time
-            ]
+            range=list(time_range)
         ),
         yaxis=dict(
             domain=[0.30, 1],
@@ -272,6 +507,22 @@ def plot_data(data, file, title, stream_label, track_label, resolution, formats)
             x=1.06,
             traceorder="normal"
         ),
+        # grey areas over the gaps between samples
+        shapes=[
+            dict(
+                type='rect',
+                xref='x',
+                yref='paper',
+                x0=start,
+                x1=end,
+                y0=0,
+                y1=1,
+                fillcolor='rgb(200, 200, 200)',
+                opacity=0.5,
+                line=dict(width=0),
+                layer='above'
+            ) for start, end in gaps
+        ],
         annotations=[
             dict(
                 x=1.03,
@@ -323,20 +574,35 @@ def plot_data(data, file, title, stream_label, track_label, resolution, formats)
         ],
     )
 
-    if 'interactive' in formats:
-        print("Generating interactive HTML output to {}.html".format(args.path_to_file))
+    if 'interactive' in formats and html == 'compact':
+        html_file = write_compact_html(data, layout, "{}.html".format(file), title=filename, refresh=refresh,
+                                       compress=compress)
+        print("Generated compact interactive HTML output to {}".format(html_file))
+        if auto_open and not compress:
+            webbrowser.open('file://' + os.path.abspath(html_file))
+
+    elif 'interactive' in formats:
+        print("Generating interactive HTML output to {}.html".format(file))
         plotly.offline.plot({
             "data": data,
             "layout": layout
         },
-            auto_open=True,
+            auto_open=auto_open,
             filename="{}.html".format(file),
-            image_width=1000, image_height=600, image='svg'
+            image_width=1000, image_height=600, image='svg' if auto_open else None
         )
 
+        # page reloaded by the browser every few seconds, for charts that are regenerated (see live.py)
+        if refresh:
+            with open("{}.html".format(file)) as f:
+                page = f.read()
+            page = page.replace('<head>', '<head><meta http-equiv="refresh" content="{}" />'.format(refresh), 1)
+            with open("{}.html".format(file), 'w') as f:
+                f.write(page)
+
     for format in formats:
         if format != 'interactive':
-            print ("Generating {} output to {}.{}".format(format, args.path_to_file, format) )
+            print ("Generating {} output to {}.{}".format(format, file, format) )
             pio.write_image({
                 "data": data,
                 "layout": layout
@@ -347,72 +613,186 @@ def plot_data(data, file, title, stream_label, track_label, resolution, formats)
             )
 
 
-if __name__ == "__main__":
-    print(os.environ['PATH'])
-
-    parser = argparse.ArgumentParser(description='Chart generator (interactive and static) for video file analysis (frames, streams, fragments, gops, etc.)')
-    parser.add_argument('path_to_file', help='video file to parse')
+# options shared by vviz and batch analysis
+def add_analysis_arguments(parser):
     parser.add_argument('--ffprobe-exec', dest='ffprobe_exec',
                         help='ffprobe executable. (default: %(default)s)',
                         default='ffprobe')
     parser.add_argument('--mp4dump-exec', dest='mp4dump_exec',
                         help='mp4dump executable. (default: %(default)s)',
                         default='mp4dump')
+    parser.add_argument('--mp4-parser', dest='mp4_parser', choices=['native', 'mp4dump'],
+                        help='parse MP4 boxes in-process, or with mp4dump (default: %(default)s)',
+                        default='native')
     parser.add_argument('--intervals', dest='intervals',
                         help='interval to read from video file (see ffprobe -read_intervals parameter)')
+    parser.add_argument('--overview', dest='overview', action='store_true',
+                        help='only analyse short samples spread over the file (see --sample-duration and --sample-spacing)')
+    parser.add_argument('--sample-duration', dest='sample_duration', type=float,
+                        help='duration (in seconds) of each sample in overview mode (default: %(default)s)',
+                        default=10)
+    parser.add_argument('--sample-spacing', dest='sample_spacing', type=float,
+                        help='time (in seconds) between the starts of samples in overview mode (default: %(default)s)',
+                        default=300)
+    parser.add_argument('--mode', dest='mode', choices=MODES,
+                        help='read decoded frames, only packets (much faster, picture types are inferred), '
+                             'or only keyframes (fastest, for the GOP structure) (default: %(default)s)',
+                        default='frames')
+    parser.add_argument('--workers', dest='workers', type=int,
+                        help='number of ffprobe processes to run in parallel on chunks of the file (default: number of cores)',
+                        default=os.cpu_count())
     parser.add_argument('--streams', dest='streams',
-                        help='streams to read from video file (see ffprobe -select_streams parameter)',
+                        help='streams to read from video file (see ffprobe -select_streams parameter). '
+                             'A chart is generated for each selected video stream',
                         default='v:0')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                        help='always run the probes, and do not store their results in the cache')
+    parser.add_argument('--cache-dir', dest='cache_dir',
+                        help='directory for cached analysis results (default: ~/.cache/vviz)')
+    parser.add_argument('--cache-size', dest='cache_size', type=int,
+                        help='maximum size of the cache, in MB (default: %(default)s)',
+                        default=1000)
     parser.add_argument('-t', '--title', dest='title',
                         help='title for the chart (in addition to filename)',
                         default='Frame, GOP and Fragment Analysis')
-    parser.add_argument('-b', '--window', dest='window', type=float,
-                        help='size of the window (in seconds) used to calculate average bitrates',
-                        default=1.0)
+    parser.add_argument('-b', '--window', dest='window', type=float, nargs='+',
+                        help='size of the window(s) (in seconds) used to calculate average and peak bitrates',
+                        default=[1.0])
+    parser.add_argument('--max-points', dest='max_points', type=int,
+                        help='maximum number of points per frame type and bitrate line. Above it, P and B frames are '
+                             'aggregated in time bins (I and IDR frames are always shown). 0 to show all frames (default: %(default)s)',
+                        default=4000)
+    parser.add_argument('--renderer', choices=RENDERERS,
+                        help='draw frames and bitrates with SVG bars and lines, or with WebGL line segments '
+                             '(faster to pan and zoom with many frames) (default: %(default)s)',
+                        default='svg')
     parser.add_argument('-f', '--formats', dest='formats', nargs="*", choices=['interactive', 'svg', 'pdf', 'png', 'webp'],
                         help='1 or multiple output formats',
                         default=['interactive'])
     parser.add_argument('-r', '--resolution', dest='resolution', nargs=2, type=int,
                         help='resolution (width and height) for output images',
                         default=[1200, 600])
-
-    args = parser.parse_args()
-
-    filename = os.path.basename(args.path_to_file)
-
+    parser.add_argument('--html', dest='html', choices=HTML_MODES,
+                        help='interactive output with plotly.js and the data inlined, or compact: plotly.js in a '
+                             'file shared by the charts of a directory, and binary-encoded data (default: %(default)s)',
+                        default='standalone')
+    parser.add_argument('--gzip', dest='gzip', action='store_true',
+                        help='gzip compact interactive output (<chart file>.html.gz)')
+    parser.add_argument('--fragment-report', dest='fragment_report', choices=['csv', 'json'],
+                        help='also write the fragments with their frame statistics (frames by type, start on IDR, '
+                             'largest frame) to <chart file>.fragments.csv or .json')
+    parser.add_argument('--export', dest='export', choices=EXPORT_FORMATS,
+                        help='also write the frame, GOP and fragment tables as columnar files '
+                             '(<chart file>.frames.parquet, .gops.parquet and .fragments.parquet, or .arrow). '
+                             'Requires pyarrow')
+
+
+# rejects options that cannot be combined, rather than ignoring one of them
+def check_analysis_arguments(parser, args):
+    if args.overview and args.intervals:
+        parser.error("--overview cannot be combined with --intervals")
+    if args.overview and args.mode == 'keyframes':
+        parser.error("--overview cannot be combined with --mode keyframes")
+
+
+# one chart per video stream
+def chart_streams(streams, track, args, auto_open=True, refresh=None, profiler=None):
     interval = args.intervals if args.intervals else None
-    ffprobe = FFProbeCommand(executable=args.ffprobe_exec,
-                             filename=args.path_to_file,
-                             intervals=interval,
-                             streams=args.streams)
-    fresponse = ffprobe.call()
 
-    stream = Stream(origin=fresponse, stream_index=0)
+    for stream in streams:
+        file = args.path_to_file
+        title = args.title
+        if len(streams) > 1:
+            file = "{}.stream{}".format(args.path_to_file, stream.index)
+            title = "{} (stream {})".format(args.title, stream.index)
+
+        # test_pandas(stream.frames)
+
+        with stage(profiler, 'GOPs', stream=stream.index):
+            stream.gop_table
+        # frames of each fragment, for the hover texts (only keyframes were read in keyframes mode)
+        if not stream.keyframes_only:
+            with stage(profiler, 'frame/fragment join', stream=stream.index):
+                track.join_frames(stream)
+        if args.fragment_report:
+            report_file = "{}.fragments.{}".format(file, args.fragment_report)
+            write_report(fragment_rows(track), report_file, format=args.fragment_report)
+            print("Fragment report written to {}".format(report_file))
+        if args.export:
+            with stage(profiler, 'export', stream=stream.index):
+                files = export_analysis(stream, track, file, format=args.export)
+            print("Tables exported to {}".format(", ".join(files)))
+
+        data = get_chart_data(stream, track, args.window, max_points=args.max_points, renderer=args.renderer,
+                              interval=interval, profiler=profiler)
+
+        with stage(profiler, 'labels', stream=stream.index):
+            stream_label = stream.to_label(peak_windows=args.window)
+            track_label = track.to_label()
+
+        with stage(profiler, 'output', stream=stream.index):
+            plot_data(data,
+                      file,
+                      title=title,
+                      time_range=(stream.frames[0].start_time, stream.frames[-1].end_time),
+                      stream_label=stream_label,
+                      track_label=track_label,
+                      resolution=args.resolution,
+                      formats=args.formats,
+                      auto_open=auto_open,
+                      refresh=refresh,
+                      gaps=get_gaps_from_stream(stream),
+                      html=args.html,
+                      compress=args.gzip)
 
-    mp4dump = MP4DumpCommand(executable=args.mp4dump_exec,
-                             filename=args.path_to_file)
-    mresponse = mp4dump.call()
 
-    track = MP4Track(parser=mresponse)
+if __name__ == "__main__":
 
-    # test_pandas(stream.frames)
+    parser = argparse.ArgumentParser(description='Chart generator (interactive and static) for video file analysis (frames, streams, fragments, gops, etc.)')
+    parser.add_argument('path_to_file', help='video file to parse')
+    parser.add_argument('--report', dest='report', choices=REPORT_FORMATS,
+                        help='write stream, GOP, bitrate and fragment statistics instead of generating charts')
+    parser.add_argument('--report-file', dest='report_file',
+                        help='file for --report (default: standard output)')
+    parser.add_argument('--profile', dest='profile', action='store_true',
+                        help='measure the time, CPU and peak RSS of each stage of the analysis, and print a summary')
+    parser.add_argument('--profile-memory', dest='profile_memory', action='store_true',
+                        help='also measure the memory allocated by each stage (with tracemalloc, which slows the '
+                             'analysis down and skews times), implies --profile')
+    parser.add_argument('--profile-trace', dest='profile_trace',
+                        help='also write the stages to a trace file (Chrome trace event format), implies --profile')
+    add_analysis_arguments(parser)
 
-    data = []
-    data += get_frame_data_from_stream(stream)
-    data += get_bitrate_data_from_stream(stream, args.window)
-    # filtering necessary as mp4dump does not offer command line parameters for it
-    if (interval):
-        data += get_fragment_data_from_track(track,
-                                             start_time=stream.frames[0].start_time,
-                                             end_time=stream.frames[-1].end_time)
-    else:
-        data += get_fragment_data_from_track(track)
-    data += get_gop_data_from_stream(stream)
-
-    plot_data(data,
-              args.path_to_file,
-              title=args.title,
-              stream_label=stream.to_label(),
-              track_label=track.to_label(),
-              resolution=args.resolution,
-              formats=args.formats)
\ No newline at end of file
+    args = parser.parse_args()
+    check_analysis_arguments(parser, args)
+
+    cache = None if args.no_cache else AnalysisCache(directory=args.cache_dir, max_size=args.cache_size * 1000000)
+    profiler = Profiler(trace_memory=args.profile_memory) \
+        if args.profile or args.profile_memory or args.profile_trace else None
+
+    # progress messages go to stderr when the report is written to stdout
+    to_stdout = args.report and args.report_file in (None, '-')
+    with contextlib.redirect_stdout(sys.stderr if to_stdout else sys.stdout):
+        # ffprobe and the MP4 parser run in their own threads, and are measured as stages of the read stage
+        with stage(profiler, 'read'):
+            streams, track = read_streams_and_track(args, cache, profiler=profiler)
+
+        if args.report:
+            with stage(profiler, 'report'):
+                rows = analysis_rows(args.path_to_file, streams, track, peak_windows=args.window)
+        else:
+            chart_streams(streams, track, args, profiler=profiler)
+
+    if args.report:
+        write_report(rows, args.report_file, format=args.report)
+
+    if profiler:
+        profiler.count('frames', sum(len(stream.table) for stream in streams))
+        profiler.count('GOPs', sum(len(stream.gop_table) for stream in streams))
+        profiler.count('fragments', len(track.fragments))
+        with contextlib.redirect_stdout(sys.stderr if to_stdout else sys.stdout):
+            print()
+            print(profiler.summary())
+            if args.profile_trace:
+                profiler.write_trace(args.profile_trace)
+                print("Profile trace written to {}".format(args.profile_trace))